@@ -0,0 +1,158 @@
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class LatencyHistogram:
+    # Histograma de latencias con cubetas fijas; guarda las muestras para percentiles exactos dentro de un lote.
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def record(self, elapsed_ms):
+        with self.lock:
+            self.samples.append(elapsed_ms)
+
+    def percentile(self, pct):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+    def to_dict(self):
+        with self.lock:
+            samples = list(self.samples)
+        counts = {}
+        for bound in self.buckets_ms + [None]:
+            label = f"<={bound}" if bound is not None else f">{self.buckets_ms[-1]}"
+            counts[label] = 0
+        for sample in samples:
+            bound = next((b for b in self.buckets_ms if sample <= b), None)
+            counts[f"<={bound}" if bound is not None else f">{self.buckets_ms[-1]}"] += 1
+        return {
+            "count": len(samples),
+            "mean": round(sum(samples) / len(samples), 3) if samples else 0.0,
+            "p50": round(self.percentile(50), 3),
+            "p90": round(self.percentile(90), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(max(samples), 3) if samples else 0.0,
+            "buckets": {label: count for label, count in counts.items() if count},
+        }
+
+
+class RequestCoalescer:
+    # Ejecuta una sola vez cada clave dentro de un lote: las peticiones repetidas (en curso o ya resueltas)
+    # reciben el mismo resultado en lugar de repetir la llamada.
+    def __init__(self):
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def run(self, key, fn):
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+            else:
+                self.coalesced += 1
+        if owner:
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+        return future.result(), not owner
+
+    def __len__(self):
+        return len(self.futures)
+
+
+def run_bounded(items, worker, max_workers):
+    # Aplica `worker` a cada elemento con un pool acotado y devuelve los resultados en el orden de entrada.
+    if max_workers <= 1 or len(items) <= 1:
+        return [worker(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="agent-batch") as executor:
+        return list(executor.map(worker, items))
+
+
+def timed_node(name, node, histograms):
+    def run(state):
+        start = time.perf_counter()
+        try:
+            return node(state)
+        finally:
+            histograms[name].record((time.perf_counter() - start) * 1000)
+    return run
+
+
+class _StubMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class CorpusStubLLM:
+    # LLM simulado para reproducir transcripciones: responde la NLU con las etiquetas del corpus y la respuesta con un texto fijo.
+    NLU_MARKER = "Analiza esta consulta:"
+
+    def __init__(self, labels, latency_ms=0.0):
+        self.labels = labels
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def invoke(self, messages):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency_ms / 1000.0)
+        last = str(messages[-1].content)
+        if last.startswith(self.NLU_MARKER):
+            intent, entities = self.labels.get(last[len(self.NLU_MARKER):].strip(), ("otra", {}))
+            return _StubMessage(json.dumps({"intent": intent, "entities": entities}, ensure_ascii=False))
+        return _StubMessage("Tengo algunas opciones para ti. ¿Quieres que te cuente más?")
+
+    def stream(self, messages):
+        yield self.invoke(messages)
+
+
+def load_transcripts(path):
+    # Acepta una lista JSON (como nlu_fast_path_corpus.json) o JSONL con un objeto o string por línea.
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+    try:
+        items = json.loads(raw)
+    except json.JSONDecodeError:
+        items = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    return [item if isinstance(item, dict) else {"input": item} for item in items]
+
+
+if __name__ == '__main__':
+    # Reproduce transcripciones contra el grafo con un LLM simulado: python agent_batch.py [corpus] [workers] [repeticiones] [latencia_llm_ms]
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, "nlu_fast_path_corpus.json")
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    llm_latency_ms = float(sys.argv[4]) if len(sys.argv) > 4 else 50.0
+    os.environ.setdefault("AGENT_CACHE_MAX_ENTRIES", "0")
+    os.chdir(base_dir)
+
+    import lambda_function
+    transcripts = load_transcripts(corpus_path)
+    labels = {item["input"]: (item["intent"], item.get("entities", {})) for item in transcripts if "intent" in item}
+    utterances = [item.get("input") or item.get("text") for item in transcripts] * repeats
+    for max_workers, dedupe in ((1, False), (workers, False), (workers, True)):
+        lambda_function.llm = CorpusStubLLM(labels, llm_latency_ms)
+        batch = lambda_function.run_agent_batch(utterances, max_workers=max_workers, dedupe_nlu=dedupe)
+        stats = batch["stats"]
+        mismatches = sum(1 for result in batch["results"] if result.get("inputText") in labels and
+                         result.get("intent") != labels[result["inputText"]][0])
+        print(f"workers={max_workers:>2} dedupe={'sí' if dedupe else 'no':>2}: {stats['utterances']} frases en {stats['elapsed_ms']:.0f}ms "
+              f"({stats['throughput_per_s']:.1f}/s), llamadas LLM={lambda_function.llm.calls}, NLU deduplicadas={stats['nlu_deduplicated']}, "
+              f"intenciones distintas a la etiqueta={mismatches}")
+        for node, histogram in stats["latency_ms"].items():
+            print(f"    {node:>26}: p50={histogram['p50']}ms p90={histogram['p90']}ms p99={histogram['p99']}ms max={histogram['max']}ms")
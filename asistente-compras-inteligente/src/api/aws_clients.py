@@ -0,0 +1,271 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from cold_start import lazy_import
+from instrumentation import increment, instrument_boto_client
+
+AWS_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("AWS_CONNECT_TIMEOUT_SECONDS", "2"))
+AWS_READ_TIMEOUT_SECONDS = float(os.environ.get("AWS_READ_TIMEOUT_SECONDS", "10"))
+BEDROCK_READ_TIMEOUT_SECONDS = float(os.environ.get("BEDROCK_READ_TIMEOUT_SECONDS", "20"))
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "16"))
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "3"))
+AWS_RETRY_MODE = os.environ.get("AWS_RETRY_MODE", "adaptive")
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+AGENT_LATENCY_BUDGET_SECONDS = float(os.environ.get("AGENT_LATENCY_BUDGET_SECONDS", "25"))
+LAMBDA_TIMEOUT_MARGIN_SECONDS = float(os.environ.get("LAMBDA_TIMEOUT_MARGIN_SECONDS", "1"))
+BUDGET_MAX_ABANDONED_CALLS = int(os.environ.get("BUDGET_MAX_ABANDONED_CALLS", str(AWS_MAX_POOL_CONNECTIONS)))
+
+# (conexión, lectura) en segundos por servicio; Bedrock genera texto y necesita más margen de lectura.
+SERVICE_TIMEOUTS = {
+    "s3": (AWS_CONNECT_TIMEOUT_SECONDS, AWS_READ_TIMEOUT_SECONDS),
+    "transcribe": (AWS_CONNECT_TIMEOUT_SECONDS, AWS_READ_TIMEOUT_SECONDS),
+    "polly": (AWS_CONNECT_TIMEOUT_SECONDS, AWS_READ_TIMEOUT_SECONDS),
+    "bedrock-runtime": (AWS_CONNECT_TIMEOUT_SECONDS, BEDROCK_READ_TIMEOUT_SECONDS),
+    "http": (AWS_CONNECT_TIMEOUT_SECONDS, AWS_READ_TIMEOUT_SECONDS),
+}
+
+_REQUEST_DEADLINE = contextvars.ContextVar("request_deadline", default=None)
+# Hilos para las llamadas en curso más las abandonadas por el presupuesto, que siguen ocupando un hilo hasta que
+# vence el read_timeout del cliente: con el límite de abandonadas siempre quedan hilos libres para las nuevas.
+_BUDGET_EXECUTOR = ThreadPoolExecutor(max_workers=AWS_MAX_POOL_CONNECTIONS + BUDGET_MAX_ABANDONED_CALLS, thread_name_prefix="latency-budget")
+_ABANDONED_CALLS = 0
+_ABANDONED_LOCK = threading.Lock()
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class ClientFactory:
+    # Crea los clientes de AWS desde una sola sesión de boto3 (credenciales resueltas una vez) con pool de conexiones
+    # keep-alive, timeouts por servicio y reintentos adaptativos de botocore.
+    def __init__(self, region_name, endpoint_urls=None, max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+                 max_attempts=AWS_MAX_ATTEMPTS, retry_mode=AWS_RETRY_MODE, timeouts=None):
+        self.region_name = region_name
+        self.endpoint_urls = endpoint_urls or {}
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self.retry_mode = retry_mode
+        self.timeouts = dict(SERVICE_TIMEOUTS, **(timeouts or {}))
+        self.session = None
+        self.lock = threading.Lock()
+
+    def config(self, service_name):
+        connect_timeout, read_timeout = self.timeouts.get(service_name, self.timeouts["http"])
+        return lazy_import("botocore.config").Config(
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            max_pool_connections=self.max_pool_connections,
+            tcp_keepalive=True,
+            retries={"mode": self.retry_mode, "total_max_attempts": self.max_attempts},
+        )
+
+    def client(self, service_name):
+        with self.lock:
+            if self.session is None:
+                self.session = lazy_import("boto3").session.Session(region_name=self.region_name)
+        client = self.session.client(service_name, config=self.config(service_name),
+                                     endpoint_url=self.endpoint_urls.get(service_name))
+        return instrument_boto_client(client)
+
+
+def build_http_session(pool_maxsize=AWS_MAX_POOL_CONNECTIONS, max_retries=HTTP_MAX_RETRIES):
+    # Sesión de requests con conexiones reutilizables y reintentos con backoff solo para GET idempotentes.
+    requests = lazy_import("requests")
+    retry = lazy_import("urllib3.util.retry").Retry(
+        total=max_retries, connect=max_retries, read=max_retries, backoff_factor=0.2,
+        status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset({"GET", "HEAD"}),
+    )
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def lambda_budget_seconds(context, budget_seconds=AGENT_LATENCY_BUDGET_SECONDS):
+    # El presupuesto nunca supera el tiempo que le queda a la invocación menos un margen para responder.
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining is None:
+        return budget_seconds
+    return max(0.0, min(budget_seconds, get_remaining() / 1000.0 - LAMBDA_TIMEOUT_MARGIN_SECONDS))
+
+
+def start_request_budget(seconds):
+    # Fija el plazo de la petición en curso (None lo desactiva); devuelve el token para end_request_budget.
+    return _REQUEST_DEADLINE.set(time.monotonic() + seconds if seconds is not None else None)
+
+
+def end_request_budget(token):
+    _REQUEST_DEADLINE.reset(token)
+
+
+@contextmanager
+def request_budget(seconds):
+    token = start_request_budget(seconds)
+    try:
+        yield
+    finally:
+        end_request_budget(token)
+
+
+def budget_remaining():
+    deadline = _REQUEST_DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def abandoned_calls():
+    return _ABANDONED_CALLS
+
+
+def _release_abandoned(future):
+    global _ABANDONED_CALLS
+    with _ABANDONED_LOCK:
+        _ABANDONED_CALLS -= 1
+
+
+def call_within_budget(name, fn, *args):
+    # Sin presupuesto activo llama directamente. Con presupuesto, si la llamada no termina a tiempo lanza
+    # BudgetExceeded; el hilo sigue hasta que vence el read_timeout del cliente, pero la invocación no lo espera.
+    # Con BUDGET_MAX_ABANDONED_CALLS llamadas así todavía en curso el servicio no responde: se degrada sin llamar.
+    global _ABANDONED_CALLS
+    remaining = budget_remaining()
+    if remaining is None:
+        return fn(*args)
+    if remaining <= 0:
+        increment(f"budget.{name}.exceeded")
+        raise BudgetExceeded(f"Presupuesto de latencia agotado antes de '{name}'.")
+    if _ABANDONED_CALLS >= BUDGET_MAX_ABANDONED_CALLS:
+        increment(f"budget.{name}.saturated")
+        raise BudgetExceeded(f"{_ABANDONED_CALLS} llamadas fuera de presupuesto siguen en curso; se omite '{name}'.")
+    future = _BUDGET_EXECUTOR.submit(fn, *args)
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeoutError:
+        increment(f"budget.{name}.exceeded")
+        with _ABANDONED_LOCK:
+            _ABANDONED_CALLS += 1
+        future.add_done_callback(_release_abandoned)
+        raise BudgetExceeded(f"'{name}' superó el presupuesto de latencia ({remaining:.2f}s restantes).")
+
+
+def iter_within_budget(name, iterable):
+    # Aplica el presupuesto a cada fragmento de un stream (p. ej. tokens de Bedrock).
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = call_within_budget(name, next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def _run_stub_server(delay_seconds):
+    # Servidor HTTP local que responde tras `delay_seconds` y cuenta las conexiones TCP distintas que recibe.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    connections = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _reply(self):
+            connections.add(self.client_address)
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            time.sleep(self.server.delay_seconds)
+            if self.command == "GET":
+                payload = {"results": {"transcripts": [{"transcript": "hola"}]}}
+            else:
+                payload = {"inputTextTokenCount": 1, "results": [{"tokenCount": 4, "outputText": "Respuesta del stub.", "completionReason": "FINISH"}]}
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            # Los clientes cortan la conexión al vencer su timeout: no es un error del stub.
+            pass
+
+    server = Server(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.delay_seconds = delay_seconds
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, connections
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+if __name__ == '__main__':
+    # Simula endpoints lentos en local: python aws_clients.py [peticiones] [retardo_lento_s]
+    requests_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    slow_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+    requests = lazy_import("requests")
+
+    server, connections = _run_stub_server(0.005)
+    url = f"http://127.0.0.1:{server.server_port}/transcript.json"
+    pooled = build_http_session()
+    for label, get in (("requests.get sin sesión", requests.get), ("sesión con pool", pooled.get)):
+        connections.clear()
+        samples = []
+        for _ in range(requests_count):
+            start = time.perf_counter()
+            get(url, timeout=SERVICE_TIMEOUTS["http"]).json()
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"{label:>24}: {len(connections)} conexiones TCP para {requests_count} GET, p50={_percentile(samples, 50):.1f}ms p99={_percentile(samples, 99):.1f}ms")
+
+    server.delay_seconds = slow_seconds
+    connections.clear()
+    start = time.perf_counter()
+    try:
+        pooled.get(url, timeout=(AWS_CONNECT_TIMEOUT_SECONDS, 0.5))
+    except requests.exceptions.RequestException as e:
+        print(f"GET de transcripción con read timeout 0.5s y endpoint de {slow_seconds}s: {type(e).__name__} en "
+              f"{time.perf_counter() - start:.2f}s tras {len(connections)} intentos")
+
+    bedrock_read_timeout, budget = 1.0, 1.5
+    factory = ClientFactory("us-east-1", endpoint_urls={"bedrock-runtime": f"http://127.0.0.1:{server.server_port}"},
+                            timeouts={"bedrock-runtime": (AWS_CONNECT_TIMEOUT_SECONDS, bedrock_read_timeout)})
+    bedrock = factory.client("bedrock-runtime")
+    invoke = lambda: bedrock.invoke_model(modelId="amazon.titan-text-express-v1", body=json.dumps({"inputText": "hola"}))
+    for delay in (0.05, slow_seconds):
+        server.delay_seconds = delay
+        start = time.perf_counter()
+        try:
+            invoke()
+            outcome = "ok"
+        except Exception as e:
+            outcome = type(e).__name__
+        unbounded = time.perf_counter() - start
+        start = time.perf_counter()
+        with request_budget(budget):
+            try:
+                call_within_budget("llm.stub", invoke)
+                budget_outcome = "ok"
+            except BudgetExceeded:
+                budget_outcome = "respuesta degradada"
+        print(f"Bedrock con retardo {delay}s: sin presupuesto {outcome} en {unbounded:.2f}s "
+              f"({AWS_MAX_ATTEMPTS} intentos, read timeout {bedrock_read_timeout}s); "
+              f"con presupuesto de {budget}s: {budget_outcome} en {time.perf_counter() - start:.2f}s")
+    server.shutdown()
@@ -0,0 +1,644 @@
+import heapq
+import math
+import re
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from functools import cached_property
+
+from text_matching import normalize_key, best_candidate, TrigramIndex
+
+NGRAM_SIZE = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+TOKEN_PATTERN = re.compile(r"\w+")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+THOUSANDS_PATTERN = re.compile(r"\d{1,3}(?:([.,])\d{3})(?:\1\d{3})*")
+RANKING_ENTITIES = ["categoria", "marca", "nombre_producto", "tamaño", "caracteristicas_adicionales"]
+
+
+def tokenize(text):
+    return normalize_key(text).split()
+
+
+def ngrams(text, size=NGRAM_SIZE):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def parse_price(value):
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER_PATTERN.search(str(value))
+    if not match:
+        return None
+    number = match.group(0)
+    if THOUSANDS_PATTERN.fullmatch(number):
+        number = number.replace(",", "").replace(".", "")
+    elif "," in number and "." in number:
+        decimal_separator = max(",", ".", key=number.rfind)
+        thousands_separator = "." if decimal_separator == "," else ","
+        number = number.replace(thousands_separator, "").replace(decimal_separator, ".")
+    else:
+        number = number.replace(",", ".")
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def _numeric(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _field_text(product, key):
+    # Las claves normalizadas se calculan una vez por valor distinto (normalize_key está memorizada).
+    value = product.get(key)
+    return normalize_key(value) if value is not None else ""
+
+
+def find_duplicate_ids(products):
+    # Ids repetidos: con ellos las sesiones, el carrito y los deltas por id no sabrían a qué producto se refieren.
+    seen, duplicates = set(), set()
+    for product in products:
+        product_id = product.get("id")
+        if product_id in seen:
+            duplicates.add(product_id)
+        seen.add(product_id)
+    return sorted(duplicates, key=str)
+
+
+def _product_entries(product):
+    # Claves que un producto aporta a cada estructura del índice; un dict vacío (producto borrado) no aporta nada.
+    if not product:
+        return {"categoria": set(), "marca": set(), "nombre": set(), "caracteristicas": set(), "colores": set(),
+                "tallas": set(), "terms": Counter()}
+    caracteristicas = product.get("caracteristicas", []) or []
+    terms = tokenize(product.get("nombre", "")) + tokenize(product.get("categoria", "")) + tokenize(product.get("marca", ""))
+    for caracteristica in caracteristicas:
+        terms += tokenize(caracteristica)
+    return {
+        "categoria": {_field_text(product, "categoria")},
+        "marca": {_field_text(product, "marca")},
+        "nombre": {_field_text(product, "nombre")},
+        "caracteristicas": {normalize_key(caracteristica) for caracteristica in caracteristicas},
+        "colores": {normalize_key(color) for color in product.get("colores", []) or []},
+        "tallas": {normalize_key(talla) for talla in product.get("tallas_disponibles", []) or []},
+        "terms": Counter(terms),
+    }
+
+
+class _PatchedSequence:
+    # Secuencia de solo lectura = base (lista o columnas del snapshot) + posiciones reemplazadas o añadidas.
+    # Cada delta crea una nueva sin copiar la base; los parches se aplanan para no encadenar capas.
+    def __init__(self, base, patches, length):
+        if isinstance(base, _PatchedSequence):
+            base, patches = base.base, {**base.patches, **patches}
+        self.base = base
+        self.patches = patches
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if position in self.patches:
+            return self.patches[position]
+        if not 0 <= position < len(self.base):
+            raise IndexError(position)
+        return self.base[position]
+
+    def __iter__(self):
+        for position in range(self.length):
+            yield self[position]
+
+    def iter_fields(self, fields):
+        base_items = self.base.iter_fields(fields) if hasattr(self.base, "iter_fields") else iter(self.base)
+        for position, item in enumerate(base_items):
+            if position in self.patches:
+                item = {key: value for key, value in self.patches[position].items() if key in fields}
+            yield item
+        for position in range(len(self.base), self.length):
+            yield {key: value for key, value in self.patches[position].items() if key in fields}
+
+
+class _PatchedMapping:
+    # Mapeo de solo lectura (clave -> filas) = base + claves reemplazadas; una clave sin filas cuenta como ausente.
+    def __init__(self, base, patches):
+        if isinstance(base, _PatchedMapping):
+            base, patches = base.base, {**base.patches, **patches}
+        self.base = base
+        self.patches = patches
+
+    def get(self, key, default=None):
+        if key in self.patches:
+            return self.patches[key] or default
+        return self.base.get(key, default)
+
+    def __contains__(self, key):
+        return bool(self.patches[key]) if key in self.patches else key in self.base
+
+    def keys(self):
+        return {key for key in self.base.keys() if key not in self.patches} | {key for key, rows in self.patches.items() if rows}
+
+    def __len__(self):
+        return len(self.keys())
+
+
+def _patched_column(values, rows, changes):
+    # Columna ordenada (valor, fila) con los cambios {fila: (valor anterior, valor nuevo)} aplicados con bisect.
+    values, rows = list(values), list(rows)
+    for row, (old, new) in changes.items():
+        if old is not None:
+            position = bisect_left(values, old)
+            while rows[position] != row:
+                position += 1
+            del values[position], rows[position]
+        if new is not None:
+            position = bisect_right(values, new)
+            values.insert(position, new)
+            rows.insert(position, row)
+    return values, rows
+
+
+class FieldIndex:
+    # Valores distintos de un campo de texto -> filas, con postings de n-gramas
+    # sobre los valores para resolver búsquedas por subcadena sin recorrer el catálogo.
+    def __init__(self):
+        self.values = []
+        self.value_ids = {}
+        self.value_rows = []
+        self.grams = defaultdict(set)
+
+    def add(self, value, row):
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            self.value_ids[value] = value_id
+            self.values.append(value)
+            self.value_rows.append(set())
+            for gram in ngrams(value):
+                self.grams[gram].add(value_id)
+        self.value_rows[value_id].add(row)
+
+    def _rows_for(self, value_ids):
+        rows = set()
+        for value_id in value_ids:
+            rows |= self.value_rows[value_id]
+        return rows
+
+    def rows_containing(self, query):
+        if len(query) < NGRAM_SIZE:
+            candidates = range(len(self.values))
+        else:
+            postings = sorted((self.grams.get(gram, set()) for gram in ngrams(query)), key=len)
+            candidates = set.intersection(*postings) if postings else set()
+        return self._rows_for(v for v in candidates if query in self.values[v])
+
+    def rows_contained_in(self, query):
+        return self._rows_for(v for v, value in enumerate(self.values) if len(value) <= len(query) and value in query)
+
+    def with_changes(self, removed, added):
+        # Copia con las filas quitadas/añadidas por valor ({valor: filas}); comparte con la original todo lo que no
+        # cambia, también si esta viene del snapshot (valores y postings de solo lectura).
+        updated = FieldIndex.__new__(FieldIndex)
+        updated.values = list(self.values)
+        updated.value_ids = dict(self.value_ids) if self.value_ids is not None else {value: i for i, value in enumerate(updated.values)}
+        row_patches, gram_patches = {}, {}
+
+        def patch_rows(value_id):
+            if value_id not in row_patches:
+                row_patches[value_id] = set(self.value_rows[value_id]) if value_id < len(self.values) else set()
+            return row_patches[value_id]
+
+        def patch_grams(value):
+            for gram in ngrams(value):
+                if gram not in gram_patches:
+                    gram_patches[gram] = set(self.grams.get(gram, ()))
+                yield gram_patches[gram]
+
+        for value, rows in removed.items():
+            patch_rows(updated.value_ids[value]).difference_update(rows)
+        for value, rows in added.items():
+            value_id = updated.value_ids.get(value)
+            if value_id is None:
+                value_id = updated.value_ids[value] = len(updated.values)
+                updated.values.append(value)
+            patch_rows(value_id).update(rows)
+        for value_id, rows in row_patches.items():
+            # Los valores que se quedan sin filas salen de los n-gramas (no se sugieren en las correcciones).
+            for postings in patch_grams(updated.values[value_id]):
+                (postings.add if rows else postings.discard)(value_id)
+        updated.value_rows = _PatchedSequence(self.value_rows, row_patches, len(updated.values))
+        updated.grams = _PatchedMapping(self.grams, gram_patches)
+        return updated
+
+    def most_similar(self, query):
+        # Valor más parecido a una consulta sin coincidencias (errores de transcripción); solo se evalúan los
+        # valores que comparten n-gramas con ella.
+        query_grams = ngrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self.grams.get(gram, ()))
+        value_id = best_candidate(query, len(query_grams), shared, self.values.__getitem__, lambda v: len(ngrams(self.values[v])))
+        return self.values[value_id] if value_id is not None else None
+
+
+class CatalogIndex:
+    def __init__(self, products):
+        self.products = list(products)
+        self.categoria = FieldIndex()
+        self.marca = FieldIndex()
+        self.nombre = FieldIndex()
+        self.caracteristicas = FieldIndex()
+        self.colores = defaultdict(set)
+        self.tallas = defaultdict(set)
+        self.term_postings = defaultdict(dict)
+        self.doc_lengths = []
+        for row, product in enumerate(self.products):
+            self._index_product(row, product)
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        self._build_numeric_columns()
+
+    def _build_numeric_columns(self):
+        # Columnas ordenadas (valor, fila) para resolver rangos con bisect en lugar de revisar cada producto.
+        priced = sorted((price, row) for row, price in ((row, _numeric(p.get("precio"))) for row, p in enumerate(self.products)) if price is not None)
+        self.price_values = [price for price, _ in priced]
+        self.price_rows = [row for _, row in priced]
+        stocked = sorted((stock, row) for row, stock in ((row, _numeric(p.get("stock"))) for row, p in enumerate(self.products)) if stock is not None)
+        self.stock_values = [stock for stock, _ in stocked]
+        self.stock_rows = [row for _, row in stocked]
+
+    def _index_product(self, row, product):
+        entries = _product_entries(product)
+        for name in ("categoria", "marca", "nombre", "caracteristicas"):
+            field = getattr(self, name)
+            for value in entries[name]:
+                field.add(value, row)
+        for name in ("colores", "tallas"):
+            postings = getattr(self, name)
+            for value in entries[name]:
+                postings[value].add(row)
+        for term, count in entries["terms"].items():
+            self.term_postings[term][row] = count
+        self.doc_lengths.append(sum(entries["terms"].values()))
+
+    def __len__(self):
+        return len(self.products)
+
+    def rows_in_price_range(self, precio_minimo=None, precio_maximo=None, rows=None):
+        # Con `rows` (las filas que ya cumplen las demás entidades) se recorre lo más corto: el tramo de la columna
+        # ordenada entre los límites o esas filas comprobando su precio. Sin `rows` se devuelve el tramo entero.
+        start = bisect_left(self.price_values, precio_minimo) if precio_minimo is not None else 0
+        end = bisect_right(self.price_values, precio_maximo) if precio_maximo is not None else len(self.price_values)
+        if rows is None:
+            return set(self.price_rows[start:end])
+        if end - start <= len(rows):
+            return rows.intersection(self.price_rows[start:end])
+        minimo = precio_minimo if precio_minimo is not None else -math.inf
+        maximo = precio_maximo if precio_maximo is not None else math.inf
+        prices = ((row, _numeric(self.products[row].get("precio"))) for row in rows)
+        return {row for row, price in prices if price is not None and minimo <= price <= maximo}
+
+    def rows_in_stock(self, rows):
+        # Filtra las filas ya encontradas en lugar de materializar todas las filas con stock del catálogo.
+        return {row for row in rows if self.in_stock(row)}
+
+    def match_rows(self, entities):
+        # Misma semántica que el filtro estricto original: cada entidad presente debe coincidir.
+        constraints = []
+        entity_categoria = normalize_key(entities.get("categoria", ""))
+        if entity_categoria:
+            constraints.append(self.categoria.rows_containing(entity_categoria) | self.categoria.rows_contained_in(entity_categoria))
+        entity_marca = normalize_key(entities.get("marca", ""))
+        if entity_marca:
+            constraints.append(self.marca.rows_containing(entity_marca))
+        entity_nombre_producto = normalize_key(entities.get("nombre_producto", ""))
+        if entity_nombre_producto:
+            constraints.append(self.nombre.rows_containing(entity_nombre_producto))
+        entity_tamano = str(entities.get("tamaño", "")).lower()
+        if entity_tamano:
+            tamano_numerico_entidad = "".join(filter(str.isdigit, entity_tamano))
+            if tamano_numerico_entidad:
+                constraints.append(self.nombre.rows_containing(tamano_numerico_entidad) | self.caracteristicas.rows_containing(tamano_numerico_entidad))
+            else:
+                constraints.append(set())
+        entity_color = normalize_key(entities.get("color", ""))
+        if entity_color:
+            constraints.append(self.colores.get(entity_color, set()))
+        entity_talla = normalize_key(entities.get("talla", ""))
+        if entity_talla:
+            constraints.append(self.tallas.get(entity_talla, set()))
+        precio_minimo = parse_price(entities.get("precio_minimo"))
+        precio_maximo = parse_price(entities.get("precio_maximo"))
+        has_price = precio_minimo is not None or precio_maximo is not None
+        if not constraints:
+            return self.rows_in_price_range(precio_minimo, precio_maximo) if has_price else set()
+        constraints.sort(key=len)
+        rows = set.intersection(*constraints)
+        # El rango de precio se aplica sobre las filas ya filtradas, sin copiar la columna de precios completa.
+        return self.rows_in_price_range(precio_minimo, precio_maximo, rows) if has_price and rows else rows
+
+    @cached_property
+    def color_keys(self):
+        return TrigramIndex(self.colores.keys())
+
+    @cached_property
+    def term_keys(self):
+        # Vocabulario del ranking; se indexa por trigramas la primera vez que un nombre de producto no coincide.
+        return TrigramIndex(self.term_postings.keys())
+
+    def _correct_words(self, query):
+        words = [word if word in self.term_postings else (self.term_keys.lookup(word) or word) for word in query.split()]
+        candidate = " ".join(words)
+        return candidate if candidate != query and self.nombre.rows_containing(candidate) else None
+
+    def correct_entities(self, entities):
+        # Sustituye las entidades de texto sin ninguna coincidencia exacta por el valor más parecido del catálogo
+        # ("supervison" -> "supervision"). Devuelve (entidades, correcciones aplicadas).
+        corrected = dict(entities)
+        corrections = {}
+        for key, field, contained in (("categoria", self.categoria, True), ("marca", self.marca, False)):
+            query = normalize_key(entities.get(key) or "")
+            if not query or field.rows_containing(query) or (contained and field.rows_contained_in(query)):
+                continue
+            match = field.most_similar(query)
+            if match is not None:
+                corrected[key] = corrections[key] = match
+        # Los nombres son largos y casi únicos: se corrige palabra a palabra contra el vocabulario en lugar de
+        # sustituir la consulta por el nombre completo de un producto.
+        nombre = normalize_key(entities.get("nombre_producto") or "")
+        if nombre and not self.nombre.rows_containing(nombre):
+            match = self._correct_words(nombre)
+            if match is not None:
+                corrected["nombre_producto"] = corrections["nombre_producto"] = match
+        color = normalize_key(entities.get("color") or "")
+        if color and color not in self.colores:
+            match = self.color_keys.lookup(color)
+            if match is not None:
+                corrected["color"] = corrections["color"] = match
+        return corrected, corrections
+
+    def rank_rows(self, rows, entities, limit=None):
+        query_terms = []
+        for key in RANKING_ENTITIES:
+            if entities.get(key):
+                query_terms += tokenize(entities[key])
+        scores = dict.fromkeys(rows, 0.0)
+        total_docs = len(self.products)
+        for term in set(query_terms):
+            postings = self.term_postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            smaller, larger = (scores, postings) if len(scores) <= len(postings) else (postings, scores)
+            for row in smaller:
+                if row not in larger:
+                    continue
+                tf = postings[row]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[row] / (self.avg_doc_length or 1))
+                scores[row] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if limit is not None:
+            return heapq.nsmallest(limit, rows, key=lambda row: (-scores[row], row))
+        return sorted(rows, key=lambda row: (-scores[row], row))
+
+    @cached_property
+    def row_by_id(self):
+        # Id de producto -> fila; se construye la primera vez que una sesión lo necesita. Ante ids repetidos gana la primera fila.
+        iter_fields = getattr(self.products, "iter_fields", None)
+        row_by_id = {}
+        for row, product in enumerate(iter_fields({"id"}) if iter_fields else self.products):
+            row_by_id.setdefault(product.get("id"), row)
+        return row_by_id
+
+    def apply_delta(self, upserts=(), deleted_ids=()):
+        # Nueva versión del índice con productos añadidos o reemplazados (por id) y borrados; la actual no se modifica,
+        # así las consultas en curso terminan sobre una versión coherente. Solo se recalculan las filas afectadas:
+        # un producto reemplazado conserva su fila, uno nuevo se añade al final y uno borrado queda como {} sin
+        # entradas en el índice. Devuelve (índice, {"added", "updated", "deleted"}).
+        upserts = list(upserts)
+        duplicates = find_duplicate_ids(upserts)
+        if duplicates:
+            raise ValueError(f"Ids repetidos en el delta: {duplicates}")
+        row_by_id = dict(self.row_by_id)
+        base_count = len(self.products)
+        new_products = {}
+        stats = {"added": 0, "updated": 0, "deleted": 0}
+        for product in upserts:
+            product_id = product.get("id")
+            if product_id is None:
+                raise ValueError("Producto sin 'id' en el delta.")
+            row = row_by_id.get(product_id)
+            if row is None:
+                row = row_by_id[product_id] = base_count + stats["added"]
+                stats["added"] += 1
+            else:
+                stats["updated"] += 1
+            new_products[row] = product
+        for product_id in deleted_ids:
+            row = row_by_id.pop(product_id, None)
+            if row is not None:
+                new_products[row] = {}
+                stats["deleted"] += 1
+        count = base_count + stats["added"]
+
+        updated = CatalogIndex.__new__(CatalogIndex)
+        field_changes = {name: ({}, {}) for name in ("categoria", "marca", "nombre", "caracteristicas")}
+        set_patches = {"colores": {}, "tallas": {}}
+        term_patches = {}
+        length_patches = {}
+        numeric_changes = {"precio": {}, "stock": {}}
+        total_length = self.avg_doc_length * len(self.doc_lengths)
+        for row, product in new_products.items():
+            old_product = self.products[row] if row < base_count else {}
+            old, new = _product_entries(old_product), _product_entries(product)
+            for name, (removed, added) in field_changes.items():
+                for value in old[name] - new[name]:
+                    removed.setdefault(value, set()).add(row)
+                for value in new[name] - old[name]:
+                    added.setdefault(value, set()).add(row)
+            for name, patches in set_patches.items():
+                postings = getattr(self, name)
+                for value in old[name] ^ new[name]:
+                    rows = patches.setdefault(value, set(postings.get(value, ())))
+                    (rows.add if value in new[name] else rows.discard)(row)
+            if old["terms"] != new["terms"]:
+                for term in old["terms"].keys() | new["terms"].keys():
+                    postings = term_patches.setdefault(term, dict(self.term_postings.get(term) or {}))
+                    if term in new["terms"]:
+                        postings[row] = new["terms"][term]
+                    else:
+                        postings.pop(row, None)
+            new_length = sum(new["terms"].values())
+            old_length = self.doc_lengths[row] if row < base_count else 0
+            if row >= base_count or new_length != old_length:
+                length_patches[row] = new_length
+                total_length += new_length - old_length
+            for field, changes in numeric_changes.items():
+                old_value, new_value = _numeric(old_product.get(field)), _numeric(product.get(field))
+                if old_value != new_value or row >= base_count:
+                    changes[row] = (old_value, new_value)
+
+        if isinstance(self.products, list):
+            updated.products = list(self.products) + [None] * stats["added"]
+            for row, product in new_products.items():
+                updated.products[row] = product
+        else:
+            updated.products = _PatchedSequence(self.products, new_products, count)
+        for name, (removed, added) in field_changes.items():
+            field = getattr(self, name)
+            setattr(updated, name, field.with_changes(removed, added) if removed or added else field)
+        for name, patches in set_patches.items():
+            setattr(updated, name, _PatchedMapping(getattr(self, name), patches) if patches else getattr(self, name))
+        updated.term_postings = _PatchedMapping(self.term_postings, term_patches) if term_patches else self.term_postings
+        updated.doc_lengths = _PatchedSequence(self.doc_lengths, length_patches, count) if length_patches or count != base_count else self.doc_lengths
+        updated.avg_doc_length = total_length / count if count else 0.0
+        updated.price_values, updated.price_rows = _patched_column(self.price_values, self.price_rows, numeric_changes["precio"])
+        updated.stock_values, updated.stock_rows = _patched_column(self.stock_values, self.stock_rows, numeric_changes["stock"])
+        # Las cachés derivadas (cached_property) se recalculan en la nueva versión, salvo los índices de trigramas
+        # cuando el delta no añade claves nuevas (una clave que ya no existe no produce coincidencias).
+        updated.__dict__["row_by_id"] = row_by_id
+        new_keys = {"color_keys": any(key not in self.colores for key in set_patches["colores"]),
+                    "term_keys": any(term not in self.term_postings for term in term_patches)}
+        for name, has_new_keys in new_keys.items():
+            if name in self.__dict__ and not has_new_keys:
+                updated.__dict__[name] = self.__dict__[name]
+        return updated, stats
+
+    def rows_with_terms(self, terms):
+        # Filas que contienen alguno de los términos (ya normalizados); candidatas para el ranking BM25 de texto libre.
+        rows = set()
+        for term in terms:
+            rows.update((self.term_postings.get(term) or {}).keys())
+        return rows
+
+    def in_stock(self, row):
+        return (_numeric(self.products[row].get("stock")) or 0) > 0
+
+    def rows_for_ids(self, product_ids):
+        return [self.row_by_id[product_id] for product_id in product_ids if product_id in self.row_by_id]
+
+    def search_rows(self, entities, limit=None, in_stock_only=False, candidate_rows=None):
+        # Filas de los `limit` mejores productos y total de coincidencias. Con `candidate_rows` (p. ej. los resultados
+        # del turno anterior) solo se revisan esas filas en lugar de consultar los índices del catálogo completo.
+        if not entities:
+            return [], 0
+        if candidate_rows is not None:
+            candidates = ((row, self.products[row]) for row in candidate_rows)
+            rows = {row for row, product in candidates if strict_match(product, entities) and
+                    (not in_stock_only or (_numeric(product.get("stock")) or 0) > 0)}
+            return self.rank_rows(rows, entities, limit), len(rows)
+        rows = self.match_rows(entities)
+        if in_stock_only and rows:
+            rows = self.rows_in_stock(rows)
+        return self.rank_rows(rows, entities, limit), len(rows)
+
+    def search(self, entities, limit=None, in_stock_only=False):
+        # Devuelve los `limit` mejores productos y el total de coincidencias antes de recortar.
+        rows, match_count = self.search_rows(entities, limit, in_stock_only)
+        return [self.products[row] for row in rows], match_count
+
+
+def strict_match(product, entities):
+    # Filtro lineal original, conservado como referencia de paridad para el índice.
+    match_score = 0; perfect_match_needed = 0
+    entity_categoria = normalize_key(entities.get("categoria", ""))
+    if entity_categoria:
+        perfect_match_needed += 1
+        product_categoria_actual = _field_text(product, "categoria")
+        if entity_categoria in product_categoria_actual or product_categoria_actual in entity_categoria: match_score += 1
+        elif entity_categoria in _field_text(product, "nombre"): match_score += 0.5
+    entity_marca = normalize_key(entities.get("marca", ""))
+    if entity_marca:
+        perfect_match_needed += 1
+        if entity_marca in _field_text(product, "marca"): match_score += 1
+    entity_nombre_producto = normalize_key(entities.get("nombre_producto", ""))
+    if entity_nombre_producto:
+        perfect_match_needed += 1
+        if entity_nombre_producto in _field_text(product, "nombre"): match_score += 1
+    entity_tamano = str(entities.get("tamaño", "")).lower()
+    if entity_tamano:
+        perfect_match_needed += 1
+        tamano_numerico_entidad = "".join(filter(str.isdigit, entity_tamano))
+        if tamano_numerico_entidad:
+            if tamano_numerico_entidad in _field_text(product, "nombre") or \
+               any(tamano_numerico_entidad in normalize_key(car) for car in product.get("caracteristicas", []) or []):
+                match_score += 1
+    entity_color = normalize_key(entities.get("color", ""))
+    if entity_color:
+        perfect_match_needed += 1
+        product_colores = [normalize_key(c) for c in product.get("colores", []) or []]
+        if product_colores and entity_color in product_colores: match_score += 1
+    entity_talla = normalize_key(entities.get("talla", ""))
+    if entity_talla:
+        perfect_match_needed += 1
+        product_tallas = [normalize_key(t) for t in product.get("tallas_disponibles", []) or []]
+        if product_tallas and entity_talla in product_tallas: match_score += 1
+    precio_minimo = parse_price(entities.get("precio_minimo"))
+    precio_maximo = parse_price(entities.get("precio_maximo"))
+    if precio_minimo is not None or precio_maximo is not None:
+        perfect_match_needed += 1
+        precio = _numeric(product.get("precio"))
+        if precio is not None and (precio_minimo is None or precio >= precio_minimo) and (precio_maximo is None or precio <= precio_maximo):
+            match_score += 1
+    return perfect_match_needed > 0 and match_score >= perfect_match_needed
+
+
+def linear_search(products, entities, in_stock_only=False):
+    if not entities:
+        return []
+    return [product for product in products if strict_match(product, entities) and
+            (not in_stock_only or (_numeric(product.get("stock")) or 0) > 0)]
+
+
+def _synthetic_catalog(size):
+    categorias = ["televisor", "laptop", "zapatillas", "botas", "camisa", "smartphone", "accesorios"]
+    marcas = [f"marca{i}" for i in range(200)]
+    colores = ["negro", "blanco", "rojo", "azul", "gris", "verde"]
+    products = []
+    for i in range(size):
+        categoria = categorias[i % len(categorias)]
+        products.append({
+            "id": f"sku{i:07d}",
+            "nombre": f"{categoria.capitalize()} {marcas[i % len(marcas)]} modelo {i % 997} {40 + i % 30} pulgadas",
+            "categoria": categoria,
+            "marca": marcas[(i * 7) % len(marcas)],
+            "precio": float(20 + (i * 37) % 3000),
+            "stock": i % 40,
+            "caracteristicas": [f"caracteristica {i % 13}", f"serie {i % 101}"],
+            "colores": [colores[i % len(colores)], colores[(i + 2) % len(colores)]],
+            "tallas_disponibles": [str(38 + i % 8), str(39 + i % 8)],
+        })
+    return products
+
+
+if __name__ == '__main__':
+    sizes = [int(s) for s in sys.argv[1:]] or [1000, 10000, 100000, 1000000]
+    queries = [
+        {"categoria": "televisor", "marca": "marca7"},
+        {"categoria": "zapatillas", "color": "negro", "talla": "40"},
+        {"nombre_producto": "modelo 42", "tamaño": "55 pulgadas"},
+        {"categoria": "botas de montaña"},
+        {"categoria": "laptop", "precio_minimo": "500", "precio_maximo": "1.500 dólares"},
+    ]
+    for size in sizes:
+        products = _synthetic_catalog(size)
+        start = time.perf_counter()
+        index = CatalogIndex(products)
+        build_ms = (time.perf_counter() - start) * 1000
+        indexed_ms = linear_ms = 0.0
+        for entities in queries:
+            start = time.perf_counter()
+            indexed, total = index.search(entities, in_stock_only=True)
+            indexed_ms += (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            linear = linear_search(products, entities, in_stock_only=True)
+            linear_ms += (time.perf_counter() - start) * 1000
+            if total != len(linear) or sorted(p["id"] for p in indexed) != sorted(p["id"] for p in linear):
+                raise SystemExit(f"Paridad rota para {entities} con {size} productos")
+        print(f"{size:>8} productos: build={build_ms:.1f}ms indice={indexed_ms / len(queries):.3f}ms/consulta lineal={linear_ms / len(queries):.3f}ms/consulta")
@@ -0,0 +1,442 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from functools import cached_property
+
+from catalog_index import CatalogIndex, FieldIndex, find_duplicate_ids
+from response_cache import LRUTTLCache
+
+# Snapshot binario del catálogo, generado offline a partir de products.json:
+#   MAGIC | longitud de cabecera (uint32) | cabecera JSON | secciones alineadas a 8 bytes
+# Cada sección es un arreglo de ancho fijo (uint32 "I", float64 "d") o bytes crudos ("B").
+# Los textos van internados en una única tabla de strings y las columnas guardan su posición;
+# los índices de búsqueda se guardan en formato CSR (offsets + items) y se leen directamente del mmap.
+SNAPSHOT_MAGIC = b"CATSNAP1"
+SNAPSHOT_VERSION = 2  # 2: valores indexados con normalize_key (sin acentos y con raíz de plural)
+SECTION_ALIGNMENT = 8
+MISSING_REF = 0xFFFFFFFF
+STRING_FIELDS = ["id", "nombre", "categoria", "marca", "descripcion"]
+NUMERIC_FIELDS = ["precio", "stock"]
+LIST_FIELDS = ["caracteristicas", "colores", "tallas_disponibles"]
+INDEXED_TEXT_FIELDS = ["categoria", "marca", "nombre", "caracteristicas"]
+INDEXED_SET_FIELDS = ["colores", "tallas"]
+POSTINGS_CACHE_ENTRIES = int(os.environ.get("CATALOG_SNAPSHOT_POSTINGS_CACHE", "256"))
+POSTINGS_CACHE_MIN_ROWS = 64
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array("I", [0])
+        self.data = bytearray()
+
+    def ref(self, value):
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = len(self.ids)
+            self.ids[value] = string_id
+            self.data += value.encode("utf-8")
+            self.offsets.append(len(self.data))
+        return string_id
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _align(offset):
+    return (offset + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
+
+
+class _SnapshotWriter:
+    def __init__(self):
+        self.strings = _StringTable()
+        self.sections = []
+
+    def add(self, name, typecode, data):
+        self.sections.append((name, typecode, bytes(data) if typecode == "B" else array(typecode, data).tobytes()))
+
+    def add_rows(self, prefix, groups):
+        offsets = array("I", [0])
+        items = array("I")
+        for rows in groups:
+            items.extend(rows)
+            offsets.append(len(items))
+        self.add(f"{prefix}_offsets", "I", offsets)
+        self.add(f"{prefix}_items", "I", items)
+
+    def add_postings(self, prefix, postings, weighted=False):
+        # postings: pares (clave, filas) o (clave, {fila: peso}) -> claves internadas + filas ordenadas en CSR.
+        keys = array("I")
+        groups = []
+        weights = array("I")
+        for key, rows in postings:
+            keys.append(self.strings.ref(key))
+            ordered = sorted(rows)
+            groups.append(ordered)
+            if weighted:
+                weights.extend(rows[row] for row in ordered)
+        self.add(f"{prefix}_keys", "I", keys)
+        self.add_rows(prefix, groups)
+        if weighted:
+            self.add(f"{prefix}_weights", "I", weights)
+
+    def write(self, output_path, header):
+        self.add("str_offsets", "I", self.strings.offsets)
+        self.add("str_data", "B", self.strings.data)
+        directory = {}
+        header = dict(header, sections=directory)
+        # La cabecera se dimensiona con offsets de tamaño máximo; las secciones empiezan justo después.
+        placeholder = {name: [MISSING_REF, len(blob), typecode] for name, typecode, blob in self.sections}
+        offset = _align(len(SNAPSHOT_MAGIC) + 4 + len(json.dumps(dict(header, sections=placeholder))))
+        for name, typecode, blob in self.sections:
+            directory[name] = [offset, len(blob), typecode]
+            offset = _align(offset + len(blob))
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack("<I", len(header_bytes)))
+            f.write(header_bytes)
+            for name, _, blob in self.sections:
+                f.seek(directory[name][0])
+                f.write(blob)
+            f.truncate(offset)
+        os.replace(tmp_path, output_path)
+        return header
+
+
+def build_snapshot(products, output_path, source_fingerprint=""):
+    duplicates = find_duplicate_ids(products)
+    if duplicates:
+        raise ValueError(f"Ids de producto repetidos: {duplicates}")
+    writer = _SnapshotWriter()
+    count = len(products)
+    string_columns = {field: array("I", [MISSING_REF]) * count for field in STRING_FIELDS}
+    numeric_columns = {field: array("d", [math.nan]) * count for field in NUMERIC_FIELDS}
+    integer_columns = {field: True for field in NUMERIC_FIELDS}
+    list_columns = {field: [] for field in LIST_FIELDS}
+    list_present = {field: array("I") for field in LIST_FIELDS}
+    extra_offsets = array("I", [0])
+    extra_data = bytearray()
+
+    for row, product in enumerate(products):
+        row_lists = {field: [] for field in LIST_FIELDS}
+        extras = {}
+        for key, value in product.items():
+            if key in string_columns and isinstance(value, str):
+                string_columns[key][row] = writer.strings.ref(value)
+            elif key in numeric_columns and _is_number(value):
+                numeric_columns[key][row] = float(value)
+                integer_columns[key] = integer_columns[key] and isinstance(value, int)
+            elif key in row_lists and isinstance(value, list) and all(isinstance(item, str) for item in value):
+                row_lists[key] = [writer.strings.ref(item) for item in value]
+                list_present[key].append(row)
+            else:
+                # Campos desconocidos o con tipos inesperados se conservan tal cual como JSON por fila.
+                extras[key] = value
+        for field in LIST_FIELDS:
+            list_columns[field].append(row_lists[field])
+        if extras:
+            extra_data += json.dumps(extras, ensure_ascii=False).encode("utf-8")
+        extra_offsets.append(len(extra_data))
+
+    for field in STRING_FIELDS:
+        writer.add(f"col_{field}", "I", string_columns[field])
+    for field in NUMERIC_FIELDS:
+        writer.add(f"col_{field}", "d", numeric_columns[field])
+    for field in LIST_FIELDS:
+        writer.add_rows(f"lst_{field}", list_columns[field])
+        writer.add(f"lst_{field}_present", "I", list_present[field])
+    writer.add("extra_offsets", "I", extra_offsets)
+    writer.add("extra_data", "B", extra_data)
+
+    index = CatalogIndex(products)
+    for name in INDEXED_TEXT_FIELDS:
+        field_index = getattr(index, name)
+        writer.add(f"idx_{name}_values", "I", (writer.strings.ref(value) for value in field_index.values))
+        writer.add_rows(f"idx_{name}_rows", (sorted(rows) for rows in field_index.value_rows))
+        writer.add_postings(f"idx_{name}_grams", field_index.grams.items())
+    for name in INDEXED_SET_FIELDS:
+        writer.add_postings(f"idx_{name}", getattr(index, name).items())
+    writer.add_postings("idx_terms", index.term_postings.items(), weighted=True)
+    writer.add("idx_doc_lengths", "I", index.doc_lengths)
+    writer.add("idx_price_values", "d", index.price_values)
+    writer.add("idx_price_rows", "I", index.price_rows)
+    writer.add("idx_stock_values", "d", index.stock_values)
+    writer.add("idx_stock_rows", "I", index.stock_rows)
+
+    return writer.write(output_path, {
+        "version": SNAPSHOT_VERSION,
+        "byteorder": sys.byteorder,
+        "count": count,
+        "source_fingerprint": source_fingerprint,
+        "integer_columns": [field for field, is_int in integer_columns.items() if is_int],
+        "avg_doc_length": index.avg_doc_length,
+    })
+
+
+class _RowSets:
+    # Lista de conjuntos de filas en CSR; cada conjunto se decodifica al pedirlo y los más usados quedan en caché.
+    def __init__(self, offsets, items):
+        self.offsets = offsets
+        self.items = items
+        self.cache = LRUTTLCache(max_entries=POSTINGS_CACHE_ENTRIES, ttl_seconds=math.inf)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        if end - start < POSTINGS_CACHE_MIN_ROWS:
+            return set(self.items[start:end])
+        rows = self.cache.get(position)
+        if rows is None:
+            rows = set(self.items[start:end])
+            self.cache.set(position, rows)
+        return rows
+
+
+class _Postings:
+    # Mapeo clave -> filas (o {fila: frecuencia}) en CSR. Solo el diccionario de claves vive siempre en memoria.
+    def __init__(self, snapshot, prefix):
+        sections = snapshot.sections
+        self.slots = {snapshot.string(ref): slot for slot, ref in enumerate(sections[f"{prefix}_keys"])}
+        self.offsets = sections[f"{prefix}_offsets"]
+        self.items = sections[f"{prefix}_items"]
+        self.weights = sections.get(f"{prefix}_weights")
+        self.cache = LRUTTLCache(max_entries=POSTINGS_CACHE_ENTRIES, ttl_seconds=math.inf)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def keys(self):
+        return self.slots.keys()
+
+    def get(self, key, default=None):
+        slot = self.slots.get(key)
+        if slot is None:
+            return default
+        start, end = self.offsets[slot], self.offsets[slot + 1]
+        cacheable = end - start >= POSTINGS_CACHE_MIN_ROWS
+        postings = self.cache.get(slot) if cacheable else None
+        if postings is None:
+            if self.weights is None:
+                postings = set(self.items[start:end])
+            else:
+                postings = dict(zip(self.items[start:end], self.weights[start:end]))
+            if cacheable:
+                self.cache.set(slot, postings)
+        return postings
+
+
+class _SnapshotFieldIndex(FieldIndex):
+    # FieldIndex de solo lectura: valores, filas y n-gramas se leen del snapshot en lugar de construirse con add().
+    def __init__(self, snapshot, prefix):
+        self.snapshot = snapshot
+        self.prefix = prefix
+        self.value_ids = None
+        self.value_rows = _RowSets(snapshot.sections[f"{prefix}_rows_offsets"], snapshot.sections[f"{prefix}_rows_items"])
+        self.grams = _Postings(snapshot, f"{prefix}_grams")
+
+    @cached_property
+    def values(self):
+        # Se decodifican una sola vez, en la primera consulta que los necesita.
+        return [self.snapshot.string(ref) for ref in self.snapshot.sections[f"{self.prefix}_values"]]
+
+
+class LazyProducts:
+    # Vista de solo lectura sobre las columnas del snapshot: el dict de un producto se arma solo al pedir su fila.
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return self.snapshot.count
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self.snapshot.materialize(i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self.snapshot.materialize(row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.snapshot.materialize(row)
+
+    def iter_fields(self, fields):
+        for row in range(len(self)):
+            yield self.snapshot.materialize(row, fields)
+
+
+class CatalogSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"'{path}' no es un snapshot de catálogo.")
+        header_start = len(SNAPSHOT_MAGIC) + 4
+        header_length = struct.unpack_from("<I", self.buffer, len(SNAPSHOT_MAGIC))[0]
+        self.header = json.loads(self.buffer[header_start:header_start + header_length])
+        if self.header["version"] != SNAPSHOT_VERSION or self.header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Snapshot '{path}' incompatible (versión {self.header['version']}, {self.header['byteorder']}).")
+        self.count = self.header["count"]
+        self.source_fingerprint = self.header["source_fingerprint"]
+        self.integer_columns = set(self.header["integer_columns"])
+        view = memoryview(self.buffer)
+        self.sections = {}
+        for name, (offset, length, typecode) in self.header["sections"].items():
+            section = view[offset:offset + length]
+            self.sections[name] = section if typecode == "B" else section.cast(typecode)
+        self.list_present = {}
+        self.products = LazyProducts(self)
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def _load_index(self):
+        # Mismo CatalogIndex que en la carga desde JSON, con sus estructuras leídas del mmap en lugar de reconstruirlas.
+        index = CatalogIndex.__new__(CatalogIndex)
+        index.products = self.products
+        for name in INDEXED_TEXT_FIELDS:
+            setattr(index, name, _SnapshotFieldIndex(self, f"idx_{name}"))
+        for name in INDEXED_SET_FIELDS:
+            setattr(index, name, _Postings(self, f"idx_{name}"))
+        index.term_postings = _Postings(self, "idx_terms")
+        index.doc_lengths = self.sections["idx_doc_lengths"]
+        index.avg_doc_length = self.header["avg_doc_length"]
+        for name in ("price_values", "price_rows", "stock_values", "stock_rows"):
+            setattr(index, name, self.sections[f"idx_{name}"])
+        return index
+
+    def string(self, string_id):
+        offsets = self.sections["str_offsets"]
+        return str(self.sections["str_data"][offsets[string_id]:offsets[string_id + 1]], "utf-8")
+
+    def _has_list(self, field, row):
+        present = self.list_present.get(field)
+        if present is None:
+            present = self.list_present[field] = set(self.sections[f"lst_{field}_present"])
+        return row in present
+
+    def materialize(self, row, fields=None):
+        product = {}
+        for field in STRING_FIELDS:
+            if fields is None or field in fields:
+                string_id = self.sections[f"col_{field}"][row]
+                if string_id != MISSING_REF:
+                    product[field] = self.string(string_id)
+        for field in NUMERIC_FIELDS:
+            if fields is None or field in fields:
+                value = self.sections[f"col_{field}"][row]
+                if not math.isnan(value):
+                    product[field] = int(value) if field in self.integer_columns else value
+        for field in LIST_FIELDS:
+            if (fields is None or field in fields) and self._has_list(field, row):
+                offsets = self.sections[f"lst_{field}_offsets"]
+                items = self.sections[f"lst_{field}_items"]
+                product[field] = [self.string(items[i]) for i in range(offsets[row], offsets[row + 1])]
+        extra_offsets = self.sections["extra_offsets"]
+        if extra_offsets[row] != extra_offsets[row + 1]:
+            extras = json.loads(bytes(self.sections["extra_data"][extra_offsets[row]:extra_offsets[row + 1]]))
+            product.update(extras if fields is None else {k: v for k, v in extras.items() if k in fields})
+        return product
+
+
+def fingerprint_bytes(raw):
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def build_snapshot_from_json(json_path, output_path):
+    with open(json_path, "rb") as f:
+        raw_catalog = f.read()
+    return build_snapshot(json.loads(raw_catalog), output_path, fingerprint_bytes(raw_catalog))
+
+
+def _rss_mb():
+    # ru_maxrss se hereda entre fork/exec en Linux; /proc/self/status refleja solo este proceso.
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def _measure_load(mode, path):
+    baseline_mb, _ = _rss_mb()
+    start = time.perf_counter()
+    if mode == "json":
+        with open(path, "rb") as f:
+            products = json.loads(f.read())
+        index = CatalogIndex(products)
+    else:
+        index = CatalogSnapshot(path).index
+    load_ms = (time.perf_counter() - start) * 1000
+    queries = [{"categoria": "televisor", "marca": "marca7"}, {"nombre_producto": "modelo 42", "tamaño": "55 pulgadas"},
+               {"categoria": "zapatillas", "color": "negro", "talla": "40"}]
+    query_ms = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for entities in queries:
+            index.search(entities, limit=2, in_stock_only=True)
+        query_ms.append((time.perf_counter() - start) * 1000 / len(queries))
+    rss_mb, peak_mb = _rss_mb()
+    print(json.dumps({"load_ms": round(load_ms, 1), "first_query_ms": round(query_ms[0], 2), "query_ms": round(min(query_ms[1:]), 2),
+                      "rss_mb": round(rss_mb - baseline_mb, 1), "peak_mb": round(peak_mb - baseline_mb, 1)}))
+
+
+def _benchmark(sizes):
+    import subprocess
+    import tempfile
+    from catalog_index import _synthetic_catalog
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, "products.json")
+            snapshot_path = os.path.join(tmp, "products.catsnap")
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(_synthetic_catalog(size), f, ensure_ascii=False)
+            build_snapshot_from_json(json_path, snapshot_path)
+            for mode, path in (("json", json_path), ("snapshot", snapshot_path)):
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", mode, path],
+                                        check=True, capture_output=True, text=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(f"{size:>8} productos {mode:>8}: carga={result['load_ms']}ms primera consulta={result['first_query_ms']}ms "
+                      f"consulta={result['query_ms']}ms "
+                      f"rss=+{result['rss_mb']}MB pico=+{result['peak_mb']}MB archivo={os.path.getsize(path) // 1024}KB")
+
+
+if __name__ == '__main__':
+    # Paso offline: python catalog_snapshot.py products.json products.catsnap
+    # Benchmark:     python catalog_snapshot.py --benchmark [tamaños...]
+    if len(sys.argv) >= 2 and sys.argv[1] == "--measure":
+        _measure_load(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--benchmark":
+        _benchmark([int(s) for s in sys.argv[2:]] or [1000, 10000, 100000])
+    else:
+        source = sys.argv[1] if len(sys.argv) > 1 else "products.json"
+        target = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(source)[0] + ".catsnap"
+        try:
+            header = build_snapshot_from_json(source, target)
+        except ValueError as e:
+            raise SystemExit(f"No se generó el snapshot: {e}")
+        print(f"Snapshot '{target}' generado: {header['count']} productos, {os.path.getsize(target)} bytes.")
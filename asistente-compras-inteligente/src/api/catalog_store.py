@@ -0,0 +1,320 @@
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog_index import CatalogIndex, find_duplicate_ids
+from catalog_snapshot import CatalogSnapshot, build_snapshot, fingerprint_bytes
+from cold_start import lazy_import
+from instrumentation import log_info, log_warning, log_error, increment, record
+
+CATALOG_SOURCE = os.environ.get("CATALOG_SOURCE", "")
+CATALOG_MANIFEST_NAME = os.environ.get("CATALOG_MANIFEST_NAME", "catalog_manifest.json")
+CATALOG_RELOAD_INTERVAL_SECONDS = float(os.environ.get("CATALOG_RELOAD_INTERVAL_SECONDS", "60"))
+CATALOG_CACHE_DIR = os.environ.get("CATALOG_CACHE_DIR", "/tmp/catalog")
+
+# Manifiesto publicado junto al catálogo (se sube el último, cuando la base y los deltas ya existen):
+# {"version": 7, "base": {"version": 5, "key": "products-v5.catsnap", "fingerprint": "..."},
+#  "deltas": [{"version": 6, "key": "delta-v6.json"}, {"version": 7, "key": "delta-v7.json"}]}
+# Un delta es {"upsert": [productos completos], "delete": [ids]}; la base puede ser un snapshot o un JSON.
+
+
+class CatalogVersion:
+    # Todo lo que una consulta necesita de una versión del catálogo; se publica entera con una sola asignación y no
+    # se modifica después (salvo el recomendador, que se construye en segundo plano bajo demanda), así una petición en
+    # curso termina sobre la versión con la que empezó.
+    def __init__(self, products, index, fingerprint, version=0, base_key=None):
+        self.products = products
+        self.index = index
+        self.fingerprint = fingerprint
+        self.version = version
+        self.base_key = base_key
+        self.fast_nlu = None
+        self.recommender = None
+        self.recommender_build = None
+
+    def __len__(self):
+        return len(self.index)
+
+
+def load_catalog_version(path, version=0, base_key=None):
+    # Base completa desde un snapshot (.catsnap, leído con mmap) o desde un JSON de productos.
+    if path.endswith(".catsnap"):
+        snapshot = CatalogSnapshot(path)
+        return CatalogVersion(snapshot.products, snapshot.index, snapshot.source_fingerprint, version, base_key)
+    with open(path, "rb") as f:
+        raw_catalog = f.read()
+    products = json.loads(raw_catalog)
+    duplicates = find_duplicate_ids(products)
+    if duplicates:
+        increment("catalog.duplicate_ids", len(duplicates))
+        log_warning(f"LAMBDA_CATALOG_WARNING: '{path}' tiene ids repetidos {duplicates}; las sesiones y los deltas usan la primera fila.")
+    return CatalogVersion(products, CatalogIndex(products), fingerprint_bytes(raw_catalog), version, base_key)
+
+
+def merge_deltas(deltas):
+    # Varios deltas seguidos -> uno solo (el último cambio de cada id gana), para actualizar el índice una vez.
+    upserts, deleted = {}, set()
+    for delta in deltas:
+        for product in delta.get("upsert", []) or []:
+            upserts[product.get("id")] = product
+            deleted.discard(product.get("id"))
+        for product_id in delta.get("delete", []) or []:
+            upserts.pop(product_id, None)
+            deleted.add(product_id)
+    return {"upsert": list(upserts.values()), "delete": sorted(deleted, key=str)}
+
+
+class LocalCatalogSource:
+    # Directorio con el manifiesto; el cambio se detecta con mtime y tamaño del manifiesto (un stat por comprobación).
+    def __init__(self, directory, manifest_name=CATALOG_MANIFEST_NAME):
+        self.directory = directory
+        self.manifest_name = manifest_name
+
+    def read_manifest(self, known_tag=None):
+        # Devuelve (etiqueta, manifiesto) o (etiqueta, None) si no cambió desde `known_tag`.
+        path = os.path.join(self.directory, self.manifest_name)
+        stat = os.stat(path)
+        tag = f"{stat.st_mtime_ns}:{stat.st_size}"
+        if tag == known_tag:
+            return tag, None
+        with open(path, "rb") as f:
+            return tag, json.loads(f.read())
+
+    def read(self, key):
+        with open(os.path.join(self.directory, key), "rb") as f:
+            return f.read()
+
+    def local_path(self, key):
+        return os.path.join(self.directory, key)
+
+
+class S3CatalogSource:
+    # Prefijo de S3 con el manifiesto; GetObject condicional (If-None-Match con el ETag) responde 304 sin cuerpo si no cambió.
+    def __init__(self, client, bucket, prefix="", manifest_name=CATALOG_MANIFEST_NAME, cache_dir=CATALOG_CACHE_DIR):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.manifest_name = manifest_name
+        self.cache_dir = cache_dir
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def read_manifest(self, known_tag=None):
+        conditional = {"IfNoneMatch": known_tag} if known_tag else {}
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(self.manifest_name), **conditional)
+        except lazy_import("botocore.exceptions").ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                return known_tag, None
+            raise
+        return response["ETag"], json.loads(response["Body"].read())
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    def local_path(self, key):
+        # Los snapshots se descargan una vez a /tmp para leerlos con mmap; las claves son versionadas e inmutables.
+        path = os.path.join(self.cache_dir, os.path.basename(key))
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.client.download_file(self.bucket, self._key(key), path + ".part")
+            os.replace(path + ".part", path)
+        return path
+
+
+def create_catalog_source(uri=CATALOG_SOURCE, client_factory=None):
+    if not uri:
+        return None
+    if uri.startswith("s3://"):
+        bucket, _, prefix = uri[len("s3://"):].partition("/")
+        return S3CatalogSource(client_factory.client("s3"), bucket, prefix)
+    return LocalCatalogSource(uri)
+
+
+class CatalogStore:
+    # Recarga en caliente: como mucho cada `interval` segundos se comprueba el manifiesto (stat o ETag) y, si cambió,
+    # en un hilo aparte se aplican los deltas nuevos sobre la versión vigente (o se carga la base si cambió) y se
+    # publica la nueva versión. Las peticiones nunca esperan a una recarga: siguen con la versión anterior hasta el
+    # intercambio. En Lambda el hilo avanza mientras haya una invocación en curso.
+    def __init__(self, source, current, publish=None, prepare=None, interval=CATALOG_RELOAD_INTERVAL_SECONDS):
+        self.source = source
+        self.current = current
+        self.publish = publish or (lambda version: None)
+        self.prepare = prepare or (lambda version, previous, delta: None)
+        self.interval = interval
+        self.tag = None
+        self.next_check = 0.0
+        self.pending = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-reload")
+
+    def maybe_reload(self):
+        # Coste en la ruta de la petición: leer el reloj y, una vez por intervalo, encolar la comprobación.
+        now = time.monotonic()
+        with self.lock:
+            if now >= self.next_check and (self.pending is None or self.pending.done()):
+                self.next_check = now + self.interval
+                self.pending = self.executor.submit(self._reload_safely)
+        return self.current
+
+    def _reload_safely(self):
+        try:
+            return self.reload()
+        except Exception as e:
+            increment("catalog.reload_errors")
+            log_error(f"LAMBDA_CATALOG_RELOAD_ERROR: {e}; se mantiene la versión {self.current.version}.")
+            return False
+
+    def reload(self):
+        # Síncrona (la usa el hilo de recarga y el benchmark). Devuelve True si publicó una versión nueva.
+        start = time.perf_counter()
+        tag, manifest = self.source.read_manifest(self.tag)
+        if manifest is None:
+            return False
+        current = self.current
+        if manifest["version"] == current.version and manifest["base"]["key"] == current.base_key:
+            self.tag = tag
+            return False
+        base = manifest["base"]
+        if current.base_key is None and base.get("fingerprint") == current.fingerprint:
+            # El catálogo empaquetado en la Lambda es esa misma base: solo hace falta aplicar los deltas.
+            version = CatalogVersion(current.products, current.index, current.fingerprint, base["version"], base["key"])
+            version.fast_nlu, version.recommender = current.fast_nlu, current.recommender
+            version.recommender_build = current.recommender_build
+            previous, mode = version, "delta"
+        elif base["key"] != current.base_key or manifest["version"] < current.version:
+            version = load_catalog_version(self.source.local_path(base["key"]), base["version"], base["key"])
+            previous, mode = None, "base"
+        else:
+            version, previous, mode = current, current, "delta"
+        pending = sorted((delta for delta in manifest.get("deltas", []) if delta["version"] > version.version), key=lambda delta: delta["version"])
+        if mode == "delta" and not pending:
+            # Sin deltas nuevos no cambia ningún producto: no hay nada que preparar (ni NLU ni recomendador que rehacer).
+            if version is not current:
+                self.current = version
+                self.publish(version)
+            self.tag = tag
+            return version is not current
+        delta = None
+        if pending:
+            delta = merge_deltas(json.loads(self.source.read(entry["key"])) for entry in pending)
+            index, stats = version.index.apply_delta(delta["upsert"], delta["delete"])
+            version = CatalogVersion(index.products, index, f"{version.fingerprint}@{pending[-1]['version']}", pending[-1]["version"], base["key"])
+            increment("catalog.delta_products", sum(stats.values()))
+        self.prepare(version, previous, delta if previous is not None else None)
+        self.current = version
+        self.publish(version)
+        self.tag = tag
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        record(f"catalog.reload.{mode}", elapsed_ms)
+        log_info(f"LAMBDA_CATALOG_RELOAD: versión {current.version} -> {version.version} ({mode}, {len(pending)} deltas, "
+                 f"{len(version)} productos) en {elapsed_ms:.1f}ms")
+        return True
+
+
+def _write_manifest(directory, manifest, manifest_name=CATALOG_MANIFEST_NAME):
+    # Reemplazo atómico: un lector ve el manifiesto anterior o el nuevo, nunca uno a medio escribir.
+    path = os.path.join(directory, manifest_name)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def publish_base(directory, products_path):
+    # Nueva base versionada (snapshot) en el directorio; los deltas anteriores dejan de aplicarse.
+    manifest_path = os.path.join(directory, CATALOG_MANIFEST_NAME)
+    previous_version = 0
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            previous_version = json.load(f)["version"]
+    version = previous_version + 1
+    with open(products_path, "rb") as f:
+        raw_catalog = f.read()
+    key = f"products-v{version}.catsnap"
+    build_snapshot(json.loads(raw_catalog), os.path.join(directory, key), fingerprint_bytes(raw_catalog))
+    manifest = {"version": version, "base": {"version": version, "key": key, "fingerprint": fingerprint_bytes(raw_catalog)}, "deltas": []}
+    _write_manifest(directory, manifest)
+    return manifest
+
+
+def publish_delta(directory, delta):
+    manifest_path = os.path.join(directory, CATALOG_MANIFEST_NAME)
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    duplicates = find_duplicate_ids(delta.get("upsert", []) or [])
+    if duplicates:
+        raise ValueError(f"Ids repetidos en el delta: {duplicates}")
+    version = manifest["version"] + 1
+    key = f"delta-v{version}.json"
+    with open(os.path.join(directory, key), "w", encoding="utf-8") as f:
+        json.dump(delta, f, ensure_ascii=False)
+    manifest = dict(manifest, version=version, deltas=manifest["deltas"] + [{"version": version, "key": key}])
+    _write_manifest(directory, manifest)
+    return manifest
+
+
+def _benchmark(sizes, changed=100):
+    import tempfile
+    from catalog_index import _synthetic_catalog
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            catalog = _synthetic_catalog(size)
+            products_path = os.path.join(tmp, "products.json")
+            with open(products_path, "w", encoding="utf-8") as f:
+                json.dump(catalog, f, ensure_ascii=False)
+            manifest = publish_base(tmp, products_path)
+            source = LocalCatalogSource(tmp)
+            start = time.perf_counter()
+            base = load_catalog_version(source.local_path(manifest["base"]["key"]), manifest["version"], manifest["base"]["key"])
+            base.index.search({"categoria": "televisor"})
+            snapshot_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            load_catalog_version(products_path).index.search({"categoria": "televisor"})
+            json_ms = (time.perf_counter() - start) * 1000
+
+            store = CatalogStore(source, base, interval=0)
+            store.reload()
+            start = time.perf_counter()
+            checks = 200
+            for _ in range(checks):
+                store.source.read_manifest(store.tag)
+            check_us = (time.perf_counter() - start) * 1e6 / checks
+
+            in_flight = store.current
+            before = in_flight.index.search({"categoria": "televisor"}, in_stock_only=True)[1]
+            delta = {"upsert": [dict(product, precio=product["precio"] + 1, stock=0) for product in catalog[:changed]] +
+                               [dict(product, id=f"nuevo{i}") for i, product in enumerate(catalog[:changed // 10])],
+                     "delete": [product["id"] for product in catalog[changed:changed + changed // 10]]}
+            publish_delta(tmp, delta)
+            start = time.perf_counter()
+            store.reload()
+            delta_ms = (time.perf_counter() - start) * 1000
+            after = store.current.index.search({"categoria": "televisor"}, in_stock_only=True)[1]
+            # El primer delta sobre un snapshot construye id -> fila y los diccionarios de valores; los siguientes ya no.
+            publish_delta(tmp, {"upsert": [dict(product, precio=product["precio"] + 2) for product in catalog[:changed]], "delete": []})
+            start = time.perf_counter()
+            store.reload()
+            next_delta_ms = (time.perf_counter() - start) * 1000
+            print(f"{size:>8} productos: base snapshot {snapshot_ms:.1f}ms, recarga completa JSON {json_ms:.1f}ms, "
+                  f"delta de {len(delta['upsert']) + len(delta['delete'])} productos {delta_ms:.1f}ms (siguiente {next_delta_ms:.1f}ms), "
+                  f"comprobación sin cambios {check_us:.1f}µs; televisores en stock: versión {in_flight.version}={before} "
+                  f"(sin cambios tras el intercambio: {in_flight.index.search({'categoria': 'televisor'}, in_stock_only=True)[1] == before}), "
+                  f"versión {in_flight.version + 1}={after}")
+
+
+if __name__ == '__main__':
+    # Publicar: python catalog_store.py --publish-base <directorio> products.json
+    #           python catalog_store.py --publish-delta <directorio> delta.json
+    # Benchmark: python catalog_store.py [tamaños...]
+    if len(sys.argv) >= 4 and sys.argv[1] == "--publish-base":
+        print(json.dumps(publish_base(sys.argv[2], sys.argv[3]), ensure_ascii=False))
+    elif len(sys.argv) >= 4 and sys.argv[1] == "--publish-delta":
+        with open(sys.argv[3], encoding="utf-8") as f:
+            print(json.dumps(publish_delta(sys.argv[2], json.load(f)), ensure_ascii=False))
+    else:
+        _benchmark([int(size) for size in sys.argv[1:]] or [10000, 100000])
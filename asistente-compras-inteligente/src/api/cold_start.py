@@ -0,0 +1,71 @@
+import importlib
+import json
+import os
+import sys
+import time
+
+MODULE_LOAD_STARTED = time.perf_counter()
+IMPORT_TIMINGS_MS = {}
+INIT_TIMINGS_MS = {}
+_report_emitted = False
+
+
+def lazy_import(module_name):
+    # Importa un módulo pesado solo cuando se necesita y registra cuánto tardó la primera vez.
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    IMPORT_TIMINGS_MS[module_name] = round((time.perf_counter() - start) * 1000, 2)
+    return module
+
+
+def timed_init(stage, fn, *args):
+    if _report_emitted:
+        return fn(*args)
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        INIT_TIMINGS_MS[stage] = round(INIT_TIMINGS_MS.get(stage, 0.0) + (time.perf_counter() - start) * 1000, 2)
+
+
+def emit_cold_start_report(module_loaded_at):
+    # Una sola línea JSON por contenedor con los tiempos de carga del módulo, imports e inicialización.
+    global _report_emitted
+    if _report_emitted:
+        return
+    _report_emitted = True
+    print(json.dumps({
+        "coldStartReport": {
+            "moduleLoadMs": round((module_loaded_at - MODULE_LOAD_STARTED) * 1000, 2),
+            "firstInvocationMs": round((time.perf_counter() - MODULE_LOAD_STARTED) * 1000, 2),
+            "importsMs": IMPORT_TIMINGS_MS,
+            "initMs": INIT_TIMINGS_MS,
+        }
+    }))
+
+
+def measure_import_time(module_name="lambda_function", runs=5):
+    import subprocess
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module_name}"], cwd=base_dir, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+if __name__ == '__main__':
+    import statistics
+    # Benchmark de regresión: python cold_start.py [corridas] [máximo_ms]; termina con error si la mediana supera el máximo.
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    max_ms = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    baseline = statistics.median(measure_import_time("json", runs))
+    samples = measure_import_time("lambda_function", runs)
+    median_ms = statistics.median(samples)
+    print(f"import lambda_function: mediana={median_ms:.1f}ms max={max(samples):.1f}ms (intérprete vacío: {baseline:.1f}ms, n={runs})")
+    if max_ms is not None and median_ms > max_ms:
+        raise SystemExit(f"Regresión: el import tarda {median_ms:.1f}ms (máximo {max_ms:.1f}ms)")
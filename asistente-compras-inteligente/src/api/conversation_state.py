@@ -0,0 +1,77 @@
+import json
+import os
+
+from response_cache import LRUTTLCache, SQLiteCacheBackend
+
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE_BACKEND", "memory")
+SESSION_STORE_PATH = os.environ.get("SESSION_STORE_PATH", "/tmp/agent_sessions.sqlite3")
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", "10000"))
+SESSION_MAX_RESULT_IDS = int(os.environ.get("SESSION_MAX_RESULT_IDS", "50"))
+SESSION_MAX_CART_ITEMS = int(os.environ.get("SESSION_MAX_CART_ITEMS", "50"))
+SESSION_ID_MAX_LENGTH = 128
+
+# Cambiar el producto buscado inicia una búsqueda nueva; el resto de entidades refinan la anterior.
+SUBJECT_ENTITIES = ("categoria", "nombre_producto")
+
+
+def new_session():
+    # Solo ids y entidades: los productos se vuelven a leer del catálogo en cada turno.
+    return {"entities": {}, "resultIds": [], "matchCount": 0, "cart": [], "lastIntent": "", "turns": 0}
+
+
+def merge_entities(previous, current):
+    # Devuelve (entidades combinadas, modo): 'new' si cambia el producto buscado, 'narrow' si el turno solo añade
+    # restricciones (basta filtrar los resultados anteriores) y 'changed' si modifica alguna ya aplicada.
+    current = {key: value for key, value in (current or {}).items() if value not in (None, "")}
+    if not previous:
+        return current, "new"
+    for key in SUBJECT_ENTITIES:
+        if key in current and str(current[key]).lower() != str(previous.get(key, "")).lower():
+            return current, "new"
+    merged = dict(previous)
+    merged.update(current)
+    changed = any(key in previous and str(previous[key]).lower() != str(value).lower() for key, value in current.items())
+    return merged, "changed" if changed else "narrow"
+
+
+def can_narrow(session):
+    # Filtrar el turno anterior solo es equivalente a buscar de nuevo si se guardaron todas sus coincidencias.
+    return bool(session["resultIds"]) and session["matchCount"] <= len(session["resultIds"])
+
+
+def add_to_cart(session, product_id):
+    if product_id is not None and product_id not in session["cart"] and len(session["cart"]) < SESSION_MAX_CART_ITEMS:
+        session["cart"].append(product_id)
+    return session
+
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and 0 < len(session_id) <= SESSION_ID_MAX_LENGTH
+
+
+class SessionStore:
+    # Sesiones serializadas como JSON compacto sobre cualquier backend con get/set (LRU en memoria o SQLite).
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _key(self, session_id):
+        return f"session:{session_id}"
+
+    def load(self, session_id):
+        raw = self.backend.get(self._key(session_id))
+        if raw is None:
+            return new_session()
+        return dict(new_session(), **json.loads(raw))
+
+    def save(self, session_id, session):
+        self.backend.set(self._key(session_id), json.dumps(session, ensure_ascii=False, separators=(",", ":")))
+
+    def clear(self):
+        self.backend.clear()
+
+
+def create_session_store(backend=SESSION_STORE_BACKEND):
+    if backend == "sqlite":
+        return SessionStore(SQLiteCacheBackend(SESSION_STORE_PATH, ttl_seconds=SESSION_TTL_SECONDS))
+    return SessionStore(LRUTTLCache(max_entries=SESSION_MAX_ENTRIES, ttl_seconds=SESSION_TTL_SECONDS))
@@ -0,0 +1,192 @@
+import re
+import unicodedata
+
+from text_matching import TrigramIndex, normalize_key
+
+WORD_PATTERN = re.compile(r"[a-z0-9ñ]+")
+PRICE_MAX_PATTERN = re.compile(r"\b(?:menos de|hasta|maximo|no mas de|por debajo de|inferior a)\s+\$?\s*(\d+(?:[.,]\d+)*)")
+PRICE_MIN_PATTERN = re.compile(r"\b(?:mas de|desde|minimo|por encima de|superior a)\s+\$?\s*(\d+(?:[.,]\d+)*)")
+TALLA_PATTERN = re.compile(r"\btalla\s+([a-z0-9]+)")
+MAX_PHRASE_WORDS = 3
+FUZZY_MIN_WORD_LENGTH = 4
+FUZZY_CONFIDENCE_PENALTY = 0.1
+
+GREETING_PHRASES = ["hola", "buenos dias", "buenas tardes", "buenas noches", "buenas", "que tal", "saludos", "hey"]
+FAREWELL_PHRASES = ["adios", "chao", "chau", "hasta luego", "hasta pronto", "hasta manana", "nos vemos", "eso es todo", "gracias por todo"]
+SEARCH_PHRASES = ["busco", "buscar", "buscando", "quiero", "quisiera", "necesito", "tienes", "tienen", "hay", "muestrame", "ensename",
+                  "me interesa", "me interesan", "estoy buscando", "me gustaria", "venden", "comprar"]
+SLOW_PATH_PHRASES = ["compara", "comparar", "comparame", "diferencia", "recomienda", "recomiendas", "recomendacion", "sugieres",
+                     "sugerencia", "carrito", "mejor", "cual"]
+FILLER_WORDS = {"un", "una", "unos", "unas", "el", "la", "los", "las", "de", "del", "en", "para", "con", "por", "me", "mi", "que",
+                "y", "o", "a", "al", "color", "talla", "marca", "favor", "porfa", "algun", "alguna", "algunos", "algunas", "tambien",
+                "muy", "gracias", "dolares", "pesos", "precio", "cuesta", "cuestan", "yo", "te", "se", "lo", "le", "es", "son", "este", "esta"}
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", str(text).lower().replace("_", " "))
+    text = "".join(c for c in text if not unicodedata.combining(c) or c == "\u0303")
+    return unicodedata.normalize("NFC", text)
+
+
+def normalize_transcript(text):
+    return " ".join(WORD_PATTERN.findall(normalize_text(text)))
+
+
+def _inflections(phrase):
+    words = phrase.split()
+    last = words[-1]
+    variants = {last}
+    if last.endswith("s"):
+        variants.add(last[:-1])
+        if last.endswith("es"):
+            variants.add(last[:-2])
+    else:
+        variants.update({last + "s", last + "es"})
+    if last.endswith("o"):
+        variants.update({last[:-1] + "a", last[:-1] + "os", last[:-1] + "as"})
+    return {" ".join(words[:-1] + [variant]) for variant in variants}
+
+
+class FastIntentExtractor:
+    # Extractor de intención y entidades por reglas y diccionarios construidos desde el catálogo.
+    def __init__(self, products, fuzzy_enabled=True):
+        self.fuzzy_enabled = fuzzy_enabled
+        self.categorias = {}
+        self.marcas = {}
+        self.colores = {}
+        self.tallas = {}
+        for product in products:
+            categoria = product.get("categoria")
+            if categoria:
+                for variant in _inflections(normalize_text(categoria)):
+                    self.categorias.setdefault(variant, categoria)
+            marca = product.get("marca")
+            if marca:
+                self.marcas.setdefault(normalize_text(marca), marca)
+            for color in product.get("colores", []) or []:
+                for variant in _inflections(normalize_text(color)):
+                    self.colores.setdefault(variant, color)
+            for talla in product.get("tallas_disponibles", []) or []:
+                self.tallas.setdefault(normalize_text(talla), str(talla))
+        # Respaldo para errores de transcripción: palabras sueltas sin coincidencia exacta se buscan por trigramas.
+        self.fuzzy = {key: self._fuzzy_gazetteer(gazetteer) for key, gazetteer in
+                      (("categoria", self.categorias), ("marca", self.marcas), ("color", self.colores))}
+
+    def covers(self, products):
+        # True si los productos no traen categorías, marcas, colores ni tallas nuevas (el extractor sigue sirviendo).
+        for product in products:
+            if product.get("categoria") and normalize_text(product["categoria"]) not in self.categorias:
+                return False
+            if product.get("marca") and normalize_text(product["marca"]) not in self.marcas:
+                return False
+            if any(normalize_text(color) not in self.colores for color in product.get("colores", []) or []):
+                return False
+            if any(normalize_text(talla) not in self.tallas for talla in product.get("tallas_disponibles", []) or []):
+                return False
+        return True
+
+    def _fuzzy_gazetteer(self, gazetteer):
+        values = {}
+        for phrase, value in gazetteer.items():
+            if " " not in phrase:
+                values.setdefault(normalize_key(phrase), value)
+        return TrigramIndex(values), values
+
+    def _find_fuzzy(self, words, skip, key):
+        # Prueba cada palabra libre y cada par de palabras unidas ("super vision" -> "supervision").
+        index, values = self.fuzzy[key]
+        free = [i for i, word in enumerate(words) if i not in skip and word not in FILLER_WORDS and not word.isdigit()]
+        candidates = [((i, i + 1), words[i] + words[i + 1]) for i in free if i + 1 in free]
+        candidates += [((i,), words[i]) for i in free if len(words[i]) >= FUZZY_MIN_WORD_LENGTH]
+        for positions, text in candidates:
+            text = normalize_key(text)
+            match = text if text in values else index.lookup(text)
+            if match is not None:
+                return values[match], positions
+        return None, ()
+
+    def _find_phrases(self, words, gazetteer):
+        found = []
+        used = set()
+        for size in range(MAX_PHRASE_WORDS, 0, -1):
+            for start in range(len(words) - size + 1):
+                positions = set(range(start, start + size))
+                if positions & used:
+                    continue
+                phrase = " ".join(words[start:start + size])
+                if phrase in gazetteer:
+                    found.append((start, gazetteer[phrase]))
+                    used |= positions
+        found.sort()
+        return [value for _, value in found], used
+
+    def _phrase_positions(self, words, phrases):
+        positions = set()
+        for phrase in phrases:
+            phrase_words = phrase.split()
+            for start in range(len(words) - len(phrase_words) + 1):
+                if words[start:start + len(phrase_words)] == phrase_words:
+                    positions |= set(range(start, start + len(phrase_words)))
+        return positions
+
+    def extract(self, user_input):
+        # Devuelve (intent, entities, confidence); una confianza baja indica que debe decidir el LLM.
+        text = normalize_text(user_input)
+        words = WORD_PATTERN.findall(text)
+        if not words:
+            return "otra", {}, 0.0
+        if self._phrase_positions(words, SLOW_PATH_PHRASES):
+            return "otra", {}, 0.0
+
+        greeting = self._phrase_positions(words, GREETING_PHRASES)
+        farewell = self._phrase_positions(words, FAREWELL_PHRASES)
+        search = self._phrase_positions(words, SEARCH_PHRASES)
+        entities = {}
+        known = set()
+        categorias, positions = self._find_phrases(words, self.categorias)
+        known |= positions
+        if categorias:
+            entities["categoria"] = categorias[0]
+        marcas, positions = self._find_phrases(words, self.marcas)
+        known |= positions
+        if marcas:
+            entities["marca"] = marcas[0]
+        colores, positions = self._find_phrases(words, self.colores)
+        known |= positions
+        if colores:
+            entities["color"] = colores[0]
+        talla_match = TALLA_PATTERN.search(text)
+        if talla_match and talla_match.group(1) in self.tallas:
+            entities["talla"] = self.tallas[talla_match.group(1)]
+            known |= {i for i, word in enumerate(words) if word == talla_match.group(1)}
+        for pattern, key in ((PRICE_MAX_PATTERN, "precio_maximo"), (PRICE_MIN_PATTERN, "precio_minimo")):
+            price_match = pattern.search(text)
+            if price_match:
+                entities[key] = price_match.group(1)
+                known |= self._phrase_positions(words, [price_match.group(0).replace("$", " ")]) | {i for i, word in enumerate(words) if word == price_match.group(1)}
+
+        known |= greeting | farewell | search
+        fuzzy_matches = 0
+        if self.fuzzy_enabled:
+            for key in ("categoria", "marca", "color"):
+                if key in entities:
+                    continue
+                value, positions = self._find_fuzzy(words, known, key)
+                if value is not None:
+                    entities[key] = value
+                    known.update(positions)
+                    fuzzy_matches += 1
+        unknown = [word for i, word in enumerate(words) if i not in known and word not in FILLER_WORDS and not word.isdigit()]
+
+        if not entities:
+            if farewell:
+                return "despedirse", {}, max(0.0, 0.95 - 0.15 * len(unknown))
+            if greeting:
+                return "saludar", {}, max(0.0, 0.95 - 0.15 * len(unknown))
+            return "otra", {}, 0.0
+
+        if "categoria" not in entities:
+            return "buscar_producto", entities, 0.4
+        confidence = 0.6 + (0.2 if search else 0.0) + (0.1 if len(entities) > 1 else 0.0) + (0.05 if not unknown else 0.0)
+        confidence -= 0.15 * len(unknown) + FUZZY_CONFIDENCE_PENALTY * fuzzy_matches
+        return "buscar_producto", entities, round(max(0.0, min(confidence, 1.0)), 2)
@@ -0,0 +1,246 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get("LOG_LEVEL", "INFO").upper(), LOG_LEVELS["INFO"])
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "AsistenteCompras")
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+REDACTED_BODY_FIELDS = ("audio_base64",)
+EMF_MAX_VALUES = 100
+
+
+def log_enabled(level):
+    return LOG_LEVELS[level] >= LOG_LEVEL
+
+
+def log(level, message):
+    if LOG_LEVELS[level] >= LOG_LEVEL:
+        print(message)
+
+
+def log_debug(message):
+    log("DEBUG", message)
+
+
+def log_info(message):
+    log("INFO", message)
+
+
+def log_warning(message):
+    log("WARNING", message)
+
+
+def log_error(message):
+    log("ERROR", message)
+
+
+def log_event(label, event):
+    # Solo serializa el evento si el nivel DEBUG está activo; nunca incluye el audio.
+    if log_enabled("DEBUG"):
+        print(f"{label}: {json.dumps(redact_event(event), ensure_ascii=False)}")
+
+
+def redact_event(event):
+    # Copia del evento apta para logs: el audio en base64 se reemplaza por su tamaño.
+    if not isinstance(event, dict):
+        return event
+    redacted = dict(event)
+    body = redacted.get("body")
+    if redacted.get("isBase64Encoded") and isinstance(body, str):
+        redacted["body"] = f"<{len(body)} caracteres base64 omitidos>"
+        return redacted
+    parsed = body
+    if isinstance(body, str):
+        try:
+            parsed = json.loads(body)
+        except ValueError:
+            redacted["body"] = body[:200] + ("..." if len(body) > 200 else "")
+            return redacted
+    if isinstance(parsed, dict):
+        parsed = dict(parsed)
+        for field in REDACTED_BODY_FIELDS:
+            if isinstance(parsed.get(field), str):
+                parsed[field] = f"<{len(parsed[field])} caracteres base64 omitidos>"
+        redacted["body"] = parsed
+    return redacted
+
+
+class StdoutSink:
+    # En Lambda cada línea JSON en stdout con la clave "_aws" se convierte en métricas de CloudWatch (EMF).
+    def emit(self, record):
+        print(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+
+class InMemorySink:
+    # Sink para pruebas y benchmarks: guarda los registros emitidos para inspeccionarlos.
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def values(self, name):
+        values = []
+        for record in self.records:
+            value = record.get(name)
+            if value is not None:
+                values.extend(value if isinstance(value, list) else [value])
+        return values
+
+    def clear(self):
+        self.records.clear()
+
+
+class MetricsRecorder:
+    # Acumula spans (ms) y contadores de una invocación y los emite como un único registro EMF al hacer flush().
+    def __init__(self, namespace=METRICS_NAMESPACE, sink=None):
+        self.namespace = namespace
+        self.sink = sink or StdoutSink()
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, value, unit="Milliseconds"):
+        with self.lock:
+            self.values.setdefault(name, []).append(round(value, 3))
+            self.units[name] = unit
+
+    def increment(self, name, value=1):
+        if not value:
+            return
+        with self.lock:
+            current = self.values.get(name)
+            self.values[name] = [(current[0] if current else 0) + value]
+            self.units[name] = "Count"
+
+    def set_property(self, key, value):
+        with self.lock:
+            self.properties[key] = value
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def flush(self, **dimensions):
+        with self.lock:
+            values, units, properties = self.values, self.units, self.properties
+            self.values, self.units, self.properties = {}, {}, {}
+        if not values:
+            return []
+        # EMF admite hasta 100 valores por métrica en cada registro: series más largas se reparten en varios.
+        records = []
+        for offset in range(0, max(len(samples) for samples in values.values()), EMF_MAX_VALUES):
+            chunk = {name: samples[offset:offset + EMF_MAX_VALUES] for name, samples in values.items() if samples[offset:offset + EMF_MAX_VALUES]}
+            record = {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [sorted(dimensions)],
+                        "Metrics": [{"Name": name, "Unit": units[name]} for name in sorted(chunk)],
+                    }],
+                },
+            }
+            record.update(properties)
+            record.update(dimensions)
+            for name, samples in chunk.items():
+                record[name] = samples[0] if len(samples) == 1 else samples
+            self.sink.emit(record)
+            records.append(record)
+        return records
+
+
+METRICS = MetricsRecorder()
+
+
+def set_metrics_sink(sink):
+    METRICS.sink = sink
+    return sink
+
+
+def record(name, value, unit="Milliseconds"):
+    if METRICS_ENABLED:
+        METRICS.record(name, value, unit)
+
+
+def increment(name, value=1):
+    if METRICS_ENABLED:
+        METRICS.increment(name, value)
+
+
+@contextmanager
+def span(name):
+    if not METRICS_ENABLED:
+        yield
+        return
+    with METRICS.span(name):
+        yield
+
+
+def flush_metrics(**dimensions):
+    return METRICS.flush(**dimensions) if METRICS_ENABLED else []
+
+
+def traced(name, fn):
+    # Envuelve un nodo del grafo (síncrono o asíncrono) con un span del mismo nombre.
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def run_async(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+        return run_async
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        with span(name):
+            return fn(*args, **kwargs)
+    return run
+
+
+def record_llm_usage(message, prefix="llm"):
+    # Tokens de entrada/salida según los expone LangChain (usage_metadata) o la respuesta cruda de Bedrock.
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens, output_tokens = usage.get("input_tokens"), usage.get("output_tokens")
+    if not usage:
+        metadata = getattr(message, "response_metadata", None) or {}
+        raw_usage = metadata.get("usage") or {}
+        input_tokens = raw_usage.get("prompt_tokens", raw_usage.get("input_tokens"))
+        output_tokens = raw_usage.get("completion_tokens", raw_usage.get("output_tokens"))
+    increment(f"{prefix}.input_tokens", input_tokens or 0)
+    increment(f"{prefix}.output_tokens", output_tokens or 0)
+
+
+def _before_aws_call(model=None, context=None, **kwargs):
+    if context is not None and model is not None:
+        context["instrumentation_span"] = (f"aws.{model.service_model.service_name}.{model.name}", time.perf_counter())
+
+
+def _after_aws_call(context=None, http_response=None, exception=None, **kwargs):
+    started = (context or {}).pop("instrumentation_span", None)
+    if started is None:
+        return
+    name, start = started
+    record(name, (time.perf_counter() - start) * 1000)
+    if exception is not None or (http_response is not None and http_response.status_code >= 400):
+        increment(f"{name}.errors")
+
+
+def instrument_boto_client(client):
+    # Un span por llamada a la API de AWS (incluidos los reintentos de botocore) sin tocar cada punto de llamada.
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is None:
+        return client
+    events.register("before-call", _before_aws_call)
+    events.register("after-call", _after_aws_call)
+    events.register("after-call-error", _after_aws_call)
+    return client
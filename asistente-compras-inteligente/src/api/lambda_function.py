@@ -1,121 +1,493 @@
+from cold_start import lazy_import, timed_init, emit_cold_start_report
+from instrumentation import (log_debug, log_info, log_warning, log_error, log_event, span, record, increment, traced,
+                             record_llm_usage, flush_metrics)
 import json
 import os
-import boto3
-import base64
-import uuid
+import asyncio
 import time
-import requests
 import sys
+import threading
 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import TypedDict, List
-from langchain_aws import ChatBedrock
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import SystemMessage, HumanMessage
-from langgraph.graph import StateGraph, END
+from aws_clients import (ClientFactory, BudgetExceeded, build_http_session, call_within_budget, iter_within_budget,
+                         lambda_budget_seconds, request_budget, start_request_budget, end_request_budget, budget_remaining,
+                         SERVICE_TIMEOUTS)
+from agent_batch import LatencyHistogram, RequestCoalescer, run_bounded, timed_node
+from catalog_index import CatalogIndex, tokenize
+from catalog_store import CatalogStore, CatalogVersion, create_catalog_source, load_catalog_version, CATALOG_SOURCE
+from fast_nlu import FastIntentExtractor, normalize_transcript
+from payloads import (ResponseAudioStore, audio_upload_key, binary_audio_response, create_upload_url, encode_base64,
+                      parse_audio_payload, resolve_response_options)
+from recommendations import VectorIndex, create_embedder, EMBEDDED_FIELDS, EMBEDDING_BACKEND, RECOMMENDATION_MIN_SCORE, STOPWORDS
+from conversation_state import (create_session_store, new_session, merge_entities, can_narrow, add_to_cart, valid_session_id,
+                                SESSION_MAX_RESULT_IDS, SESSION_STORE_BACKEND)
+from response_cache import LRUTTLCache, SQLiteCacheBackend, CacheLevel
+from transcription import BatchTranscribeBackend, StageTimer, StreamingTranscribeBackend, StubTranscriptionBackend
+from speech_synthesis import AudioCache, SpeechSynthesizer, split_sentences
+from response_streaming import clean_response_text, chunk_text, StreamingResponseCleaner, SentenceSegmenter
 
 S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME", "tu-bucket-s3-por-defecto")
 BEDROCK_MODEL_ID = os.environ.get("BEDROCK_MODEL_ID", "amazon.titan-text-express-v1")
 POLLY_VOICE_ID = os.environ.get("POLLY_VOICE_ID", "Lupe")
-AWS_REGION = os.environ.get("AWS_REGION", boto3.Session().region_name or "us-east-1")
+AWS_REGION = os.environ.get("AWS_REGION")
+CATALOG_RESULT_LIMIT = int(os.environ.get("CATALOG_RESULT_LIMIT", "2"))
+CATALOG_IN_STOCK_ONLY = os.environ.get("CATALOG_IN_STOCK_ONLY", "true").lower() == "true"
+CATALOG_SNAPSHOT_PATH = os.environ.get("CATALOG_SNAPSHOT_PATH", "products.catsnap")
+RECOMMENDATION_INDEX_PATH = os.environ.get("RECOMMENDATION_INDEX_PATH", "products.vecidx.npz")
+RECOMMENDATION_RERANK_MAX = int(os.environ.get("RECOMMENDATION_RERANK_MAX", "5000"))
+RECOMMENDATION_SYNC_BUILD_MAX = int(os.environ.get("RECOMMENDATION_SYNC_BUILD_MAX", "5000"))
+RECOMMENDATION_BUILD_WAIT_SECONDS = float(os.environ.get("RECOMMENDATION_BUILD_WAIT_SECONDS", "3"))
+NLU_FAST_PATH_THRESHOLD = float(os.environ.get("NLU_FAST_PATH_THRESHOLD", "0.8"))
+AGENT_CACHE_MAX_ENTRIES = int(os.environ.get("AGENT_CACHE_MAX_ENTRIES", "512"))
+AGENT_CACHE_TTL_SECONDS = float(os.environ.get("AGENT_CACHE_TTL_SECONDS", "900"))
+AGENT_CACHE_BACKEND = os.environ.get("AGENT_CACHE_BACKEND", "memory")
+AGENT_CACHE_PATH = os.environ.get("AGENT_CACHE_PATH", "/tmp/agent_cache.sqlite3")
+AGENT_CACHE_SHARED_MAX_ROWS = int(os.environ.get("AGENT_CACHE_SHARED_MAX_ROWS", "10000"))
+TRANSCRIBE_BACKEND = os.environ.get("TRANSCRIBE_BACKEND", "batch")
+TRANSCRIBE_POLL_INITIAL_SECONDS = float(os.environ.get("TRANSCRIBE_POLL_INITIAL_SECONDS", "0.5"))
+TRANSCRIBE_POLL_MAX_SECONDS = float(os.environ.get("TRANSCRIBE_POLL_MAX_SECONDS", "4"))
+TRANSCRIBE_DEADLINE_SECONDS = float(os.environ.get("TRANSCRIBE_DEADLINE_SECONDS", "120"))
+TRANSCRIBE_SAMPLE_RATE = int(os.environ.get("TRANSCRIBE_SAMPLE_RATE", "16000"))
+POLLY_ENGINE = os.environ.get("POLLY_ENGINE", "standard")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+TTS_PREWARM = os.environ.get("TTS_PREWARM", "true").lower() == "true"
 
+SALUDO_RESPONSE = "¡Hola! Soy tu asistente de compras inteligente. ¿Cómo puedo ayudarte hoy?"
+DESPEDIDA_RESPONSE = "¡Hasta pronto! Que tengas un excelente día."
+NLU_ERROR_RESPONSE = "Lo siento, tuve algunos problemas para entender completamente tu solicitud de voz. ¿Podrías intentar reformularla o ser un poco más específico?"
+DEGRADED_RESPONSE = "Lo siento, estoy tardando más de lo normal en responder. ¿Podrías intentarlo de nuevo en un momento?"
+CATALOG_INTENTS = ["buscar_producto", "pedir_recomendacion", "comparar_productos"]
+CART_INTENTS = ["agregar_carrito", "ver_carrito"]
+RECOMMENDATION_INTENTS = ["pedir_recomendacion", "comparar_productos"]
+STATIC_RESPONSES = [SALUDO_RESPONSE, DESPEDIDA_RESPONSE, NLU_ERROR_RESPONSE, DEGRADED_RESPONSE]
+AGENT_BATCH_MAX_WORKERS = int(os.environ.get("AGENT_BATCH_MAX_WORKERS", "8"))
+AGENT_BATCH_MAX_ITEMS = int(os.environ.get("AGENT_BATCH_MAX_ITEMS", "100"))
+DEFERRED_DRAIN_SECONDS = float(os.environ.get("DEFERRED_DRAIN_SECONDS", "0.5"))
+
+NLU_SYSTEM_PROMPT = (
+    "Tu única función es analizar la consulta del usuario y DEVOLVER ÚNICAMENTE UN OBJETO JSON VÁLIDO. "
+    "NO INCLUYAS NINGÚN TEXTO EXPLICATIVO, SALUDO, COMENTARIO, O CUALQUIER OTRA COSA FUERA DEL OBJETO JSON. "
+    "El objeto JSON debe tener exactamente dos claves de nivel superior: 'intent' (un string con la intención del usuario) y 'entities' (un diccionario que contenga las entidades extraídas como pares clave-valor). "
+    "Las intenciones posibles son: 'buscar_producto', 'comparar_productos', 'pedir_recomendacion', 'agregar_carrito', 'ver_carrito', 'saludar', 'despedirse', 'otra'. "
+    "Las entidades comunes a extraer son: 'nombre_producto', 'marca', 'categoria', 'color', 'talla', 'precio_maximo', 'precio_minimo', 'caracteristicas_adicionales'. "
+    "Para 'precio_maximo' y 'precio_minimo' usa solo el número (ej. 'menos de 500 dólares' -> 'precio_maximo': 500). "
+    "Para la entidad 'categoria', si el usuario menciona un tipo de producto como 'botas de montaña', 'televisor LED', o 'zapatillas para correr', intenta extraer la categoría más específica posible (ej. 'botas de montaña', 'televisor LED', 'zapatillas para correr') o la categoría principal (ej. 'botas', 'televisor', 'zapatillas') como valor para la clave 'categoria' en el diccionario 'entities'. "
+    "Para la entidad 'marca', si el usuario menciona un nombre específico junto al tipo de producto (ej. 'televisor SuperVision'), considera ese nombre como la marca. Extrae el nombre tal cual lo dice el usuario como valor para la clave 'marca' en 'entities'. "
+    "Si una entidad no se encuentra, no incluyas su clave en el diccionario 'entities'. "
+    "Si la intención no es clara o no hay entidades útiles, usa la intención 'otra' y un diccionario 'entities' vacío. "
+    "La estructura general del JSON que debes devolver es: {\"intent\": \"valor_de_la_intencion\", \"entities\": {\"nombre_entidad_1\": \"valor_entidad_1\", \"nombre_entidad_2\": \"valor_entidad_2\"}}. "
+    "REPITO: Tu respuesta DEBE SER SOLO EL OBJETO JSON y nada más."
+)
+RESPONSE_HUMAN_INSTRUCTION = (
+    "Basándote en el contexto anterior, formula una respuesta ÚNICA, CONVERSACIONAL, AMIGABLE y DIRECTA para el usuario. "
+    "NO simules múltiples turnos de conversación. NO uses prefijos como 'Bot:'. NO uses comillas innecesarias alrededor de toda tu respuesta. "
+    "Simplemente proporciona la frase que el asistente debería decir."
+)
+RESPONSE_SYSTEM_PROMPTS = {
+    "sin_resultados": (
+        "Eres un asistente de compras virtual servicial y empático. "
+        "Tu tarea es informar al usuario de manera clara y amigable que no se encontraron productos para su búsqueda. "
+        "Anímale a intentar con diferentes términos, a ser más general, o pregunta si puedes ayudarle con otra cosa. "
+    ),
+    "sin_catalogo": (
+        "Eres un asistente de compras virtual servicial y empático. "
+        "Responde de forma concisa, amigable y directa a la consulta del usuario basándote en la intención y el contexto proporcionado. "
+    ),
+    "con_resultados": (
+        "Eres un asistente de compras virtual experto, amigable y servicial. "
+        "Basándote en la consulta del usuario y los productos encontrados (listados en el contexto), "
+        "genera una respuesta ÚNICA, FLUIDA, CONVERSACIONAL y DIRECTA. "
+        "Presenta la información de manera clara y útil. Si hay productos, menciona uno o dos de los más relevantes. "
+        "Puedes concluir preguntando si desea más detalles sobre alguno en particular, si quiere ver otras opciones, o si hay algo más en lo que puedas asistir. "
+        "Ejemplo de una buena respuesta si encuentras 'Botas de Montaña TerraTrek': 'Encontré las Botas de Montaña TerraTrek. Son impermeables y cuestan $180.00. ¿Te gustaría saber más detalles sobre estas botas o prefieres que busque otras opciones?'"
+    ),
+}
+
+client_factory = None
 s3_client = None
 transcribe_client = None
 bedrock_runtime_client = None
 polly_client = None
+http_session = None
+transcription_backend = None
+speech_synthesizer = None
+response_audio_store = None
 llm = None
-PRODUCT_DATABASE = None
+BACKGROUND_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lambda-background")
+# Pool propio para lo diferido de cada petición (borrado del audio en S3, logs): no espera detrás de una
+# construcción del índice de recomendaciones en BACKGROUND_EXECUTOR.
+DEFERRED_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lambda-deferred")
+CATALOG = None
+CATALOG_STORE = None
+RECOMMENDER_LOCK = threading.Lock()
+FAST_NLU_FIELDS = {"categoria", "marca", "colores", "tallas_disponibles"}
+FAST_NLU_STATS = {"calls": 0, "hits": 0, "total_ms": 0.0}
+NLU_CACHE = None
+RESPONSE_CACHE = None
+SESSION_STORE = None
 agent_app = None
+PROMPT_TEMPLATES = None
+
+def get_aws_region():
+    global AWS_REGION
+    if AWS_REGION is None:
+        AWS_REGION = lazy_import("boto3").Session().region_name or "us-east-1"
+    return AWS_REGION
+
+def get_prompt_templates():
+    global PROMPT_TEMPLATES
+    if PROMPT_TEMPLATES is not None:
+        return PROMPT_TEMPLATES
+    ChatPromptTemplate = lazy_import("langchain_core.prompts").ChatPromptTemplate
+    SystemMessage = lazy_import("langchain_core.messages").SystemMessage
+    templates = {"nlu": ChatPromptTemplate.from_messages([
+        SystemMessage(content=NLU_SYSTEM_PROMPT),
+        ("human", "Analiza esta consulta: {userInput}")
+    ])}
+    for key, system_prompt in RESPONSE_SYSTEM_PROMPTS.items():
+        templates[key] = ChatPromptTemplate.from_messages([
+            SystemMessage(content=system_prompt),
+            ("human", "{context}")
+        ])
+    PROMPT_TEMPLATES = templates
+    return PROMPT_TEMPLATES
+
+def get_client_factory():
+    global client_factory
+    if client_factory is None:
+        client_factory = ClientFactory(get_aws_region())
+    return client_factory
 
 def initialize_aws_clients():
-    global s3_client, transcribe_client, bedrock_runtime_client, polly_client, llm
+    global s3_client, transcribe_client, bedrock_runtime_client, polly_client, http_session
     
     if s3_client is None:
-        s3_client = boto3.client('s3', region_name=AWS_REGION)
+        s3_client = get_client_factory().client('s3')
     if transcribe_client is None:
-        transcribe_client = boto3.client('transcribe', region_name=AWS_REGION)
+        transcribe_client = get_client_factory().client('transcribe')
     if bedrock_runtime_client is None:
-        bedrock_runtime_client = boto3.client('bedrock-runtime', region_name=AWS_REGION)
+        bedrock_runtime_client = get_client_factory().client('bedrock-runtime')
     if polly_client is None:
-        polly_client = boto3.client('polly', region_name=AWS_REGION)
+        polly_client = get_client_factory().client('polly')
+    if http_session is None:
+        http_session = build_http_session()
     
+    initialize_llm()
+    log_debug("Clientes AWS y LLM inicializados/verificados.")
+
+def initialize_llm():
+    # El modo texto solo necesita Bedrock: no crea los clientes de S3, Transcribe ni Polly.
+    global bedrock_runtime_client, llm
+    if bedrock_runtime_client is None:
+        bedrock_runtime_client = get_client_factory().client('bedrock-runtime')
     if llm is None and bedrock_runtime_client:
         try:
-            llm = ChatBedrock(
+            llm = lazy_import("langchain_aws").ChatBedrock(
                 client=bedrock_runtime_client,
                 model_id=BEDROCK_MODEL_ID,
                 model_kwargs={"temperature": 0.1}
             )
         except Exception as e:
-            print(f"Error inicializando LLM del Agente: {e}")
+            log_error(f"Error inicializando LLM del Agente: {e}")
             raise e 
-    print("Clientes AWS y LLM inicializados/verificados.")
+
+def initialize_agent_caches():
+    global NLU_CACHE, RESPONSE_CACHE
+    if NLU_CACHE is not None and RESPONSE_CACHE is not None:
+        return
+    shared_backend = None
+    if AGENT_CACHE_BACKEND == "sqlite":
+        try:
+            shared_backend = SQLiteCacheBackend(AGENT_CACHE_PATH, ttl_seconds=AGENT_CACHE_TTL_SECONDS, max_rows=AGENT_CACHE_SHARED_MAX_ROWS)
+        except Exception as e:
+            log_warning(f"Error inicializando caché compartida en '{AGENT_CACHE_PATH}', se usará solo memoria: {e}")
+    NLU_CACHE = CacheLevel("nlu", LRUTTLCache(AGENT_CACHE_MAX_ENTRIES, AGENT_CACHE_TTL_SECONDS), shared_backend)
+    RESPONSE_CACHE = CacheLevel("response", LRUTTLCache(AGENT_CACHE_MAX_ENTRIES, AGENT_CACHE_TTL_SECONDS), shared_backend)
+    invalidate_agent_caches()
+    log_info(f"Cachés del agente inicializadas (backend: {AGENT_CACHE_BACKEND if shared_backend else 'memory'}).")
+
+def get_session_store():
+    global SESSION_STORE
+    if SESSION_STORE is None:
+        try:
+            SESSION_STORE = create_session_store(SESSION_STORE_BACKEND)
+        except Exception as e:
+            log_warning(f"Error inicializando el almacén de sesiones '{SESSION_STORE_BACKEND}', se usará memoria: {e}")
+            SESSION_STORE = create_session_store("memory")
+    return SESSION_STORE
+
+def load_session(session_id):
+    if session_id is None:
+        return None
+    try:
+        return get_session_store().load(session_id)
+    except Exception as e:
+        log_warning(f"Error leyendo la sesión '{session_id}', se empieza una nueva: {e}")
+        return new_session()
+
+def save_session(session_id, agent_final_state):
+    # Persiste el estado del turno (entidades combinadas, ids de resultados y carrito) y lo devuelve para la respuesta.
+    if session_id is None:
+        return None
+    session = dict(agent_final_state.get("session") or new_session())
+    session["lastIntent"] = agent_final_state.get("intent", "")
+    session["turns"] += 1
+    try:
+        get_session_store().save(session_id, session)
+    except Exception as e:
+        log_warning(f"Error guardando la sesión '{session_id}': {e}")
+    return session
+
+def invalidate_agent_caches():
+    for cache in (NLU_CACHE, RESPONSE_CACHE):
+        if cache is not None:
+            cache.invalidate(CATALOG.fingerprint if CATALOG is not None else "")
 
 class AgentState(TypedDict):
     userInput: str
+    session: dict
     intent: str
     entities: dict
     catalogQueryResult: List[dict]
+    catalogMatchCount: int
     finalResponse: str
     callLog: List[str]
 
+def iter_catalog_fields(products, fields):
+    return products.iter_fields(fields) if hasattr(products, "iter_fields") else products
+
+def install_catalog(version):
+    # Publica una versión del catálogo con una sola asignación; cada nodo lee CATALOG una vez y trabaja sobre esa versión.
+    global CATALOG
+    previous = CATALOG
+    changed = previous is None or previous.fingerprint != version.fingerprint
+    CATALOG = version
+    if changed:
+        invalidate_agent_caches()
+    if version.recommender is None:
+        # El índice de recomendaciones se prepara al cargar cada versión, no con la primera petición que lo necesita.
+        start_recommender(version)
+
+def prepare_catalog_version(version, previous, delta):
+    # Antes de publicar una versión: la NLU por reglas y el recomendador se derivan de la anterior cuando basta con el
+    # delta (sin valores nuevos de categoría, marca, color o talla; solo se embeben los productos modificados).
+    if delta is not None and previous.fast_nlu is not None and previous.fast_nlu.covers(delta["upsert"]):
+        version.fast_nlu = previous.fast_nlu
+    else:
+        version.fast_nlu = FastIntentExtractor(iter_catalog_fields(version.products, FAST_NLU_FIELDS))
+    if delta is not None and previous.recommender is not None:
+        recommender = previous.recommender.copy()
+        recommender.upsert(delta["upsert"])
+        recommender.remove(delta["delete"])
+        recommender.source_fingerprint = version.fingerprint
+        version.recommender = recommender
+
 def load_product_database_lambda():
-    global PRODUCT_DATABASE
-    if PRODUCT_DATABASE is not None:
-        return PRODUCT_DATABASE
+    global CATALOG_STORE
+    if CATALOG is not None:
+        return CATALOG.products
 
     db_path = "products.json" 
     if not os.path.exists(db_path):
         db_path = os.path.join("data", "products.json")
 
+    version = None
+    snapshot_path = CATALOG_SNAPSHOT_PATH
+    if snapshot_path and not os.path.exists(snapshot_path):
+        snapshot_path = os.path.join("data", snapshot_path)
+    if snapshot_path and os.path.exists(snapshot_path) and os.path.exists(db_path) and os.path.getmtime(db_path) > os.path.getmtime(snapshot_path):
+        log_warning(f"LAMBDA_CATALOG_WARNING: '{db_path}' es más reciente que el snapshot '{snapshot_path}'; se carga el JSON.")
+    elif snapshot_path and os.path.exists(snapshot_path):
+        try:
+            # Snapshot binario generado offline (catalog_snapshot.py): índices ya construidos y filas leídas bajo demanda.
+            version = load_catalog_version(snapshot_path)
+            log_info(f"Base de datos de productos (Lambda) cargada desde el snapshot '{snapshot_path}' ({len(version)} productos)")
+        except Exception as e:
+            log_error(f"LAMBDA_CATALOG_ERROR: Snapshot '{snapshot_path}' no utilizable ({e}); se carga el JSON.")
+
+    if version is None:
+        try:
+            version = load_catalog_version(db_path)
+            log_info(f"Base de datos de productos (Lambda) cargada desde '{db_path}' e indexada ({len(version)} productos)")
+        except FileNotFoundError:
+            log_error(f"LAMBDA_CATALOG_ERROR: Archivo DB no encontrado en '{db_path}'.")
+            version = CatalogVersion([], CatalogIndex([]), "")
+        except Exception as e:
+            log_error(f"LAMBDA_CATALOG_ERROR: Error cargando DB: {e}")
+            version = CatalogVersion([], CatalogIndex([]), "")
+    prepare_catalog_version(version, None, None)
+    install_catalog(version)
+    if CATALOG_SOURCE:
+        # Recarga en caliente desde el manifiesto versionado (catalog_store.py); el catálogo empaquetado es la versión inicial.
+        try:
+            CATALOG_STORE = CatalogStore(create_catalog_source(CATALOG_SOURCE, get_client_factory()), version,
+                                         publish=install_catalog, prepare=prepare_catalog_version)
+        except Exception as e:
+            log_error(f"LAMBDA_CATALOG_ERROR: Origen de recarga '{CATALOG_SOURCE}' no utilizable: {e}")
+    return CATALOG.products
+
+def refresh_catalog():
+    # Al inicio de cada invocación: como mucho una comprobación por intervalo, en segundo plano.
+    if CATALOG_STORE is not None:
+        CATALOG_STORE.maybe_reload()
+
+def recommendation_index_path():
+    index_path = RECOMMENDATION_INDEX_PATH
+    if index_path and not os.path.exists(index_path):
+        index_path = os.path.join("data", index_path)
+    return index_path if index_path and os.path.exists(index_path) else None
+
+def build_recommender(catalog):
+    # Si existe un índice precalculado (recommendations.py --build) se carga y, si es de otra versión del catálogo,
+    # se sincroniza embebiendo solo los productos nuevos o modificados; si no, se embebe el catálogo completo.
+    embedder = create_embedder(EMBEDDING_BACKEND, get_client_factory().client('bedrock-runtime') if EMBEDDING_BACKEND == "bedrock" else None)
+    index_path = recommendation_index_path()
+    start = time.perf_counter()
+    recommender = None
+    if index_path is not None:
+        try:
+            recommender = VectorIndex.load(index_path, embedder)
+            if recommender is None:
+                log_warning(f"LAMBDA_RECOMMEND_WARNING: '{index_path}' es de otro backend de embeddings; se reconstruye.")
+        except Exception as e:
+            log_error(f"LAMBDA_RECOMMEND_ERROR: Índice '{index_path}' no utilizable ({e}); se reconstruye.")
+    if recommender is None:
+        recommender = VectorIndex(embedder)
+    if recommender.source_fingerprint != catalog.fingerprint or not catalog.fingerprint:
+        recommender.sync(iter_catalog_fields(catalog.products, EMBEDDED_FIELDS))
+        recommender.source_fingerprint = catalog.fingerprint
+    record("recommendations.index_load", (time.perf_counter() - start) * 1000)
+    log_info(f"Índice de recomendaciones listo ({len(recommender)} productos, backend {embedder.name}, {recommender.nbytes()} bytes).")
+    return recommender
+
+def try_build_recommender(catalog):
     try:
-        with open(db_path, 'r', encoding='utf-8') as f:
-            PRODUCT_DATABASE = json.load(f)
-        print(f"Base de datos de productos (Lambda) cargada desde '{db_path}'")
-        return PRODUCT_DATABASE
-    except FileNotFoundError:
-        print(f"LAMBDA_CATALOG_ERROR: Archivo DB no encontrado en '{db_path}'.")
-        PRODUCT_DATABASE = []
-        return []
+        catalog.recommender = build_recommender(catalog)
     except Exception as e:
-        print(f"LAMBDA_CATALOG_ERROR: Error cargando DB: {e}")
-        PRODUCT_DATABASE = []
-        return []
+        log_error(f"LAMBDA_RECOMMEND_ERROR: No se pudo construir el índice de recomendaciones: {e}")
+
+def start_recommender(catalog):
+    # Con vectores precalculados (.npz) o un catálogo pequeño con embeddings locales el índice se construye en el
+    # momento; si no, en segundo plano, y mientras tanto recommend_rows responde sin él.
+    if recommendation_index_path() is not None or (EMBEDDING_BACKEND == "local" and len(catalog) <= RECOMMENDATION_SYNC_BUILD_MAX):
+        with RECOMMENDER_LOCK:
+            if catalog.recommender is None:
+                try_build_recommender(catalog)
+        return
+    get_recommender(catalog)
+
+def get_recommender(catalog):
+    # Devuelve el índice de la versión o None mientras se construye; una construcción fallida se reintenta.
+    if catalog.recommender is None and (catalog.recommender_build is None or catalog.recommender_build.done()):
+        with RECOMMENDER_LOCK:
+            if catalog.recommender is None and (catalog.recommender_build is None or catalog.recommender_build.done()):
+                catalog.recommender_build = BACKGROUND_EXECUTOR.submit(try_build_recommender, catalog)
+    return catalog.recommender
+
+def keyword_rows(catalog, query, limit):
+    # Respaldo mientras se construye el índice vectorial: productos con alguna palabra de la frase, ordenados por BM25.
+    terms = [term for term in tokenize(query) if term not in STOPWORDS]
+    rows = catalog.index.rows_with_terms(terms)
+    if CATALOG_IN_STOCK_ONLY:
+        rows = catalog.index.rows_in_stock(rows)
+    return catalog.index.rank_rows(rows, {"nombre_producto": " ".join(terms)}, limit)
+
+def pending_recommendation_rows(catalog, query, rows, limit, current_call_log):
+    # Índice aún en construcción: las coincidencias estrictas o, si no hay, las de texto; solo si tampoco hay se espera
+    # a que termine el índice, sin pasar de RECOMMENDATION_BUILD_WAIT_SECONDS ni del presupuesto de la petición.
+    increment("recommendations.index_pending")
+    fallback = rows[:limit] if rows else keyword_rows(catalog, query, limit)
+    build = catalog.recommender_build
+    if not fallback and build is not None:
+        remaining = budget_remaining()
+        wait_seconds = RECOMMENDATION_BUILD_WAIT_SECONDS if remaining is None else max(0.0, min(RECOMMENDATION_BUILD_WAIT_SECONDS, remaining))
+        try:
+            build.result(timeout=wait_seconds)
+        except FutureTimeoutError:
+            pass
+        if catalog.recommender is not None:
+            return None
+    current_call_log.append(f"LAMBDA_RECOMMEND: Mode='{'strict' if rows else 'keywords'}_pending', Candidates='{len(rows)}', Results='{len(fallback)}'")
+    return fallback
+
+def recommend_rows(catalog: CatalogVersion, user_input: str, entities: dict, rows: List[int], limit: int, current_call_log: List[str]):
+    # Recomendaciones por similitud con la frase del usuario: reordena las coincidencias estrictas (`rows`) o, si no
+    # hay ninguna, busca en todo el catálogo ("algo para ver películas en un cuarto pequeño" no nombra un producto).
+    query = " ".join([user_input or ""] + [str(value) for value in (entities or {}).values()])
+    if get_recommender(catalog) is None:
+        fallback = pending_recommendation_rows(catalog, query, rows, limit, current_call_log)
+        if fallback is not None:
+            return fallback
+    recommender = catalog.recommender
+    candidate_ids = [catalog.index.products[row].get("id") for row in rows] if rows else None
+    with span("recommendations.search"):
+        hits = recommender.search([query], k=limit if rows else limit * 4, candidate_ids=candidate_ids)[0]
+    if rows and (not hits or hits[0][1] <= 0):
+        return rows[:limit]
+    if not rows:
+        increment("recommendations.semantic_fallback")
+        hits = [(product_id, score) for product_id, score in hits if score >= RECOMMENDATION_MIN_SCORE]
+    ranked = catalog.index.rows_for_ids([product_id for product_id, _ in hits])
+    if not rows and CATALOG_IN_STOCK_ONLY:
+        ranked = [row for row in ranked if catalog.index.in_stock(row)]
+    current_call_log.append(f"LAMBDA_RECOMMEND: Mode='{'rerank' if rows else 'semantic'}', Candidates='{len(rows) if rows else len(catalog.index)}', "
+                            f"Hits='{json.dumps([[product_id, round(score, 3)] for product_id, score in hits[:limit]])}'")
+    return ranked[:limit]
+
+def run_fast_path_nlu(user_input: str, current_call_log: List[str]):
+    fast_nlu = CATALOG.fast_nlu if CATALOG is not None else None
+    if fast_nlu is None:
+        return None
+    start = time.perf_counter()
+    intent, entities, confidence = fast_nlu.extract(user_input)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    hit = confidence >= NLU_FAST_PATH_THRESHOLD
+    FAST_NLU_STATS["calls"] += 1
+    FAST_NLU_STATS["total_ms"] += elapsed_ms
+    if hit:
+        FAST_NLU_STATS["hits"] += 1
+    increment("nlu.fast_path.hit" if hit else "nlu.fast_path.miss")
+    current_call_log.append(
+        f"LAMBDA_NLU_FAST_PATH: Hit='{hit}', Confidence='{confidence:.2f}', Latency='{elapsed_ms:.2f}ms', "
+        f"HitRate='{FAST_NLU_STATS['hits']}/{FAST_NLU_STATS['calls']}', AvgLatency='{FAST_NLU_STATS['total_ms'] / FAST_NLU_STATS['calls']:.2f}ms'"
+    )
+    if not hit:
+        return None
+    log_debug(f"NLU por ruta rápida (confianza {confidence:.2f}): {intent} {entities}")
+    current_call_log.append(f"LAMBDA_NLU: Input='{user_input}', Intent='{intent}', Entities='{json.dumps(entities)}', Source='fast_path'")
+    return {"intent": intent, "entities": entities, "callLog": current_call_log}
 
 def interpret_user_input_lambda(state: AgentState):
-    print("---LAMBDA AGENTE NODO: Interpretando Entrada---")
+    log_debug("---LAMBDA AGENTE NODO: Interpretando Entrada---")
     user_input = state["userInput"]
     current_call_log = state.get("callLog", [])
+    fast_result = run_fast_path_nlu(user_input, current_call_log)
+    if fast_result is not None:
+        return fast_result
+    nlu_cache_key = normalize_transcript(user_input)
+    if NLU_CACHE is not None:
+        cached_nlu = NLU_CACHE.get(nlu_cache_key)
+        current_call_log.append(f"LAMBDA_CACHE: Level='nlu', Hit='{cached_nlu is not None}', Stats='{NLU_CACHE.stats()}'")
+        if cached_nlu is not None:
+            log_debug(f"NLU desde caché para '{nlu_cache_key}': {cached_nlu}")
+            current_call_log.append(f"LAMBDA_NLU: Input='{user_input}', Intent='{cached_nlu['intent']}', Entities='{json.dumps(cached_nlu['entities'])}', Source='cache'")
+            return {"intent": cached_nlu["intent"], "entities": dict(cached_nlu["entities"]), "callLog": current_call_log}
     global llm
     if llm is None:
-        print("Error crítico en interpret_user_input_lambda: LLM no está inicializado.")
+        log_error("Error crítico en interpret_user_input_lambda: LLM no está inicializado.")
         current_call_log.append("LAMBDA_NLU_ERROR: LLM no inicializado.")
         return {"intent": "error_nlu_llm", "entities": {}, "callLog": current_call_log}
 
-    prompt_template = ChatPromptTemplate.from_messages([
-        SystemMessage(
-            content=(
-                "Tu única función es analizar la consulta del usuario y DEVOLVER ÚNICAMENTE UN OBJETO JSON VÁLIDO. "
-                "NO INCLUYAS NINGÚN TEXTO EXPLICATIVO, SALUDO, COMENTARIO, O CUALQUIER OTRA COSA FUERA DEL OBJETO JSON. "
-                "El objeto JSON debe tener exactamente dos claves de nivel superior: 'intent' (un string con la intención del usuario) y 'entities' (un diccionario que contenga las entidades extraídas como pares clave-valor). "
-                "Las intenciones posibles son: 'buscar_producto', 'comparar_productos', 'pedir_recomendacion', 'ver_carrito', 'saludar', 'despedirse', 'otra'. "
-                "Las entidades comunes a extraer son: 'nombre_producto', 'marca', 'categoria', 'color', 'talla', 'precio_maximo', 'caracteristicas_adicionales'. "
-                "Para la entidad 'categoria', si el usuario menciona un tipo de producto como 'botas de montaña', 'televisor LED', o 'zapatillas para correr', intenta extraer la categoría más específica posible (ej. 'botas de montaña', 'televisor LED', 'zapatillas para correr') o la categoría principal (ej. 'botas', 'televisor', 'zapatillas') como valor para la clave 'categoria' en el diccionario 'entities'. "
-                "Para la entidad 'marca', si el usuario menciona un nombre específico junto al tipo de producto (ej. 'televisor SuperVision'), considera ese nombre como la marca. Extrae el nombre tal cual lo dice el usuario como valor para la clave 'marca' en 'entities'. "
-                "Si una entidad no se encuentra, no incluyas su clave en el diccionario 'entities'. "
-                "Si la intención no es clara o no hay entidades útiles, usa la intención 'otra' y un diccionario 'entities' vacío. "
-                "La estructura general del JSON que debes devolver es: {\"intent\": \"valor_de_la_intencion\", \"entities\": {\"nombre_entidad_1\": \"valor_entidad_1\", \"nombre_entidad_2\": \"valor_entidad_2\"}}. "
-                "REPITO: Tu respuesta DEBE SER SOLO EL OBJETO JSON y nada más."
-            )
-        ),
-        HumanMessage(content=f"Analiza esta consulta: {user_input}")
-    ])
     response_content = ""
     parsed_json_string = ""
     try:
-        formatted_prompt = prompt_template.format_messages(userInput=user_input)
-        ai_response = llm.invoke(formatted_prompt)
+        formatted_prompt = get_prompt_templates()["nlu"].format_messages(userInput=user_input)
+        ai_response = call_within_budget("llm.nlu", llm.invoke, formatted_prompt)
+        increment("llm.nlu.calls")
+        record_llm_usage(ai_response, "llm.nlu")
         response_content = ai_response.content.strip()
-        print(f"Respuesta cruda del LLM para NLU (Agente-Titan, extracción mejorada): {response_content}")
+        log_debug(f"Respuesta cruda del LLM para NLU (Agente-Titan, extracción mejorada): {response_content}")
         
         json_start_index = response_content.find('{')
         if json_start_index != -1:
@@ -125,111 +497,154 @@ def interpret_user_input_lambda(state: AgentState):
                 elif char == '}': open_braces -= 1
                 if open_braces == 0 and char == '}':
                     parsed_json_string = response_content[json_start_index : json_start_index + i + 1]
-                    print(f"String JSON extraído por contador de llaves: {parsed_json_string}")
+                    log_debug(f"String JSON extraído por contador de llaves: {parsed_json_string}")
                     break
             if not parsed_json_string:
-                print("Contador de llaves no encontró un JSON balanceado.")
+                log_debug("Contador de llaves no encontró un JSON balanceado.")
         
         if not parsed_json_string:
-            print("No se pudo aislar un string JSON claro. Intentando parsear la respuesta cruda (puede fallar).")
+            log_debug("No se pudo aislar un string JSON claro. Intentando parsear la respuesta cruda (puede fallar).")
             parsed_json_string = response_content
 
         parsed_response = json.loads(parsed_json_string)
         intent = parsed_response.get("intent", "otra")
         entities = parsed_response.get("entities", {})
+        if NLU_CACHE is not None and isinstance(entities, dict):
+            NLU_CACHE.set(nlu_cache_key, {"intent": intent, "entities": dict(entities)})
         current_call_log.append(f"LAMBDA_NLU: Input='{user_input}', Intent='{intent}', Entities='{json.dumps(entities)}', ParsedJSON='{parsed_json_string[:100]}...' ,LLM_Raw_Output='{response_content[:100]}...'")
-        print(f"Intención extraída (Agente, extracción mejorada): {intent}")
-        print(f"Entidades extraídas (Agente, extracción mejorada): {entities}")
+        log_debug(f"Intención extraída (Agente, extracción mejorada): {intent}")
+        log_debug(f"Entidades extraídas (Agente, extracción mejorada): {entities}")
         return {"intent": intent, "entities": entities, "callLog": current_call_log}
+    except BudgetExceeded as e:
+        log_warning(f"NLU degradada: {e}")
+        return degraded_nlu_result(user_input, current_call_log)
     except json.JSONDecodeError as e:
-        print(f"Error FINAL al decodificar la respuesta JSON del LLM (Agente-Titan, extracción mejorada): {e}")
-        print(f"String que se intentó parsear como JSON: '{parsed_json_string}'")
-        print(f"Respuesta cruda completa del LLM: '{response_content}'")
+        log_error(f"Error FINAL al decodificar la respuesta JSON del LLM (Agente-Titan, extracción mejorada): {e}")
+        log_debug(f"String que se intentó parsear como JSON: '{parsed_json_string}'")
+        log_debug(f"Respuesta cruda completa del LLM: '{response_content}'")
         current_call_log.append(f"LAMBDA_NLU_ERROR: JSONDecodeError. AttemptedParse='{parsed_json_string[:100]}...', LLM_Raw_Output='{response_content[:100]}...'")
         return {"intent": "error_nlu_format", "entities": {}, "callLog": current_call_log}
     except Exception as e:
-        print(f"Error inesperado durante la NLU (Agente-Titan, extracción mejorada): {e}")
+        log_error(f"Error inesperado durante la NLU (Agente-Titan, extracción mejorada): {e}")
         current_call_log.append(f"LAMBDA_NLU_ERROR: Exception - {str(e)}")
         return {"intent": "error_nlu_unexpected", "entities": {}, "callLog": current_call_log}
 
+def degraded_nlu_result(user_input: str, current_call_log: List[str]):
+    # Sin tiempo para Bedrock: se acepta la NLU por reglas aunque su confianza no alcance el umbral.
+    fast_nlu = CATALOG.fast_nlu if CATALOG is not None else None
+    intent, entities, confidence = fast_nlu.extract(user_input) if fast_nlu is not None else ("otra", {}, 0.0)
+    if not confidence:
+        current_call_log.append("LAMBDA_NLU_ERROR: Timeout - presupuesto de latencia agotado.")
+        return {"intent": "error_nlu_timeout", "entities": {}, "callLog": current_call_log}
+    current_call_log.append(f"LAMBDA_NLU: Input='{user_input}', Intent='{intent}', Entities='{json.dumps(entities)}', Source='fast_path_degraded', Confidence='{confidence:.2f}'")
+    return {"intent": intent, "entities": entities, "callLog": current_call_log}
+
 def query_product_catalog_lambda(state: AgentState):
-    print("---LAMBDA AGENTE NODO: Consultando Catálogo---")
+    log_debug("---LAMBDA AGENTE NODO: Consultando Catálogo---")
     entities = state.get("entities", {})
     intent = state.get("intent", "")
     current_call_log = state.get("callLog", [])
-    global PRODUCT_DATABASE
-    if PRODUCT_DATABASE is None or not PRODUCT_DATABASE:
-        print("Error: Base de datos de productos (Lambda) no disponible.")
+    catalog = CATALOG
+    if catalog is None or not len(catalog):
+        log_error("Error: Base de datos de productos (Lambda) no disponible.")
         current_call_log.append("LAMBDA_CATALOG_ERROR: DB no disponible.")
-        return {"catalogQueryResult": [], "callLog": current_call_log}
+        return {"catalogQueryResult": [], "catalogMatchCount": 0, "callLog": current_call_log}
 
-    if intent not in ["buscar_producto", "pedir_recomendacion", "comparar_productos"]:
+    if entities and intent in CATALOG_INTENTS + CART_INTENTS:
+        entities, corrections = catalog.index.correct_entities(entities)
+        if corrections:
+            increment("catalog.fuzzy_corrections", len(corrections))
+            current_call_log.append(f"LAMBDA_CATALOG_FUZZY: Corrections='{json.dumps(corrections, ensure_ascii=False)}'")
+    session = state.get("session")
+    if session is not None and intent in CATALOG_INTENTS + CART_INTENTS:
+        return query_catalog_with_session(state, session, entities, catalog)
+    if intent not in CATALOG_INTENTS:
         current_call_log.append(f"LAMBDA_CATALOG_SKIP: Intención '{intent}'.")
-        return {"catalogQueryResult": [], "callLog": current_call_log}
-    print(f"Consultando catálogo (Agente, Lógica Refinada) con entidades: {entities}")
+        return {"catalogQueryResult": [], "catalogMatchCount": 0, "callLog": current_call_log}
+    log_debug(f"Consultando catálogo (Agente, Lógica Refinada) con entidades: {entities}")
     results = []
-    if not entities:
-        print("No se proporcionaron entidades específicas para filtrar el catálogo.")
+    match_count = 0
+    if intent in RECOMMENDATION_INTENTS:
+        rows, match_count = catalog.index.search_rows(entities, limit=RECOMMENDATION_RERANK_MAX, in_stock_only=CATALOG_IN_STOCK_ONLY)
+        rows = recommend_rows(catalog, state.get("userInput", ""), entities, rows, CATALOG_RESULT_LIMIT, current_call_log)
+        results, match_count = [catalog.index.products[row] for row in rows], match_count or len(rows)
+    elif not entities:
+        log_debug("No se proporcionaron entidades específicas para filtrar el catálogo.")
         results = []
     else:
-        for product in PRODUCT_DATABASE:
-            match_score = 0; perfect_match_needed = 0
-            entity_categoria = entities.get("categoria", "").lower()
-            if entity_categoria:
-                perfect_match_needed += 1
-                product_categoria_actual = product.get("categoria", "").lower()
-                if entity_categoria in product_categoria_actual or product_categoria_actual in entity_categoria: match_score += 1
-                elif entity_categoria in product.get("nombre", "").lower(): match_score += 0.5
-            entity_marca = entities.get("marca", "").lower()
-            if entity_marca:
-                perfect_match_needed += 1
-                if entity_marca in product.get("marca", "").lower(): match_score += 1
-            entity_nombre_producto = entities.get("nombre_producto", "").lower()
-            if entity_nombre_producto:
-                perfect_match_needed +=1
-                if entity_nombre_producto in product.get("nombre", "").lower(): match_score += 1
-            entity_tamano = entities.get("tamaño", "").lower()
-            if entity_tamano:
-                perfect_match_needed +=1
-                tamano_numerico_entidad = "".join(filter(str.isdigit, entity_tamano))
-                if tamano_numerico_entidad:
-                    if tamano_numerico_entidad in product.get("nombre", "").lower() or \
-                       any(tamano_numerico_entidad in str(car).lower() for car in product.get("caracteristicas", [])):
-                        match_score += 1
-            entity_color = entities.get("color", "").lower()
-            if entity_color:
-                perfect_match_needed +=1
-                product_colores = [str(c).lower() for c in product.get("colores", [])]
-                if product_colores and entity_color in product_colores: match_score += 1
-            entity_talla = str(entities.get("talla", ""))
-            if entity_talla:
-                perfect_match_needed +=1
-                product_tallas = [str(t) for t in product.get("tallas_disponibles", [])]
-                if product_tallas and entity_talla in product_tallas: match_score += 1
-            if perfect_match_needed > 0 and match_score >= perfect_match_needed:
-                results.append(product)
+        results, match_count = catalog.index.search(entities, limit=CATALOG_RESULT_LIMIT, in_stock_only=CATALOG_IN_STOCK_ONLY)
     
     if not results:
-        print("No se encontraron productos que coincidan exactamente con todas las entidades proporcionadas.")
+        log_debug("No se encontraron productos que coincidan exactamente con todas las entidades proporcionadas.")
         current_call_log.append(f"LAMBDA_CATALOG_QUERY: Entities='{json.dumps(entities)}', Result='No products found (strict match)'")
     else:
-        print(f"Productos encontrados (Lógica Refinada): {len(results)}")
+        log_debug(f"Productos encontrados (Lógica Refinada): {match_count}, devolviendo los {len(results)} mejores")
         summary_results = [{"id": p.get("id"), "nombre": p.get("nombre")} for p in results[:3]]
-        current_call_log.append(f"LAMBDA_CATALOG_QUERY: Entities='{json.dumps(entities)}', Found='{len(results)} items', ExampleResults='{json.dumps(summary_results)}'")
-    return {"catalogQueryResult": results, "callLog": current_call_log}
+        current_call_log.append(f"LAMBDA_CATALOG_QUERY: Entities='{json.dumps(entities)}', Found='{match_count} items', ExampleResults='{json.dumps(summary_results)}'")
+    return {"entities": entities, "catalogQueryResult": results, "catalogMatchCount": match_count, "callLog": current_call_log}
 
-def generate_response_lambda(state: AgentState):
-    print("---LAMBDA AGENTE NODO: Generando Respuesta (Prompt Fluidez v2)---")
+def query_catalog_with_session(state: AgentState, session: dict, entities: dict, catalog: CatalogVersion):
+    # Turno dentro de una conversación: combina las entidades con las anteriores y, si solo se añaden restricciones
+    # ("¿y en color negro?"), filtra los resultados del turno anterior en lugar de volver a consultar el catálogo.
+    intent = state.get("intent", "")
+    current_call_log = state.get("callLog", [])
+    session = dict(session, cart=list(session["cart"]))
+    previous_rows = catalog.index.rows_for_ids(session["resultIds"])
+
+    if intent in CART_INTENTS:
+        if intent == "agregar_carrito":
+            rows = catalog.index.search_rows(entities, limit=1, candidate_rows=previous_rows)[0] if entities else previous_rows[:1]
+            for row in rows:
+                add_to_cart(session, catalog.index.products[row].get("id"))
+        else:
+            rows = catalog.index.rows_for_ids(session["cart"])
+        results = [catalog.index.products[row] for row in rows]
+        current_call_log.append(f"LAMBDA_SESSION: Intent='{intent}', ProductIds='{json.dumps([p.get('id') for p in results])}', Cart='{json.dumps(session['cart'])}'")
+        return {"catalogQueryResult": results, "catalogMatchCount": len(results), "session": session, "callLog": current_call_log}
+
+    merged_entities, mode = merge_entities(session["entities"], entities)
+    if not entities and previous_rows:
+        # "compáralos", "¿cuál me recomiendas?": se trabaja sobre los resultados ya mostrados.
+        mode, merged_entities = "previous", session["entities"]
+        rows, match_count = previous_rows, session["matchCount"]
+    elif mode == "narrow" and can_narrow(session):
+        rows, match_count = catalog.index.search_rows(merged_entities, limit=SESSION_MAX_RESULT_IDS, in_stock_only=CATALOG_IN_STOCK_ONLY, candidate_rows=previous_rows)
+    else:
+        rows, match_count = catalog.index.search_rows(merged_entities, limit=SESSION_MAX_RESULT_IDS, in_stock_only=CATALOG_IN_STOCK_ONLY)
+    if intent in RECOMMENDATION_INTENTS and mode != "previous":
+        rows = recommend_rows(catalog, state.get("userInput", ""), merged_entities, rows, SESSION_MAX_RESULT_IDS, current_call_log)
+        match_count = match_count or len(rows)
+    products = [catalog.index.products[row] for row in rows]
+    session.update(entities=merged_entities, resultIds=[p.get("id") for p in products], matchCount=match_count)
+    results = products[:CATALOG_RESULT_LIMIT]
+    current_call_log.append(f"LAMBDA_SESSION: Mode='{mode}', Entities='{json.dumps(merged_entities)}', Candidates='{len(previous_rows) if mode in ('narrow', 'previous') else len(catalog.index)}'")
+    current_call_log.append(f"LAMBDA_CATALOG_QUERY: Entities='{json.dumps(merged_entities)}', Found='{match_count} items', ExampleResults='{json.dumps([{'id': p.get('id'), 'nombre': p.get('nombre')} for p in results[:3]])}'")
+    return {"entities": merged_entities, "catalogQueryResult": results, "catalogMatchCount": match_count, "session": session, "callLog": current_call_log}
+
+def build_cart_response(intent: str, products: List[dict], session: dict):
+    if intent == "agregar_carrito":
+        if not products:
+            return "No encontré ese producto entre los resultados anteriores. ¿Me dices cuál quieres agregar?"
+        return f"Listo, agregué {products[0].get('nombre', 'el producto')} a tu carrito. Ahora tienes {len(session['cart'])} producto(s)."
+    if not products:
+        return "Tu carrito está vacío por ahora. ¿Quieres que busque algo para ti?"
+    items = ", ".join(f"{p.get('nombre', 'un producto')} (${p['precio']:.2f})" if isinstance(p.get('precio'), (int, float)) else p.get('nombre', 'un producto') for p in products)
+    total = sum(p['precio'] for p in products if isinstance(p.get('precio'), (int, float)))
+    return f"Tu carrito tiene: {items}. Total: ${total:.2f}."
+
+def prepare_response_generation(state: AgentState):
+    # Devuelve (resultado_final, prompt, clave_de_caché): si hay resultado_final no hace falta llamar al LLM.
     user_input = state.get("userInput", "")
     intent = state.get("intent", "")
     entities = state.get("entities", {})
     catalog_results = state.get("catalogQueryResult", [])
+    catalog_match_count = state.get("catalogMatchCount", len(catalog_results))
     current_call_log = state.get("callLog", [])
     global llm
     if llm is None:
-        print("Error crítico en generate_response_lambda: LLM no está inicializado.")
+        log_error("Error crítico en generate_response_lambda: LLM no está inicializado.")
         current_call_log.append("LAMBDA_RESPONSE_ERROR: LLM no inicializado.")
-        return {"finalResponse": "Lo siento, estoy experimentando un problema técnico y no puedo generar una respuesta en este momento.", "callLog": current_call_log}
+        return {"finalResponse": "Lo siento, estoy experimentando un problema técnico y no puedo generar una respuesta en este momento.", "callLog": current_call_log}, None, None
 
     context_for_llm = f"La consulta original del usuario (transcrita de voz) fue: '{user_input}'.\n"
     if intent: 
@@ -238,224 +653,684 @@ def generate_response_lambda(state: AgentState):
         context_for_llm += f"Las entidades relevantes extraídas fueron: {json.dumps(entities)}.\n"
 
     if intent.startswith("error_nlu"):
-        final_response_text = "Lo siento, tuve algunos problemas para entender completamente tu solicitud de voz. ¿Podrías intentar reformularla o ser un poco más específico?"
+        final_response_text = NLU_ERROR_RESPONSE
+        current_call_log.append(f"LAMBDA_RESPONSE_GEN: Intent='{intent}', Generated_Response='{final_response_text}'")
+        return {"finalResponse": final_response_text, "callLog": current_call_log}, None, None
+
+    if intent in CART_INTENTS and state.get("session") is not None:
+        final_response_text = build_cart_response(intent, catalog_results, state["session"])
         current_call_log.append(f"LAMBDA_RESPONSE_GEN: Intent='{intent}', Generated_Response='{final_response_text}'")
-        return {"finalResponse": final_response_text, "callLog": current_call_log}
+        return {"finalResponse": final_response_text, "callLog": current_call_log}, None, None
 
     if intent in ["saludar", "despedirse"] and not catalog_results:
         if intent == "saludar":
-            final_response_text = "¡Hola! Soy tu asistente de compras inteligente. ¿Cómo puedo ayudarte hoy?"
+            final_response_text = SALUDO_RESPONSE
         else: 
-            final_response_text = "¡Hasta pronto! Que tengas un excelente día."
+            final_response_text = DESPEDIDA_RESPONSE
         current_call_log.append(f"LAMBDA_RESPONSE_GEN: Intent='{intent}', Generated_Response='{final_response_text}'")
-        return {"finalResponse": final_response_text, "callLog": current_call_log}
-
-    system_message_content = ""
-    human_message_instruction = (
-        "Basándote en el contexto anterior, formula una respuesta ÚNICA, CONVERSACIONAL, AMIGABLE y DIRECTA para el usuario. "
-        "NO simules múltiples turnos de conversación. NO uses prefijos como 'Bot:'. NO uses comillas innecesarias alrededor de toda tu respuesta. "
-        "Simplemente proporciona la frase que el asistente debería decir."
-    )
+        return {"finalResponse": final_response_text, "callLog": current_call_log}, None, None
 
     if not catalog_results:
-        if intent in ["buscar_producto", "pedir_recomendacion", "comparar_productos"]:
+        if intent in CATALOG_INTENTS:
             context_for_llm += "No se encontraron productos en el catálogo que coincidan exactamente con la búsqueda del usuario.\n"
-            system_message_content = (
-                "Eres un asistente de compras virtual servicial y empático. "
-                "Tu tarea es informar al usuario de manera clara y amigable que no se encontraron productos para su búsqueda. "
-                "Anímale a intentar con diferentes términos, a ser más general, o pregunta si puedes ayudarle con otra cosa. "
-            )
+            prompt_key = "sin_resultados"
         else: 
             context_for_llm += "No se requirió consultar el catálogo para esta interacción.\n"
-            system_message_content = (
-                "Eres un asistente de compras virtual servicial y empático. "
-                "Responde de forma concisa, amigable y directa a la consulta del usuario basándote en la intención y el contexto proporcionado. "
-            )
+            prompt_key = "sin_catalogo"
     else: 
         context_for_llm += "Se encontraron los siguientes productos que podrían interesarle al usuario:\n"
-        for i, product in enumerate(catalog_results[:2]): 
+        for i, product in enumerate(catalog_results[:CATALOG_RESULT_LIMIT]): 
             product_info = f"  - {product.get('nombre', 'Nombre no disponible')}"
             if product.get('marca'): product_info += f" (Marca: {product.get('marca')})"
             if product.get('precio'): product_info += f", Precio: ${product.get('precio')}"
             context_for_llm += product_info + "\n"
-        if len(catalog_results) > 2:
-            context_for_llm += f"  ... y {len(catalog_results) - 2} producto(s) más similares.\n"
+        shown_count = min(len(catalog_results), CATALOG_RESULT_LIMIT)
+        if catalog_match_count > shown_count:
+            context_for_llm += f"  ... y {catalog_match_count - shown_count} producto(s) más similares.\n"
         
-        system_message_content = (
-            "Eres un asistente de compras virtual experto, amigable y servicial. "
-            "Basándote en la consulta del usuario y los productos encontrados (listados en el contexto), "
-            "genera una respuesta ÚNICA, FLUIDA, CONVERSACIONAL y DIRECTA. "
-            "Presenta la información de manera clara y útil. Si hay productos, menciona uno o dos de los más relevantes. "
-            "Puedes concluir preguntando si desea más detalles sobre alguno en particular, si quiere ver otras opciones, o si hay algo más en lo que puedas asistir. "
-            "Ejemplo de una buena respuesta si encuentras 'Botas de Montaña TerraTrek': 'Encontré las Botas de Montaña TerraTrek. Son impermeables y cuestan $180.00. ¿Te gustaría saber más detalles sobre estas botas o prefieres que busque otras opciones?'"
-        )
+        prompt_key = "con_resultados"
     
-    prompt_template = ChatPromptTemplate.from_messages([
-        SystemMessage(content=system_message_content),
-        HumanMessage(content=context_for_llm + "\n" + human_message_instruction)
-    ])
+    # El prompt incluye la frase del usuario: sin ella en la clave, dos preguntas distintas sin resultados (o con intención
+    # "otra") compartirían la misma respuesta.
+    response_cache_key = json.dumps([normalize_transcript(user_input), intent, entities, [p.get("id") for p in catalog_results], catalog_match_count],
+                                    sort_keys=True, ensure_ascii=False)
+    if RESPONSE_CACHE is not None:
+        cached_response = RESPONSE_CACHE.get(response_cache_key)
+        current_call_log.append(f"LAMBDA_CACHE: Level='response', Hit='{cached_response is not None}', Stats='{RESPONSE_CACHE.stats()}'")
+        if cached_response is not None:
+            log_debug(f"Respuesta desde caché: {cached_response}")
+            current_call_log.append(f"LAMBDA_RESPONSE_GEN: Intent='{intent}', Found='{catalog_match_count}', Generated='{cached_response[:100]}...', Source='cache'")
+            return {"finalResponse": cached_response, "callLog": current_call_log}, None, None
+
+    formatted_prompt = get_prompt_templates()[prompt_key].format_messages(context=context_for_llm + "\n" + RESPONSE_HUMAN_INSTRUCTION)
+    return None, formatted_prompt, response_cache_key
+
+def build_degraded_response(state: AgentState):
+    # Respuesta sin LLM cuando Bedrock no contesta dentro del presupuesto: describe los productos ya encontrados.
+    descriptions = []
+    for product in state.get("catalogQueryResult", [])[:CATALOG_RESULT_LIMIT]:
+        description = product.get('nombre', 'un producto')
+        if product.get('marca'): description += f" de {product.get('marca')}"
+        if isinstance(product.get('precio'), (int, float)): description += f" por ${product['precio']:.2f}"
+        descriptions.append(description)
+    if not descriptions:
+        return DEGRADED_RESPONSE
+    return f"Encontré {' y '.join(descriptions)}. ¿Te gustaría saber más detalles sobre alguno?"
+
+def record_generated_response(state: AgentState, final_response_text: str, response_cache_key: str):
+    if RESPONSE_CACHE is not None and final_response_text:
+        RESPONSE_CACHE.set(response_cache_key, final_response_text)
+    log_debug(f"Respuesta generada y limpiada por LLM (Agente, fluidez v2): {final_response_text}")
+    catalog_match_count = state.get("catalogMatchCount", len(state.get("catalogQueryResult", [])))
+    state.get("callLog", []).append(f"LAMBDA_RESPONSE_GEN: Intent='{state.get('intent', '')}', Found='{catalog_match_count}', Generated='{final_response_text[:100]}...'")
+
+def generate_response_lambda(state: AgentState):
+    log_debug("---LAMBDA AGENTE NODO: Generando Respuesta (Prompt Fluidez v2)---")
+    early_result, formatted_prompt, response_cache_key = prepare_response_generation(state)
+    if early_result is not None:
+        return early_result
+    current_call_log = state.get("callLog", [])
     
     final_response_text = "Lo siento, no pude generar una respuesta en este momento." 
     try:
-        formatted_prompt = prompt_template.format_messages()
-        ai_response = llm.invoke(formatted_prompt)
-        cleaned_response = ai_response.content.strip()
-        prefixes_to_remove = ["Bot:", "Respuesta:", "Respuesta del asistente:"]
-        for prefix in prefixes_to_remove:
-            if cleaned_response.lower().startswith(prefix.lower()):
-                cleaned_response = cleaned_response[len(prefix):].strip()
-        
-        if (cleaned_response.startswith("'") and cleaned_response.endswith("'")) or \
-           (cleaned_response.startswith('"') and cleaned_response.endswith('"')):
-            cleaned_response = cleaned_response[1:-1]
-
-        final_response_text = cleaned_response
-        print(f"Respuesta generada y limpiada por LLM (Agente, fluidez v2): {final_response_text}")
-        current_call_log.append(f"LAMBDA_RESPONSE_GEN: Intent='{intent}', Found='{len(catalog_results)}', Generated='{final_response_text[:100]}...'")
+        ai_response = call_within_budget("llm.response", llm.invoke, formatted_prompt)
+        increment("llm.response.calls")
+        record_llm_usage(ai_response, "llm.response")
+        final_response_text = clean_response_text(ai_response.content)
+        record_generated_response(state, final_response_text, response_cache_key)
+    except BudgetExceeded as e:
+        log_warning(f"Respuesta degradada: {e}")
+        final_response_text = build_degraded_response(state)
+        current_call_log.append(f"LAMBDA_RESPONSE_GEN: Intent='{state.get('intent', '')}', Generated='{final_response_text[:100]}...', Source='degraded'")
     except Exception as e:
-        print(f"Error en generación de respuesta LLM (Agente, fluidez v2): {e}")
+        log_error(f"Error en generación de respuesta LLM (Agente, fluidez v2): {e}")
         current_call_log.append(f"LAMBDA_RESPONSE_GEN_ERROR: {str(e)}")
     
     return {"finalResponse": final_response_text, "callLog": current_call_log}
 
+def stream_response_lambda(state: AgentState):
+    # Igual que generate_response_lambda, pero produce el texto limpio a medida que llegan los tokens de Bedrock.
+    log_debug("---LAMBDA AGENTE NODO: Generando Respuesta en streaming---")
+    early_result, formatted_prompt, response_cache_key = prepare_response_generation(state)
+    if early_result is not None:
+        yield early_result["finalResponse"]
+        return
+    cleaner = StreamingResponseCleaner()
+    generated = []
+    start = time.perf_counter()
+    try:
+        increment("llm.response.calls")
+        for chunk in iter_within_budget("llm.response", llm.stream(formatted_prompt)):
+            record_llm_usage(chunk, "llm.response")
+            text = cleaner.feed(chunk_text(chunk))
+            if text and not generated:
+                record("llm.response.first_token", (time.perf_counter() - start) * 1000)
+            if text:
+                generated.append(text)
+                yield text
+        text = cleaner.finish()
+        if text:
+            generated.append(text)
+            yield text
+        record_generated_response(state, "".join(generated), response_cache_key)
+    except BudgetExceeded as e:
+        log_warning(f"Respuesta en streaming degradada: {e}")
+        state.get("callLog", []).append(f"LAMBDA_RESPONSE_GEN: Intent='{state.get('intent', '')}', Source='degraded', Partial='{bool(generated)}'")
+        if not generated:
+            yield build_degraded_response(state)
+    except Exception as e:
+        log_error(f"Error en generación de respuesta LLM en streaming: {e}")
+        state.get("callLog", []).append(f"LAMBDA_RESPONSE_GEN_ERROR: {str(e)}")
+        if not generated:
+            yield "Lo siento, no pude generar una respuesta en este momento."
+
+def build_agent_workflow(nlu_node, catalog_node, response_node):
+    langgraph_graph = lazy_import("langgraph.graph")
+    workflow = langgraph_graph.StateGraph(AgentState)
+    workflow.add_node("nlu_parser_lambda", traced("node.nlu_parser_lambda", nlu_node))
+    workflow.add_node("catalog_tool_lambda", traced("node.catalog_tool_lambda", catalog_node))
+    workflow.add_node("response_generator_lambda", traced("node.response_generator_lambda", response_node))
+    workflow.set_entry_point("nlu_parser_lambda")
+    workflow.add_edge("nlu_parser_lambda", "catalog_tool_lambda")
+    workflow.add_edge("catalog_tool_lambda", "response_generator_lambda")
+    workflow.add_edge("response_generator_lambda", langgraph_graph.END)
+    return workflow
+
 def compile_agent_graph():
     global agent_app
     if agent_app is not None:
         return agent_app
         
-    workflow = StateGraph(AgentState)
-    workflow.add_node("nlu_parser_lambda", interpret_user_input_lambda)
-    workflow.add_node("catalog_tool_lambda", query_product_catalog_lambda)
-    workflow.add_node("response_generator_lambda", generate_response_lambda)
-    workflow.set_entry_point("nlu_parser_lambda")
-    workflow.add_edge("nlu_parser_lambda", "catalog_tool_lambda")
-    workflow.add_edge("catalog_tool_lambda", "response_generator_lambda")
-    workflow.add_edge("response_generator_lambda", END)
-    agent_app = workflow.compile()
-    print("Grafo del Agente LangGraph compilado para Lambda.")
+    agent_app = build_agent_workflow(interpret_user_input_lambda, query_product_catalog_lambda, generate_response_lambda).compile()
+    log_info("Grafo del Agente LangGraph compilado para Lambda.")
     return agent_app
 
-def transcribe_audio_lambda(audio_bytes: bytes, input_audio_format: str = 'webm'):
-    global s3_client, transcribe_client
+def run_agent_batch(utterances: List[str], max_workers: int = AGENT_BATCH_MAX_WORKERS, dedupe_nlu: bool = True):
+    # Ejecuta muchas frases por el grafo con un pool acotado; las consultas NLU idénticas dentro del lote
+    # (misma clave normalizada que la caché NLU) se resuelven una sola vez aunque estén en curso a la vez.
+    load_product_database_lambda()
+    initialize_agent_caches()
+    histograms = {name: LatencyHistogram() for name in ("nlu_parser_lambda", "catalog_tool_lambda", "response_generator_lambda", "total")}
+    coalescer = RequestCoalescer()
+    # Los hilos del pool no heredan el plazo de la invocación: cada frase recibe lo que quede del presupuesto del lote.
+    batch_budget = budget_remaining()
+    batch_started = time.perf_counter()
+
+    def nlu_node(state: AgentState):
+        if not dedupe_nlu:
+            return interpret_user_input_lambda(state)
+        result, coalesced = coalescer.run(normalize_transcript(state["userInput"]), lambda: interpret_user_input_lambda(state))
+        if not coalesced:
+            return result
+        current_call_log = state.get("callLog", [])
+        current_call_log.append(f"LAMBDA_NLU: Input='{state['userInput']}', Intent='{result['intent']}', Entities='{json.dumps(result['entities'])}', Source='batch_dedupe'")
+        return {"intent": result["intent"], "entities": dict(result["entities"]), "callLog": current_call_log}
+
+    batch_app = build_agent_workflow(timed_node("nlu_parser_lambda", nlu_node, histograms),
+                                     timed_node("catalog_tool_lambda", query_product_catalog_lambda, histograms),
+                                     timed_node("response_generator_lambda", generate_response_lambda, histograms)).compile()
+
+    def run_utterance(text):
+        start = time.perf_counter()
+        try:
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError("Frase vacía.")
+            with request_budget(None if batch_budget is None else batch_budget - (time.perf_counter() - batch_started)):
+                final_state = batch_app.invoke({"userInput": text, "callLog": []})
+            result = {
+                'inputText': text,
+                'intent': final_state.get('intent'),
+                'entities': final_state.get('entities', {}),
+                'catalogMatchCount': final_state.get('catalogMatchCount', 0),
+                'agentResponseText': final_state.get('finalResponse', "No pude generar una respuesta."),
+                'agentCallLog': final_state.get('callLog', [])
+            }
+        except Exception as e:
+            log_warning(f"Error procesando '{text}' en el lote: {e}")
+            result = {'inputText': text, 'error': str(e)}
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        histograms["total"].record(elapsed_ms)
+        result['latencyMs'] = round(elapsed_ms, 3)
+        return result
+
+    start = time.perf_counter()
+    results = run_bounded(list(utterances), run_utterance, max_workers)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    stats = {
+        'utterances': len(results),
+        'errors': sum(1 for result in results if 'error' in result),
+        'workers': max_workers,
+        'elapsed_ms': round(elapsed_ms, 3),
+        'throughput_per_s': round(len(results) / (elapsed_ms / 1000), 3) if elapsed_ms else 0.0,
+        'nlu_unique_prompts': len(coalescer) if dedupe_nlu else len(results),
+        'nlu_deduplicated': coalescer.coalesced,
+        'latency_ms': {name: histogram.to_dict() for name, histogram in histograms.items()}
+    }
+    log_info(f"Lote de {stats['utterances']} frases procesado en {stats['elapsed_ms']:.1f}ms ({stats['throughput_per_s']}/s), NLU deduplicadas: {stats['nlu_deduplicated']}")
+    return {'results': results, 'stats': stats}
+
+def get_transcription_backend():
+    global transcription_backend
+    if transcription_backend is not None:
+        return transcription_backend
+    if TRANSCRIBE_BACKEND == "stub":
+        transcription_backend = StubTranscriptionBackend(os.environ.get("TRANSCRIBE_STUB_TEXT"))
+        return transcription_backend
     if not s3_client or not transcribe_client:
         raise Exception("Clientes S3 o Transcribe no inicializados.")
+    batch_backend = BatchTranscribeBackend(
+        s3_client, transcribe_client, S3_BUCKET_NAME, http_session or build_http_session(),
+        fetch_timeout_seconds=SERVICE_TIMEOUTS["http"],
+        initial_poll_seconds=TRANSCRIBE_POLL_INITIAL_SECONDS,
+        max_poll_seconds=TRANSCRIBE_POLL_MAX_SECONDS,
+        deadline_seconds=TRANSCRIBE_DEADLINE_SECONDS
+    )
+    if TRANSCRIBE_BACKEND == "streaming":
+        transcription_backend = StreamingTranscribeBackend(get_aws_region(), sample_rate_hz=TRANSCRIBE_SAMPLE_RATE, fallback=batch_backend)
+    else:
+        transcription_backend = batch_backend
+    return transcription_backend
 
-    unique_id = str(uuid.uuid4())
-    s3_object_key = f"transcribe-input-lambda/{unique_id}.{input_audio_format}" 
-    transcription_job_name = f"LambdaTranscription-{unique_id}"
-    temp_audio_path = f"/tmp/{unique_id}.{input_audio_format}"
-
-    try:
-        with open(temp_audio_path, 'wb') as f:
-            f.write(audio_bytes)
-        
-        s3_client.upload_file(temp_audio_path, S3_BUCKET_NAME, s3_object_key)
-        media_file_uri = f"s3://{S3_BUCKET_NAME}/{s3_object_key}"
-        
-        transcribe_client.start_transcription_job(
-            TranscriptionJobName=transcription_job_name,
-            Media={'MediaFileUri': media_file_uri},
-            MediaFormat=input_audio_format,
-            LanguageCode='es-US'
-        )
-        while True:
-            status = transcribe_client.get_transcription_job(TranscriptionJobName=transcription_job_name)
-            job_status = status['TranscriptionJob']['TranscriptionJobStatus']
-            if job_status in ['COMPLETED', 'FAILED']: break
-            time.sleep(5)
-        
-        if job_status == 'FAILED':
-            raise Exception(f"Trabajo de transcripción falló: {status['TranscriptionJob'].get('FailureReason')}")
-        
-        transcript_uri = status['TranscriptionJob']['Transcript']['TranscriptFileUri']
-        response = requests.get(transcript_uri)
-        response.raise_for_status()
-        transcript_json = response.json()
-        return transcript_json['results']['transcripts'][0]['transcript']
-    finally:
-        if os.path.exists(temp_audio_path): os.remove(temp_audio_path)
-        try: s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_object_key)
-        except Exception: pass
+def transcribe_audio_lambda(audio_bytes: bytes, input_audio_format: str = 'webm', timings: dict = None, defer_cleanup=None, audio_s3_key: str = None):
+    backend = get_transcription_backend()
+    timings = timings if timings is not None else {}
+    with span("transcribe"):
+        if audio_s3_key is not None and hasattr(backend, "transcribe_object"):
+            transcribed_text = backend.transcribe_object(audio_s3_key, input_audio_format, timings, defer_cleanup)
+        else:
+            if audio_s3_key is not None:
+                # Los backends que necesitan los bytes (streaming, stub) descargan el audio subido por el cliente.
+                timer = StageTimer(timings)
+                timer.start("download")
+                audio_bytes = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=audio_s3_key)['Body'].read()
+                timer.stop("download")
+            transcribed_text = backend.transcribe(audio_bytes, input_audio_format, timings, defer_cleanup)
+    for stage, elapsed_ms in timings.items():
+        record(f"transcribe.{stage}", elapsed_ms)
+    log_debug(f"Transcripción ({backend.name}) completada, tiempos por etapa (ms): {timings}")
+    return transcribed_text
 
-def synthesize_speech_lambda(text_to_synthesize: str):
-    global polly_client
+def initialize_speech_synthesizer():
+    global speech_synthesizer
+    if speech_synthesizer is not None:
+        return speech_synthesizer
     if not polly_client:
         raise Exception("Cliente Polly no inicializado.")
+    speech_synthesizer = SpeechSynthesizer(polly_client, POLLY_VOICE_ID, engine=POLLY_ENGINE, output_format='mp3',
+                                           cache=AudioCache(TTS_CACHE_MAX_BYTES))
+    if TTS_PREWARM:
+        phrases = STATIC_RESPONSES + [sentence for phrase in STATIC_RESPONSES for sentence in split_sentences(phrase) if sentence != phrase]
+        warmed = speech_synthesizer.prewarm(phrases)
+        log_info(f"Audio de {warmed} frases estáticas pre-sintetizado.")
+    return speech_synthesizer
+
+def synthesize_speech_lambda(text_to_synthesize: str):
     if not text_to_synthesize: return None
+    with span("tts"):
+        return initialize_speech_synthesizer().synthesize(text_to_synthesize)
 
-    response = polly_client.synthesize_speech(
-        Text=text_to_synthesize,
-        OutputFormat='mp3',
-        VoiceId=POLLY_VOICE_ID,
-        Engine='standard'
-    )
-    if 'AudioStream' in response:
-        return response['AudioStream'].read()
-    return None
+def synthesize_speech_chunks_lambda(text_to_synthesize: str):
+    if not text_to_synthesize: return
+    yield from initialize_speech_synthesizer().synthesize_chunks(text_to_synthesize)
+
+def parse_audio_request(event):
+    if 'body' not in event:
+        return None, {'statusCode': 400, 'body': json.dumps({'error': 'Cuerpo de la solicitud no encontrado.'})}
+    try:
+        options, audio_bytes = parse_audio_payload(event)
+        response_mode, audio_delivery = resolve_response_options(options, event)
+        audio_s3_key = audio_upload_key(options['audio_s3_key'], S3_BUCKET_NAME) if options.get('audio_s3_key') else None
+    except ValueError as e:
+        return None, {'statusCode': 400, 'body': json.dumps({'error': f'Cuerpo de la solicitud no válido: {e}'})}
+    input_audio_format = options.get('audio_format') or 'webm'
+    if options.get('action') == 'upload_url':
+        return {'action': 'upload_url', 'audio_format': input_audio_format}, None
+    if audio_bytes is None and audio_s3_key is None:
+        return None, {'statusCode': 400, 'body': json.dumps({'error': 'audio_base64, audio binario o audio_s3_key no encontrado en el cuerpo.'})}
+
+    if options.get('session_id') is not None and not valid_session_id(options['session_id']):
+        return None, {'statusCode': 400, 'body': json.dumps({'error': 'session_id debe ser un string no vacío de hasta 128 caracteres.'})}
+
+    audio_source = f"{len(audio_bytes)} bytes" if audio_bytes is not None else f"s3://{S3_BUCKET_NAME}/{audio_s3_key}"
+    log_debug(f"Audio recibido ({audio_source}), formato: {input_audio_format}")
+    return {
+        'action': 'transcribe',
+        'audio_bytes': audio_bytes,
+        'audio_s3_key': audio_s3_key,
+        'audio_format': input_audio_format,
+        'audio_mode': options.get('audio_mode', 'full'),
+        'response_format': options.get('response_format', 'json'),
+        'response_mode': response_mode,
+        'audio_delivery': audio_delivery,
+        'session_id': options.get('session_id')
+    }, None
+
+def build_upload_url_response(request):
+    try:
+        upload = create_upload_url(s3_client, S3_BUCKET_NAME, request['audio_format'])
+    except ValueError as e:
+        return {'statusCode': 400, 'body': json.dumps({'error': str(e)})}
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(upload)
+    }
+
+def parse_text_request(event):
+    if 'body' not in event:
+        return None, {'statusCode': 400, 'body': json.dumps({'error': 'Cuerpo de la solicitud no encontrado.'})}
+    try:
+        body = json.loads(event['body']) if isinstance(event['body'], (str, bytes, bytearray)) else event['body']
+    except (TypeError, ValueError) as e:
+        return None, {'statusCode': 400, 'body': json.dumps({'error': f'Cuerpo de la solicitud no válido: {e}'})}
+    if not isinstance(body, dict):
+        return None, {'statusCode': 400, 'body': json.dumps({'error': 'Cuerpo de la solicitud no válido: el cuerpo JSON debe ser un objeto.'})}
+    if 'texts' in body:
+        texts = body['texts']
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return None, {'statusCode': 400, 'body': json.dumps({'error': 'texts debe ser una lista de frases.'})}
+        if len(texts) > AGENT_BATCH_MAX_ITEMS:
+            return None, {'statusCode': 400, 'body': json.dumps({'error': f'El lote admite como máximo {AGENT_BATCH_MAX_ITEMS} frases.'})}
+        try:
+            max_workers = max(1, min(int(body.get('max_workers', AGENT_BATCH_MAX_WORKERS)), AGENT_BATCH_MAX_WORKERS))
+        except (TypeError, ValueError):
+            return None, {'statusCode': 400, 'body': json.dumps({'error': 'max_workers debe ser un número entero.'})}
+        return {'texts': texts, 'max_workers': max_workers}, None
+    text = body.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return None, {'statusCode': 400, 'body': json.dumps({'error': 'text no encontrado en el cuerpo.'})}
+    if body.get('session_id') is not None and not valid_session_id(body['session_id']):
+        return None, {'statusCode': 400, 'body': json.dumps({'error': 'session_id debe ser un string no vacío de hasta 128 caracteres.'})}
+    return {'text': text, 'session_id': body.get('session_id')}, None
+
+def add_session_fields(response_body, session_id, session):
+    if session_id is not None and session is not None:
+        response_body['sessionId'] = session_id
+        response_body['cart'] = session['cart']
+    return response_body
+
+def get_response_audio_store():
+    global response_audio_store
+    if response_audio_store is None:
+        if not s3_client:
+            raise Exception("Cliente S3 no inicializado.")
+        response_audio_store = ResponseAudioStore(s3_client, S3_BUCKET_NAME)
+    return response_audio_store
+
+def audio_encoder(audio_delivery):
+    # (sufijo del campo, función) para el audio dentro de un cuerpo JSON: base64 en línea o URL prefirmada de S3.
+    if audio_delivery == 'url':
+        return 'Url', get_response_audio_store().url_for
+    return 'Base64', encode_base64
+
+def build_agent_response(transcribed_text, agent_final_state, response_audio_bytes=None, response_audio_chunks=None, session_id=None, session=None,
+                         response_mode='full', audio_delivery='base64'):
+    if response_audio_bytes:
+        log_debug("Respuesta de audio sintetizada.")
+    elif response_audio_chunks is not None:
+        log_debug(f"Respuesta de audio sintetizada en {len(response_audio_chunks)} segmentos.")
+    else:
+        log_warning("No se pudo sintetizar el audio de respuesta.")
+    agent_response_text = agent_final_state.get('finalResponse', "No pude generar una respuesta.")
+    if audio_delivery == 'binary' and (response_audio_bytes or response_audio_chunks):
+        # Los segmentos MP3 se concatenan: el resultado se reproduce como un solo archivo.
+        audio = response_audio_bytes or b"".join(audio for _, audio in response_audio_chunks if audio)
+        has_session = session_id is not None and session is not None
+        return binary_audio_response(audio, {
+            'X-Input-Text': transcribed_text,
+            'X-Agent-Response-Text': agent_response_text,
+            'X-Session-Id': session_id if has_session else None,
+            'X-Cart': ",".join(session['cart']) if has_session else None
+        })
+
+    audio_suffix, encode_audio = audio_encoder(audio_delivery)
+    response_body = {
+        'inputText': transcribed_text,
+        'agentResponseText': agent_response_text,
+        f'agentResponseAudio{audio_suffix}': encode_audio(response_audio_bytes) if response_audio_bytes else None
+    }
+    if response_mode != 'compact':
+        agent_call_log = agent_final_state.get('callLog', [])
+        if speech_synthesizer is not None and speech_synthesizer.cache is not None:
+            agent_call_log.append(f"LAMBDA_TTS_CACHE: Stats='{speech_synthesizer.cache.stats()}'")
+        response_body['agentCallLog'] = agent_call_log
+    if response_audio_chunks is not None:
+        response_body['agentResponseAudioChunks'] = [
+            {'text': sentence, f'audio{audio_suffix}': encode_audio(audio)}
+            for sentence, audio in response_audio_chunks if audio
+        ]
+    add_session_fields(response_body, session_id, session)
+    if response_mode == 'compact':
+        # Sin agentCallLog, sin campos vacíos y sin espacios entre separadores.
+        body = json.dumps({key: value for key, value in response_body.items() if value is not None}, separators=(',', ':'))
+    else:
+        body = json.dumps(response_body)
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*' 
+        },
+        'body': body
+    }
+
+def run_agent_until_response(transcribed_text: str, call_log: List[str], session: dict = None):
+    # Ejecuta NLU y catálogo como el grafo, dejando la generación de la respuesta para el streaming.
+    state = {"userInput": transcribed_text, "callLog": call_log, "session": session}
+    with span("node.nlu_parser_lambda"):
+        state.update(interpret_user_input_lambda(state))
+    with span("node.catalog_tool_lambda"):
+        state.update(query_product_catalog_lambda(state))
+    return state
+
+def iter_streaming_events(transcribed_text: str, state: AgentState, response_mode: str = 'full', audio_delivery: str = 'base64'):
+    # El NDJSON siempre es texto: "binary" se trata como base64.
+    audio_suffix, encode_audio = audio_encoder(audio_delivery)
+    yield {'type': 'transcript', 'inputText': transcribed_text}
+    segmenter = SentenceSegmenter()
+    generated = []
+    def segment_events(sentences):
+        for sentence in sentences:
+            audio = synthesize_speech_lambda(sentence)
+            yield {'type': 'segment', 'text': sentence, f'audio{audio_suffix}': encode_audio(audio) if audio else None}
+    for text in stream_response_lambda(state):
+        generated.append(text)
+        yield {'type': 'text', 'delta': text}
+        yield from segment_events(segmenter.feed(text))
+    yield from segment_events(segmenter.finish())
+    done = {'type': 'done', 'agentResponseText': "".join(generated)}
+    if response_mode != 'compact':
+        done['agentCallLog'] = state.get('callLog', [])
+    yield done
+
+def build_streaming_response(transcribed_text: str, state: AgentState, response_mode: str = 'full', audio_delivery: str = 'base64'):
+    # Con integraciones con buffer el cuerpo NDJSON se arma completo; un runtime con streaming puede iterar los eventos.
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/x-ndjson',
+            'Access-Control-Allow-Origin': '*' 
+        },
+        'body': "".join(json.dumps(event) + "\n" for event in iter_streaming_events(transcribed_text, state, response_mode, audio_delivery))
+    }
+
+def build_error_response(e, handler_name):
+    log_error(f"Error en {handler_name}: {e}")
+    if isinstance(e, BudgetExceeded):
+        # Plazo agotado (p. ej. la transcripción): 504 sin traza, el cliente puede reintentar.
+        increment("errors.timeout")
+        return {
+            'statusCode': 504,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)})
+        }
+    import traceback
+    traceback.print_exc()
+    return {
+        'statusCode': 500,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': str(e)})
+    }
 
 def lambda_handler(event, context):
-    print(f"Evento recibido: {json.dumps(event)}")
+    log_event("Evento recibido", event)
+    budget_token = start_request_budget(lambda_budget_seconds(context))
     global agent_app 
     try:
-        initialize_aws_clients()
-        load_product_database_lambda()
+        timed_init("aws_clients", initialize_aws_clients)
+        timed_init("agent_caches", initialize_agent_caches)
+        timed_init("catalog", load_product_database_lambda)
+        refresh_catalog()
+        timed_init("speech_synthesizer", initialize_speech_synthesizer)
         if agent_app is None:
-            compile_agent_graph()
+            timed_init("agent_graph", compile_agent_graph)
+        emit_cold_start_report(MODULE_LOADED_AT)
         
-        if 'body' not in event:
-            return {'statusCode': 400, 'body': json.dumps({'error': 'Cuerpo de la solicitud no encontrado.'})}
-        body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
-        if 'audio_base64' not in body:
-            return {'statusCode': 400, 'body': json.dumps({'error': 'audio_base64 no encontrado en el cuerpo.'})}
-        
-        audio_base64_string = body['audio_base64']
-        input_audio_format = body.get('audio_format', 'webm') 
-        audio_bytes = base64.b64decode(audio_base64_string)
-        print(f"Audio decodificado, {len(audio_bytes)} bytes, formato: {input_audio_format}")
+        request, error_response = parse_audio_request(event)
+        if error_response is not None:
+            return error_response
+        if request['action'] == 'upload_url':
+            return build_upload_url_response(request)
 
-        transcribed_text = transcribe_audio_lambda(audio_bytes, input_audio_format)
+        transcription_timings = {}
+        transcribed_text = transcribe_audio_lambda(request['audio_bytes'], request['audio_format'], transcription_timings, audio_s3_key=request['audio_s3_key'])
         if not transcribed_text:
             raise Exception("La transcripción falló o devolvió texto vacío.")
-        print(f"Texto Transcrito: {transcribed_text}")
+        log_debug(f"Texto Transcrito: {transcribed_text}")
 
         if agent_app is None:
             raise Exception("El grafo del agente no se pudo compilar.")
 
-        agent_initial_input = {"userInput": transcribed_text, "callLog": []}
-        agent_final_state = agent_app.invoke(agent_initial_input)
+        transcribe_log = [f"LAMBDA_TRANSCRIBE: Backend='{TRANSCRIBE_BACKEND}', TimingsMs='{json.dumps(transcription_timings)}'"]
+        session_id = request['session_id']
+        if request['response_format'] == 'ndjson':
+            state = run_agent_until_response(transcribed_text, transcribe_log, load_session(session_id))
+            save_session(session_id, state)
+            return build_streaming_response(transcribed_text, state, request['response_mode'], request['audio_delivery'])
+
+        agent_initial_input = {"userInput": transcribed_text, "callLog": transcribe_log, "session": load_session(session_id)}
+        with span("agent"):
+            agent_final_state = agent_app.invoke(agent_initial_input)
+        session = save_session(session_id, agent_final_state)
         agent_response_text = agent_final_state.get('finalResponse', "No pude generar una respuesta.")
-        print(f"Respuesta del Agente (Texto): {agent_response_text}")
+        log_debug(f"Respuesta del Agente (Texto): {agent_response_text}")
 
-        response_audio_bytes = synthesize_speech_lambda(agent_response_text)
-        response_audio_base64 = None
-        if response_audio_bytes:
-            response_audio_base64 = base64.b64encode(response_audio_bytes).decode('utf-8')
-            print("Respuesta de audio sintetizada y codificada en base64.")
-        else:
-            print("No se pudo sintetizar el audio de respuesta.")
+        response_options = {'session_id': session_id, 'session': session, 'response_mode': request['response_mode'], 'audio_delivery': request['audio_delivery']}
+        if request['audio_mode'] == 'chunks':
+            return build_agent_response(transcribed_text, agent_final_state, response_audio_chunks=list(synthesize_speech_chunks_lambda(agent_response_text)), **response_options)
+        return build_agent_response(transcribed_text, agent_final_state, response_audio_bytes=synthesize_speech_lambda(agent_response_text), **response_options)
+    except Exception as e:
+        return build_error_response(e, "lambda_handler")
+    finally:
+        end_request_budget(budget_token)
+        flush_metrics(Handler="lambda_handler")
 
+def text_lambda_handler(event, context):
+    # Entrada de texto (chat y pruebas de regresión): mismo grafo, sin Transcribe ni Polly.
+    log_event("Evento de texto recibido", event)
+    budget_token = start_request_budget(lambda_budget_seconds(context))
+    global agent_app
+    try:
+        timed_init("llm", initialize_llm)
+        timed_init("agent_caches", initialize_agent_caches)
+        timed_init("catalog", load_product_database_lambda)
+        refresh_catalog()
+        if agent_app is None:
+            timed_init("agent_graph", compile_agent_graph)
+        emit_cold_start_report(MODULE_LOADED_AT)
+
+        request, error_response = parse_text_request(event)
+        if error_response is not None:
+            return error_response
+
+        if 'texts' in request:
+            response_body = run_agent_batch(request['texts'], max_workers=request['max_workers'])
+        else:
+            with span("agent"):
+                agent_final_state = agent_app.invoke({"userInput": request['text'], "callLog": ["LAMBDA_INPUT: Mode='text'"],
+                                                      "session": load_session(request['session_id'])})
+            response_body = add_session_fields({
+                'inputText': request['text'],
+                'agentResponseText': agent_final_state.get('finalResponse', "No pude generar una respuesta."),
+                'agentCallLog': agent_final_state.get('callLog', [])
+            }, request['session_id'], save_session(request['session_id'], agent_final_state))
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*' 
             },
-            'body': json.dumps({
-                'inputText': transcribed_text,
-                'agentResponseText': agent_response_text,
-                'agentResponseAudioBase64': response_audio_base64,
-                'agentCallLog': agent_final_state.get('callLog', [])
-            })
+            'body': json.dumps(response_body)
         }
     except Exception as e:
-        print(f"Error en lambda_handler: {e}")
-        import traceback
-        traceback.print_exc()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
-        }
+        return build_error_response(e, "text_lambda_handler")
+    finally:
+        end_request_budget(budget_token)
+        flush_metrics(Handler="text_lambda_handler")
+
+async def initialize_lambda_async():
+    # La creación de clientes y la carga del catálogo no dependen entre sí: se solapan en hilos separados.
+    timed_init("agent_caches", initialize_agent_caches)
+    await asyncio.gather(asyncio.to_thread(timed_init, "aws_clients", initialize_aws_clients),
+                         asyncio.to_thread(timed_init, "catalog", load_product_database_lambda))
+    refresh_catalog()
+    emit_cold_start_report(MODULE_LOADED_AT)
+
+async def stream_sentences_async(state: AgentState, generated: List[str]):
+    # Frases a medida que Bedrock genera tokens: el hilo del LLM las deja en una cola y cada una se sintetiza en
+    # cuanto se completa, mientras el resto del texto se sigue generando. El texto generado queda en `generated`.
+    loop = asyncio.get_running_loop()
+    sentences = asyncio.Queue()
+    def produce():
+        segmenter = SentenceSegmenter()
+        try:
+            for text in stream_response_lambda(state):
+                generated.append(text)
+                for sentence in segmenter.feed(text):
+                    loop.call_soon_threadsafe(sentences.put_nowait, sentence)
+            for sentence in segmenter.finish():
+                loop.call_soon_threadsafe(sentences.put_nowait, sentence)
+        finally:
+            loop.call_soon_threadsafe(sentences.put_nowait, None)
+    producer = asyncio.create_task(asyncio.to_thread(produce))
+    while (sentence := await sentences.get()) is not None:
+        yield sentence
+    await producer
+
+async def synthesize_sentences_async(sentences):
+    # Lanza la síntesis de cada frase en cuanto llega, sin esperar al resto del texto.
+    pending = []
+    async for sentence in sentences:
+        pending.append((sentence, asyncio.create_task(asyncio.to_thread(synthesize_speech_lambda, sentence))))
+    return [(sentence, await task) for sentence, task in pending]
+
+async def drain_deferred(futures, timeout=DEFERRED_DRAIN_SECONDS):
+    # Lambda congela el contenedor al devolver la respuesta: lo diferido tiene un margen corto para terminar antes.
+    # Lo que no termine sigue en la siguiente invocación del contenedor; la regla de ciclo de vida del prefijo de
+    # entrada de Transcribe borra el audio si el contenedor no vuelve a usarse.
+    if not futures:
+        return
+    done, pending = await asyncio.wait([asyncio.wrap_future(future) for future in futures], timeout=timeout)
+    if pending:
+        increment("deferred.pending", len(pending))
+        log_warning(f"{len(pending)} tareas diferidas siguen en curso tras {timeout}s.")
+
+async def lambda_handler_async(event, context):
+    # Lo diferido (logs, borrado del audio en S3) sale de la ruta crítica y se drena con un plazo corto al final.
+    deferred = []
+    def defer(fn, *args):
+        deferred.append(DEFERRED_EXECUTOR.submit(fn, *args))
+    defer(log_event, "Evento recibido (async)", event)
+    budget_token = start_request_budget(lambda_budget_seconds(context))
+    try:
+        await initialize_lambda_async()
+        request, error_response = parse_audio_request(event)
+        if error_response is not None:
+            return error_response
+        if request['action'] == 'upload_url':
+            return build_upload_url_response(request)
+
+        synthesizer_ready = asyncio.create_task(asyncio.to_thread(initialize_speech_synthesizer))
+        transcription_timings = {}
+        transcribed_text = await asyncio.to_thread(transcribe_audio_lambda, request['audio_bytes'], request['audio_format'], transcription_timings, defer, request['audio_s3_key'])
+        if not transcribed_text:
+            raise Exception("La transcripción falló o devolvió texto vacío.")
+        defer(log_debug, f"Texto Transcrito: {transcribed_text}")
+
+        transcribe_log = [f"LAMBDA_TRANSCRIBE: Backend='{TRANSCRIBE_BACKEND}', TimingsMs='{json.dumps(transcription_timings)}'"]
+        session_id = request['session_id']
+        session = await asyncio.to_thread(load_session, session_id)
+        # La sesión se guarda antes de responder: el siguiente turno puede llegar al mismo contenedor enseguida.
+        state = await asyncio.to_thread(run_agent_until_response, transcribed_text, transcribe_log, session)
+        await synthesizer_ready
+        if request['response_format'] == 'ndjson':
+            await asyncio.to_thread(save_session, session_id, state)
+            return await asyncio.to_thread(build_streaming_response, transcribed_text, state, request['response_mode'], request['audio_delivery'])
+
+        generated = []
+        with span("agent.response_and_tts"):
+            response_audio_chunks = await synthesize_sentences_async(stream_sentences_async(state, generated))
+        agent_final_state = dict(state, finalResponse="".join(generated) or "No pude generar una respuesta.")
+        session = await asyncio.to_thread(save_session, session_id, agent_final_state)
+        defer(log_debug, f"Respuesta del Agente (Texto): {agent_final_state['finalResponse']}")
+
+        response_options = {'session_id': session_id, 'session': session, 'response_mode': request['response_mode'], 'audio_delivery': request['audio_delivery']}
+        if request['audio_mode'] == 'chunks':
+            return await asyncio.to_thread(build_agent_response, transcribed_text, agent_final_state, response_audio_chunks=response_audio_chunks, **response_options)
+        # Los segmentos MP3 de cada frase se concatenan en un solo archivo reproducible.
+        response_audio_bytes = b"".join(audio for _, audio in response_audio_chunks if audio) or None
+        return await asyncio.to_thread(build_agent_response, transcribed_text, agent_final_state, response_audio_bytes=response_audio_bytes, **response_options)
+    except Exception as e:
+        return build_error_response(e, "lambda_handler_async")
+    finally:
+        await drain_deferred(deferred)
+        end_request_budget(budget_token)
+        flush_metrics(Handler="async_lambda_handler")
+
+def async_lambda_handler(event, context):
+    return asyncio.run(lambda_handler_async(event, context))
+
+MODULE_LOADED_AT = time.perf_counter()
 
 if __name__ == '__main__':
     print("Ejecutando prueba local de lambda_handler (requiere un archivo de audio base64)...")
@@ -0,0 +1,60 @@
+import json
+import math
+import os
+import sys
+import time
+
+# Cobertura de la NLU por reglas (fast_nlu.py) y acuerdo con el nodo NLU real (prompt, llamada y extracción del JSON)
+# respondido por un LLM simulado con las etiquetas del corpus.
+# Uso: python nlu_agreement.py [corpus]
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import lambda_function
+from agent_batch import CorpusStubLLM
+from fast_nlu import FastIntentExtractor
+
+
+def llm_nlu_outputs(corpus):
+    # Cada frase pasa por interpret_user_input_lambda con la ruta rápida y la caché NLU desactivadas; el LLM, el umbral
+    # y la caché del módulo se restauran al terminar.
+    saved = lambda_function.llm, lambda_function.NLU_FAST_PATH_THRESHOLD, lambda_function.NLU_CACHE
+    lambda_function.llm = CorpusStubLLM({item["input"]: (item["intent"], item["entities"]) for item in corpus})
+    lambda_function.NLU_FAST_PATH_THRESHOLD = math.inf
+    lambda_function.NLU_CACHE = None
+    try:
+        outputs = {}
+        for item in corpus:
+            result = lambda_function.interpret_user_input_lambda({"userInput": item["input"], "callLog": []})
+            outputs[item["input"]] = (result["intent"], result["entities"])
+        return outputs
+    finally:
+        lambda_function.llm, lambda_function.NLU_FAST_PATH_THRESHOLD, lambda_function.NLU_CACHE = saved
+
+
+if __name__ == '__main__':
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, "nlu_fast_path_corpus.json")
+    threshold = float(os.environ.get("NLU_FAST_PATH_THRESHOLD", "0.8"))
+    with open(os.path.join(base_dir, "products.json"), 'r', encoding='utf-8') as f:
+        extractor = FastIntentExtractor(json.load(f))
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    llm_labels = llm_nlu_outputs(corpus)
+
+    hits = agreements = 0
+    elapsed_ms = 0.0
+    for item in corpus:
+        start = time.perf_counter()
+        intent, entities, confidence = extractor.extract(item["input"])
+        elapsed_ms += (time.perf_counter() - start) * 1000
+        if confidence < threshold:
+            continue
+        hits += 1
+        llm_intent, llm_entities = llm_labels[item["input"]]
+        if intent == llm_intent and entities == llm_entities:
+            agreements += 1
+        else:
+            print(f"Desacuerdo: '{item['input']}' -> rápido=({intent}, {entities}) LLM=({llm_intent}, {llm_entities})")
+    print(f"Corpus: {len(corpus)} frases, umbral={threshold}")
+    print(f"Ruta rápida: {hits}/{len(corpus)} ({hits / len(corpus):.0%}) sin llamar al LLM, acuerdo con el LLM: {agreements}/{hits or 1} ({agreements / (hits or 1):.0%})")
+    print(f"Latencia media de la ruta rápida: {elapsed_ms / len(corpus):.3f}ms")
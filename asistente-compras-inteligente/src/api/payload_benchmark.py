@@ -0,0 +1,87 @@
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+
+# Bytes transferidos y CPU del handler por petición según la forma del cuerpo (JSON base64, binario, multipart,
+# referencia a S3) y de la respuesta (completa, compacta, MP3 binario, URL prefirmada), con clientes AWS simulados.
+# Uso: python payload_benchmark.py [iteraciones] [tamaños_audio_bytes...]
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import lambda_function
+import pipeline_benchmark
+from instrumentation import InMemorySink, set_metrics_sink
+
+POLLY_BYTES_PER_CHAR = 400
+MULTIPART_BOUNDARY = "----asistenteBoundary7MA4YWxkTrZu0gW"
+
+
+def multipart_body(audio, fields):
+    parts = [f'--{MULTIPART_BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+             for name, value in fields.items()]
+    parts.append(f'--{MULTIPART_BOUNDARY}\r\nContent-Disposition: form-data; name="audio"; filename="grabacion.webm"\r\n'
+                 f'Content-Type: audio/webm\r\n\r\n'.encode("utf-8") + audio + b"\r\n")
+    return b"".join(parts) + f"--{MULTIPART_BOUNDARY}--\r\n".encode("utf-8")
+
+
+def scenarios(audio):
+    # (nombre, evento, bytes cliente -> API Gateway, bytes subidos directo a S3)
+    json_body = json.dumps({'audio_base64': base64.b64encode(audio).decode('utf-8'), 'audio_format': 'webm'})
+    compact_body = json.dumps({'audio_base64': base64.b64encode(audio).decode('utf-8'), 'audio_format': 'webm', 'response_mode': 'compact'})
+    form = multipart_body(audio, {'response_mode': 'compact'})
+    upload_key = "audio-uploads/benchmark.webm"
+    lambda_function.s3_client.put_object(Bucket=lambda_function.S3_BUCKET_NAME, Key=upload_key, Body=audio)
+    reference_body = json.dumps({'audio_s3_key': upload_key, 'audio_format': 'webm', 'response_mode': 'compact', 'audio_delivery': 'url'})
+    return [
+        ("JSON base64 -> JSON completo", {'body': json_body}, len(json_body), 0),
+        ("JSON base64 -> JSON compacto", {'body': compact_body}, len(compact_body), 0),
+        ("binario -> MP3 binario", {'headers': {'Content-Type': 'audio/webm', 'Accept': 'audio/mpeg'}, 'isBase64Encoded': True,
+                                    'body': base64.b64encode(audio).decode('ascii')}, len(audio), 0),
+        ("multipart -> JSON compacto", {'headers': {'Content-Type': f'multipart/form-data; boundary={MULTIPART_BOUNDARY}'}, 'isBase64Encoded': True,
+                                        'body': base64.b64encode(form).decode('ascii')}, len(form), 0),
+        ("S3 -> URL prefirmada", {'body': reference_body}, len(reference_body), len(audio)),
+    ]
+
+
+def response_sizes(response):
+    # (bytes Lambda -> API Gateway, bytes API Gateway -> cliente con cabeceras, bytes de audio descargados de S3)
+    headers_bytes = sum(len(name) + len(value) + 4 for name, value in response.get('headers', {}).items())
+    body = response['body']
+    client_bytes = len(base64.b64decode(body)) if response.get('isBase64Encoded') else len(body.encode('utf-8'))
+    s3_bytes = 0
+    if not response.get('isBase64Encoded') and response['headers'].get('Content-Type') == 'application/json':
+        payload = json.loads(body)
+        urls = [payload.get('agentResponseAudioUrl')] + [chunk.get('audioUrl') for chunk in payload.get('agentResponseAudioChunks', [])]
+        objects = lambda_function.s3_client.objects
+        s3_bytes = sum(len(objects[(lambda_function.S3_BUCKET_NAME, url.split(".amazonaws.com/")[1].split("?")[0])]) for url in urls if url)
+    return len(json.dumps(response)), client_bytes + headers_bytes, s3_bytes
+
+
+def measure(event, iterations):
+    cpu_ms = []
+    for _ in range(iterations):
+        start = time.process_time()
+        response = lambda_function.lambda_handler(event, None)
+        cpu_ms.append((time.process_time() - start) * 1000)
+        if response['statusCode'] != 200:
+            raise SystemExit(f"Respuesta inesperada: {response}")
+    return response, statistics.median(cpu_ms)
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    sizes = [int(size) for size in sys.argv[2:]] or [48000, 480000]
+    pipeline_benchmark.install_stubs(0.0, POLLY_BYTES_PER_CHAR)
+    set_metrics_sink(InMemorySink())
+    lambda_function.lambda_handler({'body': json.dumps({'audio_base64': base64.b64encode(b'\x00' * 16).decode('utf-8')})}, None)
+    for size in sizes:
+        audio = os.urandom(size)
+        print(f"audio de entrada {size} bytes (n={iterations}, respuesta MP3 simulada de {POLLY_BYTES_PER_CHAR} bytes/carácter):")
+        for name, event, client_request_bytes, s3_upload_bytes in scenarios(audio):
+            response, cpu_ms = measure(event, iterations)
+            lambda_response_bytes, client_response_bytes, s3_download_bytes = response_sizes(response)
+            print(f"  {name:<30} petición cliente={client_request_bytes:>8} evento={len(json.dumps(event)):>8} | "
+                  f"respuesta Lambda={lambda_response_bytes:>7} cliente={client_response_bytes:>7} | "
+                  f"directo S3={s3_upload_bytes + s3_download_bytes:>7} | CPU handler {cpu_ms:.2f}ms")
@@ -0,0 +1,204 @@
+import binascii
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import quote
+
+from instrumentation import increment
+
+AUDIO_UPLOAD_PREFIX = os.environ.get("AUDIO_UPLOAD_PREFIX", "audio-uploads/")
+RESPONSE_AUDIO_PREFIX = os.environ.get("RESPONSE_AUDIO_PREFIX", "tts-responses/")
+AUDIO_URL_TTL_SECONDS = int(os.environ.get("AUDIO_URL_TTL_SECONDS", "300"))
+RESPONSE_AUDIO_KEYS_MAX = 1024
+RESPONSE_AUDIO_REUPLOAD_SECONDS = 6 * 3600
+RESPONSE_AUDIO_CONTENT_TYPE = "audio/mpeg"
+AUDIO_FORMATS_BY_CONTENT_TYPE = {
+    "audio/webm": "webm", "audio/ogg": "ogg", "audio/opus": "ogg", "audio/wav": "wav", "audio/x-wav": "wav", "audio/wave": "wav",
+    "audio/mpeg": "mp3", "audio/mp3": "mp3", "audio/mp4": "mp4", "audio/x-m4a": "m4a", "audio/m4a": "m4a",
+    "audio/flac": "flac", "audio/x-flac": "flac", "audio/amr": "amr",
+}
+REQUEST_OPTION_FIELDS = ("action", "audio_format", "audio_mode", "audio_s3_key", "response_format", "response_mode", "audio_delivery", "session_id")
+RESPONSE_MODES = ("full", "compact")
+AUDIO_DELIVERIES = ("base64", "binary", "url")
+EXPOSED_RESPONSE_HEADERS = "X-Input-Text, X-Agent-Response-Text, X-Session-Id, X-Cart"
+
+# Formas de enviar el audio a lambda_handler (el cuerpo JSON con audio_base64 sigue funcionando igual):
+#  - audio binario: Content-Type audio/* (tipo de medio binario en API Gateway) y las opciones en la query string,
+#  - multipart/form-data: parte "audio" con el archivo y las opciones como campos,
+#  - referencia a S3: audio_s3_key de un objeto subido antes con la URL prefirmada de {"action": "upload_url"}.
+
+
+def header(event, name):
+    # API Gateway REST conserva las mayúsculas de las cabeceras del cliente; HTTP API las pasa a minúsculas.
+    name = name.lower()
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def split_header_params(value):
+    # 'multipart/form-data; boundary="x"' -> ("multipart/form-data", {"boundary": "x"})
+    main, *params = (value or "").split(";")
+    parameters = {}
+    for param in params:
+        key, _, param_value = param.strip().partition("=")
+        if key:
+            parameters[key.lower()] = param_value.strip().strip('"')
+    return main.strip().lower(), parameters
+
+
+def decode_body(event):
+    # Con tipos de medios binarios API Gateway entrega el cuerpo en base64. a2b_base64 lee el str ASCII directamente;
+    # base64.b64decode lo codificaría antes a bytes, una copia más del audio completo.
+    body = event.get("body") or ""
+    if isinstance(body, (bytes, bytearray)):
+        return body
+    if event.get("isBase64Encoded"):
+        return binascii.a2b_base64(body)
+    return body.encode("utf-8")
+
+
+def encode_base64(data):
+    return binascii.b2a_base64(data, newline=False).decode("ascii")
+
+
+def parse_multipart(body, boundary):
+    # multipart/form-data -> {nombre: (content_type, bytes)}. Los delimitadores se buscan con bytes.find sobre el
+    # cuerpo ya decodificado y cada parte se copia una sola vez.
+    delimiter = b"--" + boundary.encode("latin-1")
+    position = body.find(delimiter)
+    if position < 0:
+        raise ValueError("cuerpo multipart sin delimitador.")
+    parts = {}
+    while True:
+        position += len(delimiter)
+        if body[position:position + 2] == b"--":
+            return parts
+        headers_end = body.find(b"\r\n\r\n", position)
+        next_delimiter = body.find(b"\r\n" + delimiter, headers_end)
+        if headers_end < 0 or next_delimiter < 0:
+            raise ValueError("cuerpo multipart incompleto.")
+        part_headers = {}
+        for line in body[position:headers_end].decode("utf-8", "replace").split("\r\n"):
+            name, _, value = line.partition(":")
+            if value:
+                part_headers[name.strip().lower()] = value.strip()
+        name = split_header_params(part_headers.get("content-disposition"))[1].get("name")
+        if name:
+            parts[name] = (split_header_params(part_headers.get("content-type", "text/plain"))[0], body[headers_end + 4:next_delimiter])
+        position = next_delimiter + 2
+
+
+def parse_audio_payload(event):
+    # Devuelve (opciones, audio_bytes o None). Lanza ValueError si el cuerpo no es válido.
+    media_type, params = split_header_params(header(event, "content-type"))
+    options = {name: value for name, value in (event.get("queryStringParameters") or {}).items() if name in REQUEST_OPTION_FIELDS}
+    audio_bytes = None
+    if media_type.startswith("audio/") or media_type == "application/octet-stream":
+        audio_bytes = decode_body(event)
+        if media_type in AUDIO_FORMATS_BY_CONTENT_TYPE:
+            options.setdefault("audio_format", AUDIO_FORMATS_BY_CONTENT_TYPE[media_type])
+    elif media_type == "multipart/form-data":
+        if not params.get("boundary"):
+            raise ValueError("multipart/form-data sin boundary.")
+        for name, (part_type, value) in parse_multipart(decode_body(event), params["boundary"]).items():
+            if name == "audio":
+                audio_bytes = value
+                if part_type in AUDIO_FORMATS_BY_CONTENT_TYPE:
+                    options.setdefault("audio_format", AUDIO_FORMATS_BY_CONTENT_TYPE[part_type])
+            elif name in REQUEST_OPTION_FIELDS:
+                options[name] = value.decode("utf-8")
+    else:
+        body = event["body"]
+        if isinstance(body, str):
+            body = json.loads(binascii.a2b_base64(body) if event.get("isBase64Encoded") else body)
+        if not isinstance(body, dict):
+            raise ValueError("el cuerpo JSON debe ser un objeto.")
+        options.update((name, body[name]) for name in REQUEST_OPTION_FIELDS if name in body)
+        if body.get("audio_base64") is not None:
+            audio_bytes = binascii.a2b_base64(body["audio_base64"])
+    return options, audio_bytes
+
+
+def resolve_response_options(options, event):
+    # Sin audio_delivery explícito, "Accept: audio/mpeg" pide el MP3 como cuerpo binario (API Gateway solo lo convierte
+    # a binario en una REST API si el Accept de la petición coincide con uno de sus tipos de medios binarios).
+    response_mode = options.get("response_mode") or "full"
+    audio_delivery = options.get("audio_delivery") or ("binary" if RESPONSE_AUDIO_CONTENT_TYPE in (header(event, "accept") or "") else "base64")
+    if response_mode not in RESPONSE_MODES:
+        raise ValueError(f"response_mode debe ser uno de {RESPONSE_MODES}.")
+    if audio_delivery not in AUDIO_DELIVERIES:
+        raise ValueError(f"audio_delivery debe ser uno de {AUDIO_DELIVERIES}.")
+    return response_mode, audio_delivery
+
+
+def audio_upload_key(value, bucket, prefix=AUDIO_UPLOAD_PREFIX):
+    # Solo objetos del bucket de la Lambda bajo el prefijo de subidas: el cliente no puede hacer que la función lea
+    # (y transcriba) cualquier objeto al que tenga acceso su rol.
+    if not isinstance(value, str):
+        raise ValueError("audio_s3_key debe ser un string.")
+    if value.startswith("s3://"):
+        value_bucket, _, value = value[len("s3://"):].partition("/")
+        if value_bucket != bucket:
+            raise ValueError("audio_s3_key debe estar en el bucket de la aplicación.")
+    if not value.startswith(prefix) or ".." in value.split("/"):
+        raise ValueError(f"audio_s3_key debe estar bajo '{prefix}'.")
+    return value
+
+
+def create_upload_url(s3_client, bucket, audio_format, prefix=AUDIO_UPLOAD_PREFIX, ttl_seconds=AUDIO_URL_TTL_SECONDS):
+    # URL prefirmada (PUT) para subir la grabación directo a S3; después se envía solo su audio_s3_key.
+    if audio_format not in set(AUDIO_FORMATS_BY_CONTENT_TYPE.values()):
+        raise ValueError(f"audio_format '{audio_format}' no soportado.")
+    key = f"{prefix}{uuid.uuid4()}.{audio_format}"
+    url = s3_client.generate_presigned_url("put_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=ttl_seconds)
+    return {"uploadUrl": url, "audioS3Key": key, "expiresIn": ttl_seconds}
+
+
+def binary_audio_response(audio, text_headers):
+    # El MP3 como cuerpo: la Lambda lo devuelve en base64 con isBase64Encoded y API Gateway lo entrega al cliente como
+    # binario. Los textos van en cabeceras codificadas como URL (decodeURIComponent en el navegador).
+    headers = {
+        "Content-Type": RESPONSE_AUDIO_CONTENT_TYPE,
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Expose-Headers": EXPOSED_RESPONSE_HEADERS,
+    }
+    headers.update((name, quote(str(value), safe=" ,")) for name, value in text_headers.items() if value is not None)
+    return {"statusCode": 200, "headers": headers, "isBase64Encoded": True, "body": encode_base64(audio)}
+
+
+class ResponseAudioStore:
+    # Audio de respuesta servido por URL prefirmada. La clave es el hash del MP3: las frases repetidas (saludos,
+    # segmentos ya cacheados por el TTS) no se vuelven a subir mientras el objeto siga vigente en el bucket.
+    def __init__(self, s3_client, bucket, prefix=RESPONSE_AUDIO_PREFIX, ttl_seconds=AUDIO_URL_TTL_SECONDS,
+                 max_keys=RESPONSE_AUDIO_KEYS_MAX, reupload_seconds=RESPONSE_AUDIO_REUPLOAD_SECONDS, clock=time.time):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.reupload_seconds = reupload_seconds
+        self.clock = clock
+        self.uploaded = OrderedDict()
+        self.lock = threading.Lock()
+
+    def url_for(self, audio):
+        key = f"{self.prefix}{hashlib.sha256(audio).hexdigest()[:32]}.mp3"
+        with self.lock:
+            uploaded_at = self.uploaded.get(key)
+        if uploaded_at is None or self.clock() - uploaded_at > self.reupload_seconds:
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=audio, ContentType=RESPONSE_AUDIO_CONTENT_TYPE)
+            increment("response_audio.upload")
+            with self.lock:
+                self.uploaded[key] = self.clock()
+                self.uploaded.move_to_end(key)
+                while len(self.uploaded) > self.max_keys:
+                    self.uploaded.popitem(last=False)
+        else:
+            increment("response_audio.reuse")
+        return self.s3_client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=self.ttl_seconds)
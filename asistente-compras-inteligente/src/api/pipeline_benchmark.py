@@ -0,0 +1,169 @@
+import base64
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+# Benchmark del handler con clientes AWS simulados: compara p50/p99 de lambda_handler y async_lambda_handler.
+# Uso: python pipeline_benchmark.py [iteraciones] [latencia_base_ms]
+os.environ.setdefault("AGENT_CACHE_MAX_ENTRIES", "0")
+os.environ.setdefault("TTS_PREWARM", "false")
+os.environ.setdefault("TRANSCRIBE_POLL_INITIAL_SECONDS", "0.05")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+
+import langchain_aws
+
+import aws_clients
+import lambda_function
+from instrumentation import InMemorySink, set_metrics_sink
+
+
+def _sleep_ms(ms):
+    time.sleep(ms / 1000.0)
+
+
+class StubS3Client:
+    def __init__(self, latency_ms):
+        self.latency_ms = latency_ms
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        _sleep_ms(self.latency_ms)
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        _sleep_ms(self.latency_ms)
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        _sleep_ms(self.latency_ms)
+        self.objects.pop((Bucket, Key), None)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature={'0' * 64}"
+
+
+class StubTranscribeClient:
+    def __init__(self, job_ms):
+        self.job_ms = job_ms
+        self.started = {}
+
+    def start_transcription_job(self, TranscriptionJobName, **kwargs):
+        self.started[TranscriptionJobName] = time.monotonic()
+
+    def get_transcription_job(self, TranscriptionJobName):
+        elapsed_ms = (time.monotonic() - self.started[TranscriptionJobName]) * 1000
+        status = 'COMPLETED' if elapsed_ms >= self.job_ms else 'IN_PROGRESS'
+        return {'TranscriptionJob': {'TranscriptionJobStatus': status, 'Transcript': {'TranscriptFileUri': 'stub://transcript'}}}
+
+
+class StubHttpResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'results': {'transcripts': [{'transcript': self.text}]}}
+
+
+class StubHttpSession:
+    def __init__(self, latency_ms, text):
+        self.latency_ms = latency_ms
+        self.text = text
+
+    def get(self, url, timeout=None):
+        _sleep_ms(self.latency_ms)
+        return StubHttpResponse(self.text)
+
+
+class StubPollyClient:
+    # Con `bytes_per_char` devuelve un "MP3" del tamaño aproximado del real (unos 400 bytes por carácter a 48 kbps).
+    def __init__(self, latency_ms, bytes_per_char=None):
+        self.latency_ms = latency_ms
+        self.bytes_per_char = bytes_per_char
+
+    def synthesize_speech(self, Text, **kwargs):
+        _sleep_ms(self.latency_ms)
+        audio = Text.encode('utf-8') if self.bytes_per_char is None else os.urandom(len(Text) * self.bytes_per_char)
+        return {'AudioStream': io.BytesIO(audio)}
+
+
+class StubMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class StubLLM:
+    def __init__(self, latency_ms):
+        self.latency_ms = latency_ms
+
+    def invoke(self, messages):
+        _sleep_ms(self.latency_ms)
+        if any("Analiza esta consulta" in str(m.content) for m in messages):
+            return StubMessage('{"intent": "buscar_producto", "entities": {"categoria": "botas de montaña", "caracteristicas_adicionales": "impermeables"}}')
+        return StubMessage("Encontré las Botas de Montaña TerraTrek. Son impermeables y cuestan $180.00. ¿Quieres más detalles?")
+
+    def stream(self, messages):
+        words = self.invoke(messages).content.split(" ")
+        for i, word in enumerate(words):
+            yield StubMessage(word if i == 0 else " " + word)
+
+
+def install_stubs(base_ms, polly_bytes_per_char=None):
+    # Cada cliente simulado tarda `base_ms` en crearse, como un boto3.client en arranque en frío.
+    stubs = {
+        's3': lambda: StubS3Client(base_ms),
+        'transcribe': lambda: StubTranscribeClient(base_ms * 4),
+        'bedrock-runtime': lambda: object(),
+        'polly': lambda: StubPollyClient(base_ms * 2, polly_bytes_per_char),
+    }
+
+    def slow_client(factory, service_name):
+        _sleep_ms(base_ms)
+        return stubs[service_name]()
+    aws_clients.ClientFactory.client = slow_client
+    langchain_aws.ChatBedrock = lambda **kwargs: StubLLM(base_ms * 3)
+    lambda_function.build_http_session = lambda: StubHttpSession(base_ms, "busco botas de montaña impermeables para el fin de semana")
+
+
+def reset_cold_start():
+    for name in ("client_factory", "s3_client", "transcribe_client", "bedrock_runtime_client", "polly_client", "http_session", "llm",
+                 "CATALOG", "CATALOG_STORE", "transcription_backend", "speech_synthesizer", "response_audio_store"):
+        setattr(lambda_function, name, None)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def run(handler, event, iterations, cold):
+    samples = []
+    for _ in range(iterations):
+        if cold:
+            reset_cold_start()
+        start = time.perf_counter()
+        response = handler(event, None)
+        samples.append((time.perf_counter() - start) * 1000)
+        if response['statusCode'] != 200:
+            raise SystemExit(f"Respuesta inesperada: {response}")
+    return samples
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    base_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    event = {'body': json.dumps({'audio_base64': base64.b64encode(b'\x00' * 4096).decode('utf-8'), 'audio_mode': 'chunks'})}
+    install_stubs(base_ms)
+    sink = set_metrics_sink(InMemorySink())
+    for cold in (True, False):
+        for name, handler in (("sync", lambda_function.lambda_handler), ("async", lambda_function.async_lambda_handler)):
+            sink.clear()
+            samples = run(handler, event, iterations, cold)
+            print(f"{'frío' if cold else 'caliente':>8} {name:>5}: p50={statistics.median(samples):.1f}ms p99={percentile(samples, 99):.1f}ms (n={iterations}, latencia base {base_ms}ms)")
+            spans = ("transcribe", "node.nlu_parser_lambda", "node.catalog_tool_lambda", "node.response_generator_lambda", "tts")
+            print("          " + " ".join(f"{span}={statistics.median(sink.values(span)):.1f}ms" for span in spans if sink.values(span)))
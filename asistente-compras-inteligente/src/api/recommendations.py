@@ -0,0 +1,492 @@
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+import zlib
+from functools import lru_cache
+
+from cold_start import lazy_import
+from fast_nlu import FILLER_WORDS
+from text_matching import normalize_key
+
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "local")
+EMBEDDING_MODEL_ID = os.environ.get("EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v2:0")
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "256"))
+EMBEDDING_DTYPE = os.environ.get("EMBEDDING_DTYPE", "int8")
+RECOMMENDATION_EXACT_MAX = int(os.environ.get("RECOMMENDATION_EXACT_MAX", "100000"))
+RECOMMENDATION_NPROBE = int(os.environ.get("RECOMMENDATION_NPROBE", "16"))
+RECOMMENDATION_MIN_SCORE = float(os.environ.get("RECOMMENDATION_MIN_SCORE", "0.15"))
+SEARCH_CHUNK_ROWS = 8192
+EMBED_CHUNK_TOKENS = 65536
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLE_ROWS = 20000
+COMPACT_MIN_DELETED = 1024
+
+STOPWORDS = {normalize_key(word) for word in FILLER_WORDS} | {
+    normalize_key(word) for word in ("algo", "ver", "quiero", "busco", "necesito", "recomienda", "recomiendas", "recomiendame",
+                                     "compara", "comparar", "mejor", "cual", "otro", "otra", "tu", "tus", "su", "sus", "nuevo")}
+# Conceptos del dominio: palabras que suelen usar los clientes y las del catálogo comparten un rasgo común, así
+# "películas" se acerca a "televisor"/"cinematográfica" sin depender de un modelo de embeddings remoto.
+CONCEPTS = {
+    "cine": ["pelicula", "serie", "cine", "cinematografica", "televisor", "television", "tv", "netflix", "streaming", "qled", "oled"],
+    "espacio_reducido": ["pequeno", "chico", "cuarto", "habitacion", "dormitorio", "espacio", "compacto", "departamento"],
+    "deporte": ["correr", "carrera", "running", "runner", "deporte", "deportivo", "gimnasio", "entrenar", "ejercicio", "activo",
+                "ritmo", "cardiaco", "gps", "amortiguacion", "saludable"],
+    "montana": ["montana", "senderismo", "excursion", "trekking", "terreno", "impermeable", "lluvia", "campo", "acampar", "robusta"],
+    "trabajo": ["trabajar", "trabajo", "oficina", "profesional", "programar", "estudiar", "universidad", "laptop", "portatil",
+                "computadora", "ordenador", "ultrabook"],
+    "juego": ["jugar", "juego", "videojuego", "gamer", "gaming", "rtx", "grafico", "rendimiento"],
+    "musica": ["musica", "escuchar", "cancion", "sonido", "audio", "auricular", "bluetooth", "ruido", "podcast"],
+    "movil": ["llamar", "llamada", "foto", "camara", "celular", "telefono", "smartphone", "movil", "whatsapp", "conectado"],
+    "viaje": ["viaje", "viajar", "llevar", "ligera", "ligero", "portabilidad", "bateria", "duracion"],
+    "ropa": ["vestir", "ropa", "camisa", "algodon", "look", "estilo", "urbano", "casual", "clasico", "comodidad"],
+}
+CONCEPT_OF = {}
+for _concept, _words in CONCEPTS.items():
+    for _word in _words:
+        CONCEPT_OF.setdefault(normalize_key(_word), []).append(_concept)
+FIELD_WEIGHTS = (("nombre", 2.0), ("categoria", 2.0), ("marca", 1.0), ("descripcion", 1.0), ("caracteristicas", 1.0))
+EMBEDDED_FIELDS = {field for field, _ in FIELD_WEIGHTS} | {"id"}
+
+
+def product_text(product):
+    # Texto que se embebe por producto; también sirve de huella para saber si hay que recalcular su vector.
+    parts = []
+    for field, _ in FIELD_WEIGHTS:
+        value = product.get(field)
+        if isinstance(value, list):
+            value = " ".join(str(item) for item in value)
+        parts.append(str(value) if value is not None else "")
+    return "\n".join(parts)
+
+
+@lru_cache(maxsize=65536)
+def word_vector(dim, word):
+    # Vector de la palabra, sus conceptos y sus trigramas; las palabras se repiten mucho en el catálogo, así que cada
+    # una se hashea una sola vez por dimensión (la caché no retiene instancias de HashingEmbedder).
+    np = lazy_import("numpy")
+    features = [("w:" + word, 1.0)] + [("c:" + concept, 1.5) for concept in CONCEPT_OF.get(word, ())]
+    if len(word) > 4:
+        features.extend(("g:" + word[j:j + 3], 0.2) for j in range(len(word) - 2))
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += weight if (h >> 16) & 1 else -weight
+    return vector
+
+
+class HashingEmbedder:
+    # Backend local y determinista: hashing de palabras, conceptos del dominio y trigramas de caracteres.
+    name = "local"
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def embed(self, texts):
+        np = lazy_import("numpy")
+        vocabulary, word_ids, weights, rows = {}, [], [], []
+        for i, text in enumerate(texts):
+            fields = text.split("\n")
+            field_weights = [weight for _, weight in FIELD_WEIGHTS] if len(fields) == len(FIELD_WEIGHTS) else [1.0] * len(fields)
+            for field_text, weight in zip(fields, field_weights):
+                # normalize_key por palabra: el texto completo casi nunca se repite, las palabras sí (caché más útil).
+                for raw_word in field_text.split():
+                    for word in normalize_key(raw_word).split():
+                        if word not in STOPWORDS:
+                            word_ids.append(vocabulary.setdefault(word, len(vocabulary)))
+                            weights.append(weight)
+                            rows.append(i)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if vocabulary:
+            table = np.stack([word_vector(self.dim, word) for word in vocabulary])
+            word_ids, weights, rows = np.asarray(word_ids), np.asarray(weights, dtype=np.float32), np.asarray(rows)
+            # Suma por documento en bloques de tokens (las filas vienen ordenadas) para acotar la memoria temporal.
+            for start in range(0, len(rows), EMBED_CHUNK_TOKENS):
+                chunk = slice(start, start + EMBED_CHUNK_TOKENS)
+                starts = np.flatnonzero(np.r_[True, rows[chunk][1:] != rows[chunk][:-1]])
+                vectors[rows[chunk][starts]] += np.add.reduceat(table[word_ids[chunk]] * weights[chunk, None], starts, axis=0)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class BedrockEmbedder:
+    # Embeddings de Titan en Bedrock (una llamada por texto); requiere red y permisos bedrock:InvokeModel.
+    name = "bedrock"
+
+    def __init__(self, client, model_id=EMBEDDING_MODEL_ID, dim=EMBEDDING_DIM):
+        self.client = client
+        self.model_id = model_id
+        self.dim = dim
+
+    def embed(self, texts):
+        np = lazy_import("numpy")
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            response = self.client.invoke_model(modelId=self.model_id, body=json.dumps({"inputText": text, "dimensions": self.dim, "normalize": True}))
+            vectors[i] = json.loads(response["body"].read())["embedding"]
+        return vectors
+
+
+class VectorIndex:
+    # Matriz contigua de embeddings (int8 con escala por fila, o float16) con búsqueda top-k por lotes: exacta para
+    # catálogos pequeños y por listas invertidas (IVF, k-means) cuando se supera RECOMMENDATION_EXACT_MAX.
+    def __init__(self, embedder, dtype=EMBEDDING_DTYPE, exact_max=RECOMMENDATION_EXACT_MAX, nprobe=RECOMMENDATION_NPROBE):
+        np = lazy_import("numpy")
+        self.embedder = embedder
+        self.dtype = np.int8 if dtype == "int8" else np.float16
+        self.exact_max = exact_max
+        self.nprobe = nprobe
+        self.ids = []
+        self.row_of_id = {}
+        self.text_hashes = []
+        self.count = 0
+        self.deleted = 0
+        self.matrix = np.zeros((0, embedder.dim), dtype=self.dtype)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.active = np.zeros(0, dtype=bool)
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.lists = None
+        self.trained_size = 0
+        self.source_fingerprint = ""
+
+    def __len__(self):
+        return self.count - self.deleted
+
+    def nbytes(self):
+        return self.matrix[:self.count].nbytes + self.scales[:self.count].nbytes
+
+    def _reserve(self, rows):
+        # Crece por duplicación para que añadir productos no copie la matriz en cada actualización.
+        np = lazy_import("numpy")
+        if rows <= len(self.matrix):
+            return
+        capacity = max(rows, 2 * len(self.matrix), 64)
+        for name in ("matrix", "scales", "active", "assignments"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def _store(self, rows, vectors):
+        np = lazy_import("numpy")
+        if self.dtype == np.int8:
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            self.matrix[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[rows] = scales
+        else:
+            self.matrix[rows] = vectors.astype(np.float16)
+            self.scales[rows] = 1.0
+
+    def _decoded(self, rows):
+        return self.matrix[rows].astype("float32") * self.scales[rows, None]
+
+    def upsert(self, products):
+        # Solo se embeben los productos nuevos o cuyo texto cambió; devuelve (nuevos, actualizados, sin cambios).
+        np = lazy_import("numpy")
+        pending_rows, pending_texts = [], []
+        added = updated = unchanged = 0
+        for product in products:
+            product_id = product.get("id")
+            if product_id is None:
+                continue
+            text = product_text(product)
+            text_hash = hashlib.sha1(text.encode("utf-8")).digest()[:8]
+            row = self.row_of_id.get(product_id)
+            if row is not None and self.text_hashes[row] == text_hash:
+                unchanged += 1
+                continue
+            if row is None:
+                self._reserve(self.count + 1)
+                row = self.count
+                self.count += 1
+                self.ids.append(product_id)
+                self.text_hashes.append(text_hash)
+                self.row_of_id[product_id] = row
+                self.active[row] = True
+                added += 1
+            else:
+                self.text_hashes[row] = text_hash
+                updated += 1
+            pending_rows.append(row)
+            pending_texts.append(text)
+        if pending_rows:
+            rows = np.asarray(pending_rows, dtype=np.int64)
+            self._store(rows, self.embedder.embed(pending_texts))
+            self._update_ivf(rows)
+        return added, updated, unchanged
+
+    def sync(self, products):
+        # Deja el índice igual al catálogo dado: embebe solo lo nuevo o modificado y borra los ids que ya no están.
+        seen = set()
+
+        def tracked():
+            for product in products:
+                seen.add(product.get("id"))
+                yield product
+
+        added, updated, unchanged = self.upsert(tracked())
+        removed = self.remove([product_id for product_id in list(self.row_of_id) if product_id not in seen])
+        return added, updated, unchanged, removed
+
+    def copy(self):
+        # Copia independiente para actualizar una nueva versión del catálogo sin tocar la que usan las consultas en curso.
+        clone = VectorIndex.__new__(VectorIndex)
+        clone.__dict__.update(self.__dict__)
+        for name in ("matrix", "scales", "active", "assignments"):
+            setattr(clone, name, getattr(self, name).copy())
+        clone.ids, clone.text_hashes, clone.row_of_id = list(self.ids), list(self.text_hashes), dict(self.row_of_id)
+        clone.lists = [set(rows) for rows in self.lists] if self.lists is not None else None
+        return clone
+
+    def remove(self, product_ids):
+        removed = 0
+        for product_id in product_ids:
+            row = self.row_of_id.pop(product_id, None)
+            if row is None:
+                continue
+            self.active[row] = False
+            if self.lists is not None:
+                self.lists[self.assignments[row]].discard(row)
+            removed += 1
+        self.deleted += removed
+        if self.deleted >= COMPACT_MIN_DELETED and self.deleted > self.count // 4:
+            self.compact()
+        return removed
+
+    def compact(self):
+        # Elimina las filas borradas manteniendo la matriz contigua.
+        np = lazy_import("numpy")
+        keep = np.flatnonzero(self.active[:self.count])
+        self.ids = [self.ids[row] for row in keep]
+        self.text_hashes = [self.text_hashes[row] for row in keep]
+        self.row_of_id = {product_id: row for row, product_id in enumerate(self.ids)}
+        for name in ("matrix", "scales", "active", "assignments"):
+            setattr(self, name, np.ascontiguousarray(getattr(self, name)[keep]))
+        self.count, self.deleted = len(keep), 0
+        if self.centroids is not None:
+            self._rebuild_lists()
+
+    def _train_ivf(self):
+        # k-means esférico sobre una muestra; sqrt(N) listas.
+        np = lazy_import("numpy")
+        active_rows = np.flatnonzero(self.active[:self.count])
+        nlist = max(1, int(math.sqrt(len(active_rows))))
+        rng = np.random.default_rng(0)
+        sample = self._decoded(rng.choice(active_rows, size=min(len(active_rows), KMEANS_SAMPLE_ROWS), replace=False))
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        self.centroids = centroids.astype(np.float32)
+        self.trained_size = len(active_rows)
+        self._rebuild_lists()
+
+    def _assign(self, rows):
+        np = lazy_import("numpy")
+        for start in range(0, len(rows), SEARCH_CHUNK_ROWS):
+            chunk = rows[start:start + SEARCH_CHUNK_ROWS]
+            self.assignments[chunk] = np.argmax(self._decoded(chunk) @ self.centroids.T, axis=1)
+
+    def _rebuild_lists(self):
+        np = lazy_import("numpy")
+        active_rows = np.flatnonzero(self.active[:self.count])
+        self._assign(active_rows)
+        self.lists = [set() for _ in range(len(self.centroids))]
+        for row, centroid in zip(active_rows.tolist(), self.assignments[active_rows].tolist()):
+            self.lists[centroid].add(row)
+
+    def _update_ivf(self, rows):
+        # Las filas nuevas o modificadas se asignan al centroide más cercano; si el catálogo creció mucho desde
+        # el último entrenamiento (o cruzó el umbral), se reentrena.
+        if len(self) <= self.exact_max:
+            self.centroids, self.lists = None, None
+            return
+        if self.centroids is None or len(self) > 2 * self.trained_size:
+            self._train_ivf()
+            return
+        for row in rows.tolist():
+            self.lists[self.assignments[row]].discard(row)
+        self._assign(rows)
+        for row in rows.tolist():
+            self.lists[self.assignments[row]].add(row)
+
+    def _top_k(self, queries, rows, k):
+        # Producto punto por bloques en float32 contra la matriz cuantizada; conserva los k mejores por consulta.
+        np = lazy_import("numpy")
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(rows), SEARCH_CHUNK_ROWS):
+            chunk = rows[start:start + SEARCH_CHUNK_ROWS]
+            scores = (self.matrix[chunk].astype(np.float32) @ queries.T).T * self.scales[chunk]
+            scores[:, ~self.active[chunk]] = -np.inf
+            scores = np.concatenate([best_scores, scores], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(chunk, (len(queries), len(chunk)))], axis=1)
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                candidates = np.take_along_axis(candidates, keep, axis=1)
+            best_scores, best_rows = scores, candidates
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def search_vectors(self, queries, k=10, exact=None, candidate_ids=None):
+        np = lazy_import("numpy")
+        queries = np.asarray(queries, dtype=np.float32)
+        exact = self.centroids is None if exact is None else exact or self.centroids is None
+        if candidate_ids is not None:
+            # Reordenar un subconjunto ya filtrado (p. ej. las coincidencias estrictas del catálogo) siempre es exacto.
+            rows = sorted({self.row_of_id[product_id] for product_id in candidate_ids if product_id in self.row_of_id})
+            batches = [(queries, np.asarray(rows, dtype=np.int64))]
+        elif exact:
+            batches = [(queries, np.arange(self.count))]
+        else:
+            probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :self.nprobe]
+            batches = []
+            for query, lists in zip(queries, probes):
+                rows = np.fromiter((row for centroid in lists for row in self.lists[centroid]), dtype=np.int64)
+                batches.append((query[None, :], np.sort(rows)))
+        results = []
+        for batch_queries, rows in batches:
+            scores, best_rows = self._top_k(batch_queries, rows, k)
+            for query_scores, query_rows in zip(scores, best_rows):
+                results.append([(self.ids[row], float(score)) for score, row in zip(query_scores, query_rows) if score > -np.inf])
+        return results
+
+    def search(self, texts, k=10, exact=None, candidate_ids=None):
+        # Una consulta por texto; devuelve [(id, similitud coseno)] ordenado de mayor a menor para cada una.
+        if not len(self):
+            return [[] for _ in texts]
+        return self.search_vectors(self.embedder.embed(list(texts)), k, exact, candidate_ids)
+
+
+    def save(self, path, source_fingerprint=""):
+        # Paso offline opcional: evita embeber todo el catálogo en el primer arranque de la Lambda.
+        np = lazy_import("numpy")
+        if self.deleted:
+            self.compact()
+        metadata = {"embedder": self.embedder.name, "dim": self.embedder.dim, "source_fingerprint": source_fingerprint,
+                    "ids": self.ids, "text_hashes": [text_hash.hex() for text_hash in self.text_hashes]}
+        arrays = {"matrix": self.matrix[:self.count], "scales": self.scales[:self.count],
+                  "metadata": np.frombuffer(json.dumps(metadata, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)}
+        if self.centroids is not None:
+            arrays.update(centroids=self.centroids, assignments=self.assignments[:self.count])
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path, embedder, source_fingerprint=None, **kwargs):
+        # Devuelve None si el archivo es de otro catálogo o de otro backend de embeddings.
+        np = lazy_import("numpy")
+        with np.load(path) as data:
+            metadata = json.loads(data["metadata"].tobytes())
+            if (metadata["embedder"], metadata["dim"]) != (embedder.name, embedder.dim):
+                return None
+            if source_fingerprint is not None and metadata["source_fingerprint"] != source_fingerprint:
+                return None
+            index = cls(embedder, dtype="int8" if data["matrix"].dtype == np.int8 else "float16", **kwargs)
+            index.matrix, index.scales = data["matrix"], data["scales"]
+            index.count = len(metadata["ids"])
+            index.assignments = data["assignments"] if "assignments" in data else np.zeros(index.count, dtype=np.int32)
+            centroids = data["centroids"] if "centroids" in data else None
+        index.ids = metadata["ids"]
+        index.source_fingerprint = metadata["source_fingerprint"]
+        index.text_hashes = [bytes.fromhex(text_hash) for text_hash in metadata["text_hashes"]]
+        index.row_of_id = {product_id: row for row, product_id in enumerate(index.ids)}
+        index.active = np.ones(index.count, dtype=bool)
+        if len(index) > index.exact_max:
+            if centroids is None:
+                index._train_ivf()
+            else:
+                index.centroids, index.trained_size = centroids, index.count
+                index.lists = [set() for _ in range(len(centroids))]
+                for row, centroid in enumerate(index.assignments.tolist()):
+                    index.lists[centroid].add(row)
+        return index
+
+
+def create_embedder(backend=EMBEDDING_BACKEND, client=None):
+    if backend == "bedrock" and client is not None:
+        return BedrockEmbedder(client)
+    return HashingEmbedder()
+
+
+def _recall_at_k(approximate, exact):
+    hits = total = 0
+    for approx_hits, exact_hits in zip(approximate, exact):
+        expected = {product_id for product_id, _ in exact_hits}
+        hits += len(expected & {product_id for product_id, _ in approx_hits})
+        total += len(expected)
+    return hits / (total or 1)
+
+
+def build_index_from_json(json_path, output_path):
+    from catalog_snapshot import fingerprint_bytes
+    with open(json_path, "rb") as f:
+        raw_catalog = f.read()
+    index = VectorIndex(create_embedder())
+    index.upsert(json.loads(raw_catalog))
+    index.save(output_path, fingerprint_bytes(raw_catalog))
+    return index
+
+
+def _benchmark(sizes):
+    import tempfile
+    from catalog_index import _synthetic_catalog
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(base_dir, "products.json"), "r", encoding="utf-8") as f:
+        products = json.load(f)
+    index = VectorIndex(HashingEmbedder())
+    index.upsert(products)
+    for query in ("algo para ver películas en un cuarto pequeño", "quiero algo para salir a correr",
+                  "compara laptops para jugar y para trabajar", "algo para escuchar música sin ruido",
+                  "necesito algo para caminar en la montaña bajo la lluvia"):
+        hits = ", ".join(f"{product_id} ({score:.2f})" for product_id, score in index.search([query], k=3)[0])
+        print(f"{query!r}: {hits}")
+
+    queries = [f"{categoria} marca{i} modelo {i * 7} caracteristica {i % 13}" for i, categoria in
+               enumerate(["televisor", "laptop", "zapatillas", "botas", "camisa", "smartphone", "accesorios"] * 5)]
+    for size in sizes:
+        catalog = _synthetic_catalog(size)
+        index = VectorIndex(HashingEmbedder(), exact_max=min(RECOMMENDATION_EXACT_MAX, size // 2))
+        start = time.perf_counter()
+        index.upsert(catalog)
+        build_s = time.perf_counter() - start
+        timings = {}
+        for mode in (True, False):
+            start = time.perf_counter()
+            results = index.search(queries, k=10, exact=mode)
+            timings[mode] = ((time.perf_counter() - start) * 1000 / len(queries), results)
+        changed = [dict(product, nombre=product["nombre"] + " edición 2025") for product in catalog[:size // 100]]
+        start = time.perf_counter()
+        added, updated, unchanged = index.upsert(changed + catalog[size // 100:])
+        upsert_s = time.perf_counter() - start
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "catalog.vecidx.npz")
+            index.save(path)
+            start = time.perf_counter()
+            VectorIndex.load(path, HashingEmbedder(), exact_max=index.exact_max)
+            load_s = time.perf_counter() - start
+        print(f"{size:>8} productos: matriz {index.nbytes() / 1e6:.1f}MB ({index.matrix.dtype}), construcción {build_s:.2f}s, "
+              f"exacta {timings[True][0]:.2f}ms/consulta, IVF({len(index.centroids)} listas, nprobe={index.nprobe}) "
+              f"{timings[False][0]:.2f}ms/consulta, recall@10 IVF={_recall_at_k(timings[False][1], timings[True][1]):.0%}, "
+              f"actualización incremental de {updated} productos en {upsert_s:.2f}s, carga desde archivo {load_s:.2f}s")
+
+
+if __name__ == '__main__':
+    # Paso offline: python recommendations.py --build products.json products.vecidx.npz
+    # Benchmark:     python recommendations.py [tamaños...]
+    if len(sys.argv) >= 2 and sys.argv[1] == "--build":
+        source = sys.argv[2] if len(sys.argv) > 2 else "products.json"
+        target = sys.argv[3] if len(sys.argv) > 3 else os.path.splitext(source)[0] + ".vecidx.npz"
+        index = build_index_from_json(source, target)
+        print(f"Índice de recomendaciones '{target}' generado: {len(index)} productos, {os.path.getsize(target)} bytes.")
+    else:
+        _benchmark([int(size) for size in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import increment, log_warning
+
+
+class LRUTTLCache:
+    # Caché en proceso con tamaño acotado: expulsa la entrada menos usada y descarta las vencidas.
+    def __init__(self, max_entries=512, ttl_seconds=900, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCacheBackend:
+    # Sustituto local de una caché compartida entre contenedores (un archivo SQLite en disco). Cada `prune_every`
+    # escrituras se borran las filas vencidas y, si aún quedan más de `max_rows`, las que vencen antes.
+    def __init__(self, path, ttl_seconds=900, max_rows=10000, prune_every=256, clock=time.time):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self.clock = clock
+        self.writes = 0
+        self.lock = threading.Lock()
+        import sqlite3
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=1.0)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS agent_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS agent_cache_expires_at ON agent_cache (expires_at)")
+        self.prune()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value, expires_at FROM agent_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= self.clock():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO agent_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                                    (key, json.dumps(value), self.clock() + self.ttl_seconds))
+            self.writes += 1
+            due = self.writes % self.prune_every == 0
+        if due:
+            self.prune()
+
+    def prune(self):
+        with self.lock, self.connection:
+            expired = self.connection.execute("DELETE FROM agent_cache WHERE expires_at <= ?", (self.clock(),)).rowcount
+            excess = self.connection.execute("SELECT COUNT(*) FROM agent_cache").fetchone()[0] - self.max_rows
+            if excess > 0:
+                self.connection.execute("DELETE FROM agent_cache WHERE key IN (SELECT key FROM agent_cache ORDER BY expires_at LIMIT ?)", (excess,))
+        increment("cache.shared.pruned", expired + max(excess, 0))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM agent_cache").fetchone()[0]
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM agent_cache")
+
+
+class CacheLevel:
+    # Un nivel de caché: primero la LRU local y, si existe, el backend compartido.
+    def __init__(self, name, local, shared=None):
+        self.name = name
+        self.local = local
+        self.shared = shared
+        self.namespace = ""
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f"{self.name}:{self.namespace}:{key}"
+
+    def get(self, key):
+        full_key = self._key(key)
+        value = self.local.get(full_key)
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(full_key)
+            except Exception as e:
+                log_warning(f"Error leyendo caché compartida '{self.name}': {e}")
+                value = None
+            if value is not None:
+                self.local.set(full_key, value)
+        if value is None:
+            self.misses += 1
+            increment(f"cache.{self.name}.miss")
+        else:
+            self.hits += 1
+            increment(f"cache.{self.name}.hit")
+        return value
+
+    def set(self, key, value):
+        full_key = self._key(key)
+        self.local.set(full_key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(full_key, value)
+            except Exception as e:
+                log_warning(f"Error escribiendo caché compartida '{self.name}': {e}")
+
+    def invalidate(self, namespace=""):
+        # Las entradas compartidas de versiones anteriores del catálogo quedan inaccesibles al cambiar el namespace.
+        self.namespace = namespace
+        self.local.clear()
+
+    def stats(self):
+        return f"hits={self.hits} misses={self.misses} size={len(self.local)}"
@@ -0,0 +1,127 @@
+import re
+
+RESPONSE_PREFIXES = ["Bot:", "Respuesta:", "Respuesta del asistente:"]
+QUOTE_CHARS = ("'", '"')
+HEAD_BUFFER_CHARS = sum(len(prefix) for prefix in RESPONSE_PREFIXES) + 1
+SENTENCE_END = re.compile(r"[.!?…][\"'»)]?(?=\s)")
+# Una comilla igual a la inicial seguida de más texto: la inicial no envuelve toda la respuesta.
+QUOTE_CLOSED_EARLY = {quote: re.compile(re.escape(quote) + r"\s*\S") for quote in QUOTE_CHARS}
+
+
+def clean_response_text(text):
+    cleaned_response = text.strip()
+    for prefix in RESPONSE_PREFIXES:
+        if cleaned_response.lower().startswith(prefix.lower()):
+            cleaned_response = cleaned_response[len(prefix):].strip()
+
+    # Solo comillas que envuelven todo el texto: '"Hola" dijo él' o '"Hola" dijo "él"' se dejan igual.
+    quote = cleaned_response[:1]
+    if quote in QUOTE_CHARS and cleaned_response.endswith(quote) and quote not in cleaned_response[1:-1]:
+        cleaned_response = cleaned_response[1:-1]
+    return cleaned_response
+
+
+def chunk_text(chunk):
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+
+class StreamingResponseCleaner:
+    # Versión incremental de clean_response_text: retiene el inicio hasta poder descartar los prefijos y los
+    # espacios finales. Si la respuesta empieza con comilla retiene el texto hasta que otra comilla igual seguida
+    # de más texto muestra que no la envuelve entera; si no aparece, finish() decide con el final del texto.
+    def __init__(self):
+        self.head = ""
+        self.head_released = False
+        self.quote = None
+        self.tail = ""
+
+    def feed(self, token):
+        if not self.head_released:
+            self.head += token
+            if len(self.head.lstrip()) < HEAD_BUFFER_CHARS:
+                return ""
+            return self._release_head()
+        return self._emit(token)
+
+    def _release_head(self):
+        self.head_released = True
+        text = self.head.lstrip()
+        for prefix in RESPONSE_PREFIXES:
+            if text.lower().startswith(prefix.lower()):
+                text = text[len(prefix):].lstrip()
+        if text[:1] in QUOTE_CHARS:
+            self.quote = text[0]
+        return self._emit(text)
+
+    def _emit(self, token):
+        text = self.tail + token
+        if self.quote:
+            if not QUOTE_CLOSED_EARLY[self.quote].search(text, 1):
+                self.tail = text
+                return ""
+            self.quote = None
+        hold = len(text.rstrip())
+        self.tail = text[hold:]
+        return text[:hold]
+
+    def finish(self):
+        if not self.head_released:
+            emitted = self._release_head()
+        else:
+            emitted = ""
+        tail = self.tail.rstrip()
+        if self.quote and tail.endswith(self.quote):
+            tail = tail[1:-1]
+        self.quote = None
+        self.tail = ""
+        return emitted + tail
+
+
+class SentenceSegmenter:
+    # Agrupa el texto que llega por trozos en frases completas que ya se pueden sintetizar.
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        while True:
+            match = SENTENCE_END.search(self.buffer)
+            if not match:
+                break
+            sentence = self.buffer[:match.end()].strip()
+            self.buffer = self.buffer[match.end():]
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    def finish(self):
+        sentence = self.buffer.strip()
+        self.buffer = ""
+        return [sentence] if sentence else []
+
+
+def stream_clean(text, token_size):
+    cleaner = StreamingResponseCleaner()
+    pieces = [cleaner.feed(text[start:start + token_size]) for start in range(0, len(text), token_size)]
+    return "".join(pieces) + cleaner.finish()
+
+
+PARITY_CASES = [
+    "Hola, ¿en qué te ayudo?", "Bot: Claro.", "Respuesta: 'Tenemos botas.'", '  "Respuesta envuelta en comillas."  ',
+    '"Hola" dijo él', "'Texto con comilla' final", '"Hola" dijo "él"', "Respuesta del asistente: \"Sí\"", '"', "''",
+    'Cita al final: "ok"', '"Sin cierre', "Bot:", "",
+]
+
+
+if __name__ == '__main__':
+    # Paridad entre la limpieza incremental y clean_response_text con distintos tamaños de token.
+    for case in PARITY_CASES:
+        for token_size in (1, 2, 3, 7, 64):
+            streamed, expected = stream_clean(case, token_size), clean_response_text(case)
+            if streamed != expected:
+                raise SystemExit(f"Paridad rota para {case!r} (token de {token_size}): {streamed!r} != {expected!r}")
+    print(f"Paridad OK en {len(PARITY_CASES)} casos.")
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from instrumentation import increment, log_warning
+
+SENTENCE_BOUNDARY = re.compile(r"(?:(?<=[.!?…])|(?<=[.!?…][\"'»)]))\s+")
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text or "") if sentence.strip()]
+
+
+class AudioCache:
+    # Caché direccionada por contenido: la clave es el hash de (texto, voz, motor, formato) y el límite es en bytes.
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key_for(text, voice_id, engine, output_format):
+        return hashlib.sha256(json.dumps([text, voice_id, engine, output_format], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            audio = self.entries.get(key)
+            if audio is None:
+                self.misses += 1
+                increment("cache.tts.miss")
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            increment("cache.tts.hit")
+            return audio
+
+    def set(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self.entries[key] = audio
+            self.total_bytes += len(audio)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def stats(self):
+        return f"hits={self.hits} misses={self.misses} entries={len(self.entries)} bytes={self.total_bytes}"
+
+
+class SpeechSynthesizer:
+    def __init__(self, polly_client, voice_id, engine="standard", output_format="mp3", cache=None):
+        self.polly_client = polly_client
+        self.voice_id = voice_id
+        self.engine = engine
+        self.output_format = output_format
+        self.cache = cache
+
+    def _synthesize_uncached(self, text):
+        response = self.polly_client.synthesize_speech(
+            Text=text,
+            OutputFormat=self.output_format,
+            VoiceId=self.voice_id,
+            Engine=self.engine
+        )
+        if 'AudioStream' in response:
+            return response['AudioStream'].read()
+        return None
+
+    def synthesize(self, text):
+        if not text:
+            return None
+        if self.cache is None:
+            return self._synthesize_uncached(text)
+        key = AudioCache.key_for(text, self.voice_id, self.engine, self.output_format)
+        audio = self.cache.get(key)
+        if audio is None:
+            audio = self._synthesize_uncached(text)
+            if audio:
+                self.cache.set(key, audio)
+        return audio
+
+    def synthesize_chunks(self, text):
+        # Sintetiza frase por frase para que el primer segmento esté disponible antes que el resto.
+        for sentence in split_sentences(text):
+            audio = self.synthesize(sentence)
+            if audio:
+                yield sentence, audio
+
+    def prewarm(self, phrases):
+        warmed = 0
+        for phrase in phrases:
+            try:
+                if self.synthesize(phrase):
+                    warmed += 1
+            except Exception as e:
+                log_warning(f"Error pre-sintetizando frase estática: {e}")
+        return warmed
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Los módulos de la Lambda se importan por nombre desde src/api, igual que en el paquete desplegado.
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+
+import pytest
+import requests
+from botocore.exceptions import ReadTimeoutError
+
+import aws_clients
+from aws_clients import (AWS_CONNECT_TIMEOUT_SECONDS, BudgetExceeded, ClientFactory, _run_stub_server, abandoned_calls,
+                         build_http_session, call_within_budget, request_budget)
+
+SLOW_SECONDS = 1.5
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server, connections = _run_stub_server(0.0)
+    yield server, connections
+    server.shutdown()
+
+
+@pytest.fixture
+def slow_stub(stub):
+    server, connections = stub
+    server.delay_seconds = SLOW_SECONDS
+    connections.clear()
+    yield server, connections
+    server.delay_seconds = 0.0
+
+
+def wait_for_abandoned(count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while abandoned_calls() != count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return abandoned_calls()
+
+
+def bedrock_client(server, read_timeout, max_attempts=1):
+    factory = ClientFactory("us-east-1", endpoint_urls={"bedrock-runtime": f"http://127.0.0.1:{server.server_port}"},
+                            max_attempts=max_attempts, timeouts={"bedrock-runtime": (AWS_CONNECT_TIMEOUT_SECONDS, read_timeout)})
+    client = factory.client("bedrock-runtime")
+    return lambda: client.invoke_model(modelId="amazon.titan-text-express-v1", body=json.dumps({"inputText": "hola"}))
+
+
+def test_http_session_reuses_connections(stub):
+    server, connections = stub
+    connections.clear()
+    session = build_http_session()
+    url = f"http://127.0.0.1:{server.server_port}/transcript.json"
+    for _ in range(5):
+        assert session.get(url, timeout=(1, 1)).json()["results"]["transcripts"][0]["transcript"] == "hola"
+    assert len(connections) == 1
+
+
+def test_http_session_read_timeout(slow_stub):
+    server, connections = slow_stub
+    session = build_http_session(max_retries=1)
+    start = time.perf_counter()
+    with pytest.raises(requests.exceptions.RequestException):
+        session.get(f"http://127.0.0.1:{server.server_port}/transcript.json", timeout=(1, 0.2))
+    # Un intento más el reintento, cada uno cortado por el read timeout y no por el retardo del servidor.
+    assert time.perf_counter() - start < SLOW_SECONDS
+    assert len(connections) == 2
+
+
+def test_bedrock_client_read_timeout(slow_stub):
+    server, _ = slow_stub
+    invoke = bedrock_client(server, read_timeout=0.3)
+    start = time.perf_counter()
+    with pytest.raises(ReadTimeoutError):
+        invoke()
+    assert time.perf_counter() - start < SLOW_SECONDS
+
+
+def test_bedrock_client_succeeds_within_timeout(stub):
+    server, _ = stub
+    response = bedrock_client(server, read_timeout=1.0)()
+    assert json.loads(response["body"].read())["results"][0]["outputText"] == "Respuesta del stub."
+
+
+def test_budget_cuts_call_before_client_timeout(slow_stub):
+    server, _ = slow_stub
+    invoke = bedrock_client(server, read_timeout=5.0)
+    start = time.perf_counter()
+    with request_budget(0.3):
+        with pytest.raises(BudgetExceeded):
+            call_within_budget("llm.stub", invoke)
+    assert time.perf_counter() - start < 0.3 + 0.5
+    # La llamada abandonada sigue hasta que responde el servidor lento y después libera su hilo.
+    assert abandoned_calls() == 1
+    assert wait_for_abandoned(0, timeout=SLOW_SECONDS + 2) == 0
+
+
+def test_exhausted_budget_skips_call():
+    calls = []
+    with request_budget(0.0):
+        with pytest.raises(BudgetExceeded):
+            call_within_budget("llm.stub", calls.append, 1)
+    assert calls == []
+
+
+def test_call_without_budget_runs_inline():
+    assert call_within_budget("llm.stub", sum, [1, 2]) == 3
+
+
+def test_timed_out_call_is_tracked_until_it_finishes():
+    release = threading.Event()
+    with request_budget(0.05):
+        with pytest.raises(BudgetExceeded):
+            call_within_budget("llm.stub", release.wait, 2)
+    assert abandoned_calls() == 1
+    release.set()
+    assert wait_for_abandoned(0) == 0
+
+
+def test_saturated_budget_skips_calls(monkeypatch):
+    monkeypatch.setattr(aws_clients, "BUDGET_MAX_ABANDONED_CALLS", 1)
+    release = threading.Event()
+    calls = []
+    try:
+        with request_budget(0.05):
+            with pytest.raises(BudgetExceeded):
+                call_within_budget("llm.stub", release.wait, 2)
+        with request_budget(1.0):
+            with pytest.raises(BudgetExceeded):
+                call_within_budget("llm.stub", calls.append, 1)
+        assert calls == []
+    finally:
+        release.set()
+    assert wait_for_abandoned(0) == 0
+    with request_budget(1.0):
+        call_within_budget("llm.stub", calls.append, 1)
+    assert calls == [1]
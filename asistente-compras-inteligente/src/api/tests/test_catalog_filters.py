@@ -0,0 +1,51 @@
+import pytest
+
+from catalog_index import CatalogIndex, _synthetic_catalog, linear_search, parse_price
+
+QUERIES = [
+    {"categoria": "laptop", "precio_minimo": "500", "precio_maximo": "1.500 dólares"},
+    {"marca": "marca3", "precio_maximo": "100"},
+    {"precio_minimo": "2900"},
+    {"categoria": "camisa", "precio_minimo": "20"},
+    {"categoria": "televisor"},
+]
+
+
+def ids(products):
+    return sorted(product["id"] for product in products)
+
+
+@pytest.fixture(scope="module")
+def products():
+    return _synthetic_catalog(3000)
+
+
+@pytest.fixture(scope="module")
+def index(products):
+    return CatalogIndex(products)
+
+
+@pytest.mark.parametrize("in_stock_only", [False, True])
+@pytest.mark.parametrize("entities", QUERIES)
+def test_filters_match_linear_search(index, products, entities, in_stock_only):
+    found, total = index.search(entities, in_stock_only=in_stock_only)
+    expected = linear_search(products, entities, in_stock_only=in_stock_only)
+    assert total == len(expected)
+    assert ids(found) == ids(expected)
+
+
+def test_price_range_filters_given_rows(index, products):
+    rows = set(range(0, len(products), 7))
+    in_range = index.rows_in_price_range(100.0, 200.0, rows)
+    assert in_range == {row for row in rows if 100.0 <= products[row]["precio"] <= 200.0}
+    assert index.rows_in_price_range(100.0, 200.0) == {row for row, product in enumerate(products) if 100.0 <= product["precio"] <= 200.0}
+
+
+def test_in_stock_filters_given_rows(index, products):
+    rows = set(range(50))
+    assert index.rows_in_stock(rows) == {row for row in rows if products[row]["stock"] > 0}
+
+
+@pytest.mark.parametrize("value, expected", [("1.500 dólares", 1500.0), ("$1,299.99", 1299.99), ("99,5", 99.5), ("sin precio", None), (True, None)])
+def test_parse_price(value, expected):
+    assert parse_price(value) == expected
@@ -0,0 +1,50 @@
+import pytest
+
+from catalog_index import CatalogIndex, _synthetic_catalog, linear_search
+
+QUERIES = [
+    {"categoria": "televisor", "marca": "marca7"},
+    {"categoria": "zapatillas", "color": "negro", "talla": "40"},
+    {"nombre_producto": "modelo 42", "tamaño": "55 pulgadas"},
+    {"categoria": "botas de montaña"},
+    {"marca": "marca3"},
+]
+
+
+def ids(products):
+    return sorted(product["id"] for product in products)
+
+
+@pytest.fixture(scope="module")
+def products():
+    return _synthetic_catalog(3000)
+
+
+@pytest.fixture(scope="module")
+def index(products):
+    return CatalogIndex(products)
+
+
+@pytest.mark.parametrize("entities", QUERIES)
+def test_index_matches_linear_search(index, products, entities):
+    found, total = index.search(entities)
+    expected = linear_search(products, entities)
+    assert total == len(expected)
+    assert ids(found) == ids(expected)
+
+
+def test_limit_keeps_total_count(index, products):
+    entities = {"categoria": "televisor"}
+    found, total = index.search(entities, limit=5)
+    assert len(found) == 5
+    assert total == len(linear_search(products, entities))
+
+
+def test_results_are_ranked_by_bm25(index):
+    found, _ = index.search({"categoria": "televisor", "nombre_producto": "modelo 42"}, limit=3)
+    assert found
+    assert all("modelo 42" in product["nombre"] for product in found)
+
+
+def test_no_entities_returns_nothing(index):
+    assert index.search({}) == ([], 0)
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from catalog_index import CatalogIndex, _synthetic_catalog, linear_search
+from catalog_store import CatalogStore, LocalCatalogSource, load_catalog_version, publish_base, publish_delta
+
+QUERIES = [
+    {"categoria": "televisor", "marca": "marca7"},
+    {"categoria": "laptop", "color": "negro", "talla": "40"},
+    {"nombre_producto": "modelo 42", "tamaño": "55 pulgadas"},
+]
+
+
+def ids(products):
+    return sorted(product["id"] for product in products)
+
+
+@pytest.fixture(scope="module")
+def products():
+    return _synthetic_catalog(3000)
+
+
+@pytest.fixture(scope="module")
+def index(products):
+    return CatalogIndex(products)
+
+
+@pytest.mark.parametrize("entities", QUERIES)
+def test_delta_matches_linear_search(index, products, entities):
+    upserts = [dict(products[0], precio=999.0, stock=0), dict(products[1], categoria="laptop"),
+               {"id": "nuevo1", "nombre": "Laptop marca7 modelo 42 55 pulgadas", "categoria": "laptop",
+                "marca": "marca7", "precio": 800.0, "stock": 3, "caracteristicas": [], "colores": ["negro"],
+                "tallas_disponibles": ["40"]}]
+    deleted = [products[2]["id"], products[3]["id"]]
+    updated, stats = index.apply_delta(upserts, deleted)
+    assert stats == {"added": 1, "updated": 2, "deleted": 2}
+
+    by_id = {product["id"]: product for product in products}
+    by_id.update((product["id"], product) for product in upserts)
+    for product_id in deleted:
+        del by_id[product_id]
+    for in_stock_only in (False, True):
+        found, total = updated.search(entities, in_stock_only=in_stock_only)
+        expected = linear_search(list(by_id.values()), entities, in_stock_only=in_stock_only)
+        assert total == len(expected)
+        assert ids(found) == ids(expected)
+
+
+@pytest.fixture
+def store(tmp_path):
+    # Catálogo empaquetado en la Lambda publicado también como base del directorio de recarga.
+    products_path = tmp_path / "products.json"
+    products_path.write_text(json.dumps(_synthetic_catalog(200), ensure_ascii=False), encoding="utf-8")
+    publish_base(str(tmp_path), str(products_path))
+    calls = {"prepare": 0, "publish": 0}
+
+    def prepare(version, previous, delta):
+        calls["prepare"] += 1
+
+    def publish(version):
+        calls["publish"] += 1
+
+    current = load_catalog_version(str(products_path))
+    store = CatalogStore(LocalCatalogSource(str(tmp_path)), current, publish=publish, prepare=prepare)
+    store.calls = calls
+    return store
+
+
+def test_reload_without_deltas_skips_prepare(store):
+    current = store.current
+    assert store.reload()
+    assert store.calls == {"prepare": 0, "publish": 1}
+    # Misma base y mismos productos: solo se adopta la versión del manifiesto.
+    assert store.current.products is current.products
+    assert store.current.base_key is not None
+
+    assert not store.reload()
+    assert store.calls == {"prepare": 0, "publish": 1}
+
+
+def test_reload_prepares_once_per_delta(store):
+    store.reload()
+    product = dict(store.current.products[0], precio=1.0)
+    publish_delta(store.source.directory, {"upsert": [product], "delete": []})
+    assert store.reload()
+    assert store.calls == {"prepare": 1, "publish": 2}
+    assert store.current.index.search({"nombre_producto": product["nombre"]})[1] >= 1
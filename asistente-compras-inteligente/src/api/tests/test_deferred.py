@@ -0,0 +1,24 @@
+import asyncio
+import threading
+import time
+
+from lambda_function import DEFERRED_EXECUTOR, drain_deferred
+
+
+def test_drain_waits_for_quick_cleanup():
+    done = []
+    futures = [DEFERRED_EXECUTOR.submit(done.append, "s3.delete")]
+    asyncio.run(drain_deferred(futures, timeout=1.0))
+    assert done == ["s3.delete"]
+
+
+def test_drain_is_bounded_by_timeout():
+    release = threading.Event()
+    futures = [DEFERRED_EXECUTOR.submit(release.wait, 5)]
+    start = time.perf_counter()
+    try:
+        asyncio.run(drain_deferred(futures, timeout=0.1))
+        assert time.perf_counter() - start < 1.0
+        assert not futures[0].done()
+    finally:
+        release.set()
@@ -0,0 +1,63 @@
+import json
+import math
+import os
+
+import pytest
+
+import lambda_function
+from agent_batch import CorpusStubLLM
+from conftest import API_DIR
+from fast_nlu import FastIntentExtractor
+
+THRESHOLD = 0.8
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    with open(os.path.join(API_DIR, "nlu_fast_path_corpus.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    with open(os.path.join(API_DIR, "products.json"), "r", encoding="utf-8") as f:
+        return FastIntentExtractor(json.load(f))
+
+
+@pytest.fixture
+def llm_node(corpus, monkeypatch):
+    # Nodo NLU real contra un LLM simulado con las etiquetas del corpus; ruta rápida y caché desactivadas para no
+    # comparar la ruta rápida consigo misma.
+    labels = {item["input"]: (item["intent"], item["entities"]) for item in corpus}
+    monkeypatch.setattr(lambda_function, "llm", CorpusStubLLM(labels))
+    monkeypatch.setattr(lambda_function, "NLU_FAST_PATH_THRESHOLD", math.inf)
+    monkeypatch.setattr(lambda_function, "NLU_CACHE", None)
+
+    def interpret(text):
+        result = lambda_function.interpret_user_input_lambda({"userInput": text, "callLog": []})
+        return result["intent"], result["entities"]
+    return interpret
+
+
+def test_fast_path_agrees_with_llm_node(corpus, extractor, llm_node):
+    hits = 0
+    for item in corpus:
+        intent, entities, confidence = extractor.extract(item["input"])
+        if confidence < THRESHOLD:
+            continue
+        hits += 1
+        assert (intent, entities) == llm_node(item["input"]), item["input"]
+    # La ruta rápida tiene que cubrir una parte útil del corpus para que el acuerdo signifique algo.
+    assert hits >= len(corpus) // 2
+
+
+def test_llm_is_restored_after_agreement(corpus):
+    from nlu_agreement import llm_nlu_outputs
+    saved = lambda_function.llm, lambda_function.NLU_FAST_PATH_THRESHOLD, lambda_function.NLU_CACHE
+    llm_nlu_outputs(corpus[:3])
+    assert (lambda_function.llm, lambda_function.NLU_FAST_PATH_THRESHOLD, lambda_function.NLU_CACHE) == saved
+
+
+def test_unknown_text_falls_back_to_llm(extractor):
+    _, _, confidence = extractor.extract("cuéntame un chiste sobre astronautas")
+    assert confidence < THRESHOLD
@@ -0,0 +1,60 @@
+import pytest
+
+from instrumentation import EMF_MAX_VALUES, METRICS_NAMESPACE, InMemorySink, MetricsRecorder
+
+
+@pytest.fixture
+def recorder():
+    return MetricsRecorder(sink=InMemorySink())
+
+
+def test_flush_emits_one_emf_record(recorder):
+    with recorder.span("node.nlu"):
+        pass
+    recorder.record("tts", 12.3456)
+    recorder.record("tts", 4.0)
+    recorder.increment("cache.nlu.hit")
+    recorder.increment("cache.nlu.hit", 2)
+    recorder.set_property("requestId", "abc")
+
+    records = recorder.flush(Handler="lambda_handler")
+
+    assert records == recorder.sink.records
+    assert len(records) == 1
+    record = records[0]
+    directive = record["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == METRICS_NAMESPACE
+    assert directive["Dimensions"] == [["Handler"]]
+    assert {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]} == {
+        "node.nlu": "Milliseconds", "tts": "Milliseconds", "cache.nlu.hit": "Count"}
+    assert record["Handler"] == "lambda_handler"
+    assert record["requestId"] == "abc"
+    assert record["tts"] == [12.346, 4.0]
+    assert record["cache.nlu.hit"] == 3
+    assert record["node.nlu"] >= 0
+
+
+def test_flush_resets_and_skips_empty(recorder):
+    recorder.increment("llm.nlu.calls")
+    recorder.flush()
+    assert recorder.flush() == []
+    assert len(recorder.sink.records) == 1
+
+
+def test_zero_increment_is_not_recorded(recorder):
+    recorder.increment("llm.output_tokens", 0)
+    assert recorder.flush() == []
+
+
+def test_long_series_are_split_across_records(recorder):
+    for value in range(EMF_MAX_VALUES + 5):
+        recorder.record("tts", value)
+    recorder.increment("cache.tts.miss")
+
+    records = recorder.flush()
+
+    assert len(records) == 2
+    assert len(records[0]["tts"]) == EMF_MAX_VALUES
+    assert records[1]["tts"] == [float(value) for value in range(EMF_MAX_VALUES, EMF_MAX_VALUES + 5)]
+    assert "cache.tts.miss" not in records[1]
+    assert recorder.sink.values("tts") == [float(value) for value in range(EMF_MAX_VALUES + 5)]
@@ -0,0 +1,69 @@
+import os
+import threading
+
+import pytest
+
+import lambda_function
+from catalog_store import load_catalog_version
+from conftest import API_DIR
+from recommendations import HashingEmbedder, word_vector
+
+
+@pytest.fixture
+def catalog():
+    return load_catalog_version(os.path.join(API_DIR, "products.json"))
+
+
+def test_recommendations_fall_back_to_strict_rows_while_index_builds(catalog):
+    rows = [3, 1, 2]
+    call_log = []
+    assert lambda_function.recommend_rows(catalog, "algo para correr", {}, rows, 2, call_log) == [3, 1]
+    assert "Mode='strict_pending'" in call_log[-1]
+
+    catalog.recommender_build.result(timeout=30)
+    assert catalog.recommender is not None
+    lambda_function.recommend_rows(catalog, "algo para correr", {}, rows, 2, call_log)
+    assert "Mode='rerank'" in call_log[-1]
+
+
+def test_small_catalog_builds_recommender_on_install(catalog, monkeypatch):
+    monkeypatch.setattr(lambda_function, "CATALOG", None)
+    lambda_function.install_catalog(catalog)
+    assert catalog.recommender is not None
+    assert catalog.recommender_build is None
+    call_log = []
+    rows = lambda_function.recommend_rows(catalog, "algo para ver películas en un cuarto pequeño", {}, [], 3, call_log)
+    assert rows
+    assert "Mode='semantic'" in call_log[-1]
+
+
+def test_pending_build_falls_back_to_keyword_matches(catalog, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(lambda_function, "build_recommender", lambda version: release.wait(5) and None)
+    try:
+        call_log = []
+        rows = lambda_function.recommend_rows(catalog, "quiero unas zapatillas para correr", {}, [], 3, call_log)
+        assert rows
+        assert "Mode='keywords_pending'" in call_log[-1]
+        assert all("zapatilla" in catalog.index.products[row]["nombre"].lower() for row in rows)
+    finally:
+        release.set()
+
+
+def test_pending_build_waits_when_nothing_else_matches(catalog, monkeypatch):
+    monkeypatch.setattr(lambda_function, "RECOMMENDATION_BUILD_WAIT_SECONDS", 30.0)
+    call_log = []
+    rows = lambda_function.recommend_rows(catalog, "algo para ver películas en un cuarto pequeño", {}, [], 3, call_log)
+    assert rows
+    assert catalog.recommender is not None
+    assert "Mode='semantic'" in call_log[-1]
+
+
+def test_word_vectors_are_cached_per_dimension():
+    word_vector.cache_clear()
+    HashingEmbedder(dim=32).embed(["zapatillas para correr"])
+    HashingEmbedder(dim=32).embed(["zapatillas"])
+    HashingEmbedder(dim=64).embed(["zapatillas"])
+    info = word_vector.cache_info()
+    assert (info.hits, info.misses) == (1, 3)
+    assert word_vector(32, "zapatillas").shape == (32,)
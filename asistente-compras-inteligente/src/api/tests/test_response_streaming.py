@@ -0,0 +1,27 @@
+import pytest
+
+from response_streaming import PARITY_CASES, SentenceSegmenter, clean_response_text, stream_clean
+
+
+@pytest.mark.parametrize("token_size", [1, 2, 3, 7, 64])
+@pytest.mark.parametrize("text", PARITY_CASES)
+def test_streaming_cleaner_matches_clean_response_text(text, token_size):
+    assert stream_clean(text, token_size) == clean_response_text(text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('"Hola" dijo él', '"Hola" dijo él'),
+    ("'Texto con comilla' final", "'Texto con comilla' final"),
+    ('Bot: "Tenemos botas."', "Tenemos botas."),
+])
+def test_leading_quote_is_kept_unless_it_wraps_the_text(text, expected):
+    assert clean_response_text(text) == expected
+
+
+def test_sentence_segmenter_splits_streamed_text():
+    segmenter = SentenceSegmenter()
+    sentences = []
+    for token in ["Encontré las bo", "tas. ¿Te las ", "muestro? Claro", " que sí"]:
+        sentences += segmenter.feed(token)
+    assert sentences == ["Encontré las botas.", "¿Te las muestro?"]
+    assert segmenter.finish() == ["Claro que sí"]
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from lambda_function import AGENT_BATCH_MAX_WORKERS, parse_text_request
+
+
+def body_of(event_body):
+    return parse_text_request({'body': json.dumps(event_body)})
+
+
+@pytest.mark.parametrize("max_workers", ["muchos", None, [4], {"n": 2}])
+def test_invalid_max_workers_is_a_400(max_workers):
+    request, error = body_of({'texts': ["hola"], 'max_workers': max_workers})
+    assert request is None
+    assert error['statusCode'] == 400
+    assert 'max_workers' in json.loads(error['body'])['error']
+
+
+@pytest.mark.parametrize("max_workers, expected", [("3", 3), (0, 1), (10 ** 6, AGENT_BATCH_MAX_WORKERS)])
+def test_max_workers_is_clamped(max_workers, expected):
+    request, error = body_of({'texts': ["hola"], 'max_workers': max_workers})
+    assert error is None
+    assert request == {'texts': ["hola"], 'max_workers': expected}
+
+
+def test_single_text_request():
+    request, error = body_of({'text': "busco botas", 'session_id': "s1"})
+    assert error is None
+    assert request == {'text': "busco botas", 'session_id': "s1"}
+
+
+@pytest.mark.parametrize("raw_body", ["no es json", "{\"text\": ", b"\xff\xfe"])
+def test_body_that_is_not_json_is_a_400(raw_body):
+    request, error = parse_text_request({'body': raw_body})
+    assert request is None
+    assert error['statusCode'] == 400
+    assert 'no válido' in json.loads(error['body'])['error']
+
+
+@pytest.mark.parametrize("event_body", [["hola"], "hola", 42, None])
+def test_json_body_that_is_not_an_object_is_a_400(event_body):
+    request, error = body_of(event_body)
+    assert request is None
+    assert error['statusCode'] == 400
+    assert 'objeto' in json.loads(error['body'])['error']
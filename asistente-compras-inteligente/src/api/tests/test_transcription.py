@@ -0,0 +1,73 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from aws_clients import request_budget
+from transcription import BatchTranscribeBackend, StreamingTranscribeBackend, TranscriptionTimeout
+
+
+class RecordingBackend:
+    name = "batch"
+
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio_bytes, input_audio_format, timings=None, defer_cleanup=None):
+        self.calls.append(input_audio_format)
+        return "hola"
+
+
+def test_streaming_without_sdk_falls_back_to_batch():
+    fallback = RecordingBackend()
+    backend = StreamingTranscribeBackend("us-east-1", fallback=fallback)
+    backend.sdk_available = False
+    assert backend.transcribe(b"\x00" * 32, "pcm") == "hola"
+    assert fallback.calls == ["pcm"]
+
+
+def test_unsupported_format_falls_back_to_batch():
+    fallback = RecordingBackend()
+    backend = StreamingTranscribeBackend("us-east-1", fallback=fallback)
+    assert backend.transcribe(b"\x00" * 32, "webm") == "hola"
+    assert fallback.calls == ["webm"]
+
+
+class SlowTranscribeClient:
+    def start_transcription_job(self, **kwargs):
+        pass
+
+    def get_transcription_job(self, TranscriptionJobName):
+        return {'TranscriptionJob': {'TranscriptionJobStatus': 'IN_PROGRESS'}}
+
+
+def test_batch_deadline_is_bounded_by_request_budget():
+    backend = BatchTranscribeBackend(None, SlowTranscribeClient(), "bucket", None, initial_poll_seconds=0.05, deadline_seconds=120.0)
+    start = time.monotonic()
+    with request_budget(0.2):
+        with pytest.raises(TranscriptionTimeout, match="plazo de 0.2s"):
+            backend.transcribe_object("audio-uploads/a.webm", "webm")
+    assert time.monotonic() - start < 0.5
+
+
+def test_stalled_stream_raises_transcription_timeout(monkeypatch):
+    backend = StreamingTranscribeBackend("us-east-1")
+    backend.sdk_available = True
+
+    async def stalled_stream(audio_bytes, media_encoding, timer):
+        await asyncio.sleep(30)
+
+    monkeypatch.setattr(backend, "_transcribe_stream", stalled_stream)
+    start = time.monotonic()
+    with request_budget(0.2):
+        with pytest.raises(TranscriptionTimeout, match="streaming superó el plazo"):
+            backend.transcribe(b"\x00" * 32, "pcm")
+    assert time.monotonic() - start < 1.0
+
+
+def test_transcription_timeout_is_a_504():
+    from lambda_function import build_error_response
+    response = build_error_response(TranscriptionTimeout("Transcripción por streaming superó el plazo de 0.2s."), "lambda_handler")
+    assert response['statusCode'] == 504
+    assert "plazo" in json.loads(response['body'])['error']
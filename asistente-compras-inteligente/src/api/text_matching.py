@@ -0,0 +1,162 @@
+import os
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+FUZZY_MATCH_THRESHOLD = float(os.environ.get("FUZZY_MATCH_THRESHOLD", "0.6"))
+FUZZY_MAX_CANDIDATES = 20
+NON_ALNUM_PATTERN = re.compile(r"[^a-z0-9]+")
+STEM_CONSONANTS_BEFORE_E = set("lnrdjy")
+
+
+def stem_word(word):
+    # Plural español -> raíz común: se aplica igual al catálogo y a la consulta, así singular y plural coinciden
+    # ("colores"/"color" -> "color", "impermeables"/"impermeable" -> "impermeabl", "luces"/"luz" -> "luz").
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    if len(word) > 3 and word.endswith("ce"):
+        return word[:-2] + "z"
+    if len(word) > 3 and word.endswith("e") and word[-2] in STEM_CONSONANTS_BEFORE_E:
+        return word[:-1]
+    return word
+
+
+def normalize_key(text):
+    # casefold + sin acentos (ñ -> n) + solo letras y dígitos separados por un espacio + raíz de cada palabra.
+    return _normalize_key(text if isinstance(text, str) else str(text))
+
+
+@lru_cache(maxsize=65536)
+def _normalize_key(text):
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(stem_word(word) for word in NON_ALNUM_PATTERN.sub(" ", text).split())
+
+
+def trigrams(text):
+    # Trigramas con relleno por palabra (como pg_trgm): los bordes de palabra también cuentan como coincidencia.
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def max_edits(length):
+    return 1 if length <= 5 else 2 if length <= 10 else 3
+
+
+def edit_distance(a, b, max_distance):
+    # Levenshtein acotado: devuelve max_distance + 1 en cuanto la distancia supera el máximo.
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def best_candidate(query, query_gram_count, shared_counts, value_of, gram_count_of, threshold=FUZZY_MATCH_THRESHOLD):
+    # Entre los candidatos que comparten n-gramas con la consulta (vía postings, sin recorrer todos los valores)
+    # elige el de menor distancia de edición; se acepta si la distancia es pequeña o el coeficiente de Dice alto.
+    best = None
+    for candidate, shared in shared_counts.most_common(FUZZY_MAX_CANDIDATES):
+        value = value_of(candidate)
+        dice = 2.0 * shared / (query_gram_count + gram_count_of(candidate))
+        distance = edit_distance(query, value, max_edits(len(query)))
+        if distance > max_edits(len(query)) and dice < threshold:
+            continue
+        key = (distance, -dice, value)
+        if best is None or key < best[0]:
+            best = (key, candidate)
+    return best[1] if best is not None else None
+
+
+class TrigramIndex:
+    # Índice de trigramas sobre un conjunto de claves normalizadas (gazetteers de la NLU, colores del catálogo).
+    def __init__(self, keys=()):
+        self.keys = []
+        self.gram_counts = []
+        self.postings = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        key_id = len(self.keys)
+        grams = trigrams(key)
+        self.keys.append(key)
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(key_id)
+        return key_id
+
+    def lookup(self, query, threshold=FUZZY_MATCH_THRESHOLD):
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        key_id = best_candidate(query, len(grams), shared, self.keys.__getitem__, self.gram_counts.__getitem__, threshold)
+        return self.keys[key_id] if key_id is not None else None
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def _entity_recall(expected, found):
+    return sum(1 for key, value in expected.items() if normalize_key(found.get(key, "")) == normalize_key(value))
+
+
+if __name__ == '__main__':
+    # Recall y latencia sobre transcripciones con errores: python text_matching.py [corpus] [tamaños_catalogo...]
+    import json
+    import sys
+    import time
+    from catalog_index import CatalogIndex, _synthetic_catalog
+    from fast_nlu import FastIntentExtractor
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, "noisy_transcripts_corpus.json")
+    sizes = [int(size) for size in sys.argv[2:]] or [1000, 10000, 100000]
+    with open(os.path.join(base_dir, "products.json"), "r", encoding="utf-8") as f:
+        products = json.load(f)
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    index = CatalogIndex(products)
+    expected_entities = sum(len(item["entities"]) for item in corpus)
+    for fuzzy in (False, True):
+        extractor = FastIntentExtractor(products, fuzzy_enabled=fuzzy)
+        entity_hits = product_hits = expected_products = 0
+        elapsed_ms = 0.0
+        for item in corpus:
+            start = time.perf_counter()
+            _, entities, _ = extractor.extract(item["input"])
+            if fuzzy and entities:
+                entities = index.correct_entities(entities)[0]
+            found_rows = set(index.search_rows(entities)[0]) if entities else set()
+            elapsed_ms += (time.perf_counter() - start) * 1000
+            entity_hits += _entity_recall(item["entities"], entities)
+            expected_rows = set(index.search_rows(item["entities"])[0])
+            expected_products += len(expected_rows)
+            product_hits += len(expected_rows & found_rows)
+        print(f"{'difuso' if fuzzy else 'exacto':>6}: recall de entidades {entity_hits}/{expected_entities} ({entity_hits / expected_entities:.0%}), "
+              f"recall de productos {product_hits}/{expected_products} ({product_hits / (expected_products or 1):.0%}), "
+              f"{elapsed_ms / len(corpus):.3f}ms por frase (NLU + corrección + búsqueda)")
+
+    queries = [{"categoria": "telebisor"}, {"marca": "marca17x"}, {"nombre_producto": "modeló 42 40 pulgadaz"}, {"categoria": "laptop", "color": "negra"}]
+    for size in sizes:
+        catalog_index = CatalogIndex(_synthetic_catalog(size))
+        start = time.perf_counter()
+        catalog_index.term_keys
+        catalog_index.color_keys
+        build_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        corrections = [catalog_index.correct_entities(query)[1] for query in queries]
+        lookup_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"{size:>8} productos: corrección difusa {lookup_ms:.3f}ms/consulta (índices de trigramas en {build_ms:.1f}ms, "
+              f"{len(catalog_index.term_keys)} términos), correcciones={corrections}")
@@ -0,0 +1,208 @@
+import asyncio
+import time
+import uuid
+from functools import cached_property
+
+from aws_clients import BudgetExceeded, budget_remaining
+from cold_start import lazy_import
+from instrumentation import log_info, log_warning
+
+TRANSCRIBE_LANGUAGE_CODE = "es-US"
+STREAMING_CHUNK_BYTES = 8 * 1024
+STREAMING_ENCODINGS = {"pcm": "pcm", "wav": "pcm", "flac": "flac", "ogg": "ogg-opus", "opus": "ogg-opus"}
+
+
+class TranscriptionTimeout(BudgetExceeded):
+    # La transcripción (batch o streaming) no terminó dentro de su plazo ni del presupuesto de la petición.
+    pass
+
+
+class StageTimer:
+    # Acumula la duración (ms) de cada etapa de la transcripción: upload, queue_wait, transcription, fetch.
+    def __init__(self, timings=None):
+        self.timings = timings if timings is not None else {}
+        self.started = {}
+
+    def start(self, stage):
+        self.started[stage] = time.perf_counter()
+
+    def stop(self, stage):
+        if stage in self.started:
+            elapsed_ms = (time.perf_counter() - self.started.pop(stage)) * 1000
+            self.timings[stage] = round(self.timings.get(stage, 0.0) + elapsed_ms, 2)
+
+
+class BatchTranscribeBackend:
+    # Trabajo batch de Amazon Transcribe: subida en memoria a S3 y sondeo con backoff exponencial y plazo máximo.
+    name = "batch"
+
+    def __init__(self, s3_client, transcribe_client, bucket_name, http_session,
+                 initial_poll_seconds=0.5, max_poll_seconds=4.0, backoff_factor=1.6, deadline_seconds=120.0,
+                 fetch_timeout_seconds=10.0, sleep=time.sleep):
+        self.s3_client = s3_client
+        self.transcribe_client = transcribe_client
+        self.bucket_name = bucket_name
+        self.http_session = http_session
+        self.initial_poll_seconds = initial_poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.backoff_factor = backoff_factor
+        self.deadline_seconds = deadline_seconds
+        self.fetch_timeout_seconds = fetch_timeout_seconds
+        self.sleep = sleep
+
+    def transcribe(self, audio_bytes, input_audio_format, timings=None, defer_cleanup=None):
+        # `defer_cleanup` permite sacar el borrado del objeto S3 de la ruta crítica (se le pasa la función de limpieza).
+        timer = StageTimer(timings)
+        s3_object_key = f"transcribe-input-lambda/{uuid.uuid4()}.{input_audio_format}"
+        try:
+            timer.start("upload")
+            # put_object directo: una grabación de voz queda muy por debajo del umbral multipart, así se evitan el
+            # TransferManager y la copia del audio en un BytesIO.
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=s3_object_key, Body=audio_bytes)
+            timer.stop("upload")
+            return self._transcribe_media(s3_object_key, input_audio_format, timer)
+        finally:
+            def cleanup():
+                try: self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_object_key)
+                except Exception: pass
+            if defer_cleanup is not None:
+                defer_cleanup(cleanup)
+            else:
+                cleanup()
+
+    def transcribe_object(self, s3_object_key, input_audio_format, timings=None, defer_cleanup=None):
+        # Audio que el cliente ya subió al bucket: Transcribe lo lee de S3 sin pasar por la Lambda. El objeto no se
+        # borra aquí; lo elimina la regla de ciclo de vida del prefijo de subidas.
+        return self._transcribe_media(s3_object_key, input_audio_format, StageTimer(timings))
+
+    def _transcribe_media(self, s3_object_key, input_audio_format, timer):
+        transcription_job_name = f"LambdaTranscription-{uuid.uuid4()}"
+        timer.start("queue_wait")
+        self.transcribe_client.start_transcription_job(
+            TranscriptionJobName=transcription_job_name,
+            Media={'MediaFileUri': f"s3://{self.bucket_name}/{s3_object_key}"},
+            MediaFormat=input_audio_format,
+            LanguageCode=TRANSCRIBE_LANGUAGE_CODE
+        )
+        status = self._wait_for_job(transcription_job_name, timer)
+
+        transcript_uri = status['TranscriptionJob']['Transcript']['TranscriptFileUri']
+        timer.start("fetch")
+        response = self.http_session.get(transcript_uri, timeout=self.fetch_timeout_seconds)
+        response.raise_for_status()
+        transcript_json = response.json()
+        timer.stop("fetch")
+        return transcript_json['results']['transcripts'][0]['transcript']
+
+    def _wait_for_job(self, transcription_job_name, timer):
+        # El plazo nunca supera el presupuesto que le queda a la petición (acotado por el tiempo restante de la Lambda).
+        deadline_seconds = self.deadline_seconds
+        remaining = budget_remaining()
+        if remaining is not None:
+            deadline_seconds = max(0.0, min(deadline_seconds, remaining))
+        deadline = time.monotonic() + deadline_seconds
+        delay = self.initial_poll_seconds
+        while True:
+            status = self.transcribe_client.get_transcription_job(TranscriptionJobName=transcription_job_name)
+            job_status = status['TranscriptionJob']['TranscriptionJobStatus']
+            if job_status != 'QUEUED' and "queue_wait" in timer.started:
+                timer.stop("queue_wait")
+                timer.start("transcription")
+            if job_status in ['COMPLETED', 'FAILED']:
+                timer.stop("queue_wait")
+                timer.stop("transcription")
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TranscriptionTimeout(f"Trabajo de transcripción '{transcription_job_name}' superó el plazo de {deadline_seconds:.1f}s.")
+            self.sleep(min(delay, remaining))
+            delay = min(delay * self.backoff_factor, self.max_poll_seconds)
+        if job_status == 'FAILED':
+            raise Exception(f"Trabajo de transcripción falló: {status['TranscriptionJob'].get('FailureReason')}")
+        return status
+
+
+class StreamingTranscribeBackend:
+    # Amazon Transcribe Streaming: envía los bytes decodificados por trozos, sin archivos temporales ni S3.
+    # Requiere el paquete opcional `amazon-transcribe` (no está en requirements.txt) y audio PCM, FLAC u OGG/Opus;
+    # sin el paquete o con otro formato se usa el backend de respaldo.
+    name = "streaming"
+
+    def __init__(self, region_name, sample_rate_hz=16000, chunk_bytes=STREAMING_CHUNK_BYTES, fallback=None):
+        self.region_name = region_name
+        self.sample_rate_hz = sample_rate_hz
+        self.chunk_bytes = chunk_bytes
+        self.fallback = fallback
+
+    @cached_property
+    def sdk_available(self):
+        try:
+            lazy_import("amazon_transcribe.client")
+            lazy_import("amazon_transcribe.handlers")
+            return True
+        except ImportError:
+            fallback = f"se usa el backend '{self.fallback.name}'" if self.fallback is not None else "no hay backend de respaldo"
+            log_warning(f"TRANSCRIBE_BACKEND=streaming sin el paquete 'amazon-transcribe' en la capa; {fallback}.")
+            return False
+
+    def transcribe(self, audio_bytes, input_audio_format, timings=None, defer_cleanup=None):
+        media_encoding = STREAMING_ENCODINGS.get(input_audio_format)
+        if media_encoding is None or not self.sdk_available:
+            if self.fallback is None:
+                raise Exception(f"Transcribe Streaming no disponible para el formato '{input_audio_format}'.")
+            if media_encoding is None:
+                log_info(f"Formato '{input_audio_format}' no soportado en streaming, usando backend '{self.fallback.name}'.")
+            return self.fallback.transcribe(audio_bytes, input_audio_format, timings, defer_cleanup)
+        # Igual que el sondeo del modo batch, el stream se corta cuando se agota el presupuesto de la petición.
+        timeout = budget_remaining()
+        try:
+            return asyncio.run(asyncio.wait_for(self._transcribe_stream(audio_bytes, media_encoding, StageTimer(timings)), timeout=timeout))
+        except asyncio.TimeoutError:
+            raise TranscriptionTimeout(f"Transcripción por streaming superó el plazo de {max(timeout, 0.0):.1f}s.")
+
+    async def _transcribe_stream(self, audio_bytes, media_encoding, timer):
+        TranscribeStreamingClient = lazy_import("amazon_transcribe.client").TranscribeStreamingClient
+        TranscriptResultStreamHandler = lazy_import("amazon_transcribe.handlers").TranscriptResultStreamHandler
+
+        final_segments = []
+
+        class _FinalTranscriptHandler(TranscriptResultStreamHandler):
+            async def handle_transcript_event(self, transcript_event):
+                for result in transcript_event.transcript.results:
+                    if not result.is_partial and result.alternatives:
+                        final_segments.append(result.alternatives[0].transcript)
+
+        client = TranscribeStreamingClient(region=self.region_name)
+        timer.start("transcription")
+        stream = await client.start_stream_transcription(
+            language_code=TRANSCRIBE_LANGUAGE_CODE,
+            media_sample_rate_hz=self.sample_rate_hz,
+            media_encoding=media_encoding,
+        )
+
+        async def send_chunks():
+            timer.start("upload")
+            view = memoryview(audio_bytes)
+            for offset in range(0, len(view), self.chunk_bytes):
+                await stream.input_stream.send_audio_event(audio_chunk=bytes(view[offset:offset + self.chunk_bytes]))
+            await stream.input_stream.end_stream()
+            timer.stop("upload")
+
+        await asyncio.gather(send_chunks(), _FinalTranscriptHandler(stream.output_stream).handle_events())
+        timer.stop("transcription")
+        return " ".join(final_segments).strip()
+
+
+class StubTranscriptionBackend:
+    # Backend local para pruebas: devuelve un texto fijo o, si no hay, los bytes de audio interpretados como UTF-8.
+    name = "stub"
+
+    def __init__(self, text=None):
+        self.text = text
+
+    def transcribe(self, audio_bytes, input_audio_format, timings=None, defer_cleanup=None):
+        timer = StageTimer(timings)
+        timer.start("transcription")
+        text = self.text if self.text is not None else bytes(audio_bytes).decode("utf-8", errors="ignore")
+        timer.stop("transcription")
+        return text